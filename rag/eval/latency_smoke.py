@@ -1,15 +1,31 @@
 #!/usr/bin/env python3
 """
 Latency Smoke Test - Validación de rendimiento del pipeline RAG
-Ejecuta queries contra la API local y mide latencias p95/p99
+Ejecuta queries contra la API local y mide latencias p50/p95/p99/max, en serie
+o bajo carga (concurrencia + tasa de llegadas constante/Poisson, keep-alive);
+atribuye la latencia a cada etapa con los histogramas de /metrics
 """
+import re
 import json
+import math
 import time
+import random
 import requests
 import argparse
+import threading
 import statistics
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+_thread_state = threading.local()
+
+STAGE_METRIC = "rag_stage_duration_seconds"
+_SAMPLE_RE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
 
 def load_evalset(evalset_path: str) -> List[Dict[str, Any]]:
     """Carga el evalset desde JSONL"""
@@ -20,35 +36,53 @@ def load_evalset(evalset_path: str) -> List[Dict[str, Any]]:
                 evalset.append(json.loads(line))
     return evalset
 
-def query_api(query: str, api_url: str = "http://localhost:8000/query") -> Dict[str, Any]:
-    """Ejecuta una query contra la API RAG"""
+def get_session() -> requests.Session:
+    """Sesión HTTP del hilo actual (keep-alive: la conexión se reutiliza entre queries)"""
+    session = getattr(_thread_state, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        _thread_state.session = session
+    return session
+
+def query_api(query: str, api_url: str = "http://localhost:8000/query",
+              scheduled_at: Optional[float] = None) -> Dict[str, Any]:
+    """Ejecuta una query contra la API RAG; con scheduled_at (open-loop) la latencia
+    se mide desde el instante planificado e incluye la espera por un worker libre"""
     try:
-        start_time = time.time()
-        response = requests.post(
+        start_time = time.perf_counter()
+        if scheduled_at is None:
+            scheduled_at = start_time
+        response = get_session().post(
             api_url,
             json={"query": query},
             timeout=30
         )
-        end_time = time.time()
+        end_time = time.perf_counter()
         
-        latency_ms = (end_time - start_time) * 1000
+        latency_ms = (end_time - scheduled_at) * 1000
         
         if response.status_code == 200:
             return {
                 "success": True,
                 "latency_ms": latency_ms,
+                "queue_ms": (start_time - scheduled_at) * 1000,
+                "completed_at": end_time,
                 "response": response.json()
             }
         else:
             return {
                 "success": False,
                 "latency_ms": latency_ms,
+                "completed_at": end_time,
                 "error": f"HTTP {response.status_code}"
             }
     except requests.exceptions.RequestException as e:
         return {
             "success": False,
             "latency_ms": 0,
+            "completed_at": time.perf_counter(),
             "error": str(e)
         }
 
@@ -60,17 +94,124 @@ def calculate_percentiles(latencies: List[float], percentile: float) -> float:
     index = int((percentile / 100) * len(sorted_latencies))
     return sorted_latencies[min(index, len(sorted_latencies) - 1)]
 
+def scrape_stage_histograms(metrics_url: str, endpoint: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Histogramas por etapa del endpoint leídos de /metrics (texto Prometheus):
+    {stage: {"buckets": {le: count acumulado}, "sum": s, "count": n}}; None si no responde"""
+    try:
+        response = requests.get(metrics_url, timeout=10)
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None
+    
+    stages: Dict[str, Dict[str, Any]] = {}
+    for line in response.text.splitlines():
+        if not line.startswith(STAGE_METRIC):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if match is None:
+            continue
+        name, raw_labels, value = match.groups()
+        labels = dict(_LABEL_RE.findall(raw_labels))
+        if labels.get("endpoint") != endpoint:
+            continue
+        stage = stages.setdefault(labels["stage"], {"buckets": {}, "sum": 0.0, "count": 0.0})
+        if name.endswith("_bucket"):
+            stage["buckets"][float(labels["le"])] = float(value)
+        elif name.endswith("_sum"):
+            stage["sum"] = float(value)
+        elif name.endswith("_count"):
+            stage["count"] = float(value)
+    return stages
+
+def bucket_quantile(q: float, buckets: List[Tuple[float, float]]) -> float:
+    """Cuantil desde buckets acumulados [(le, count)] (interpolación lineal, como histogram_quantile)"""
+    if not buckets or buckets[-1][1] == 0:
+        return 0.0
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+def stage_breakdown(before: Dict[str, Dict[str, Any]], after: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Latencia por etapa (ms) de las requests entre dos lecturas de /metrics"""
+    breakdown = {}
+    for stage, current in after.items():
+        previous = before.get(stage, {"buckets": {}, "sum": 0.0, "count": 0.0})
+        count = current["count"] - previous["count"]
+        if count <= 0:
+            continue
+        buckets = [
+            (bound, cumulative - previous["buckets"].get(bound, 0.0))
+            for bound, cumulative in sorted(current["buckets"].items())
+        ]
+        breakdown[stage] = {
+            "count": int(count),
+            "avg": round((current["sum"] - previous["sum"]) / count * 1000, 2),
+            "p50": round(bucket_quantile(0.5, buckets) * 1000, 2),
+            "p99": round(bucket_quantile(0.99, buckets) * 1000, 2)
+        }
+    return breakdown
+
+def arrival_offsets(num_requests: int, qps: float, arrival: str, rng: random.Random) -> List[float]:
+    """Instantes de envío (s desde el inicio): espaciado fijo o proceso de Poisson"""
+    offsets = []
+    elapsed = 0.0
+    for _ in range(num_requests):
+        offsets.append(elapsed)
+        elapsed += rng.expovariate(qps) if arrival == "poisson" else 1.0 / qps
+    return offsets
+
+def run_load(queries: List[Dict[str, Any]], api_url: str, concurrency: int,
+             qps: Optional[float], arrival: str, seed: int = 0) -> Tuple[List[Dict[str, Any]], float]:
+    """Ejecuta las queries con `concurrency` workers. Con qps: open-loop (las llegadas
+    no esperan respuestas); sin qps: closed-loop (cada worker encadena sus queries).
+    Retorna los resultados en orden de envío y el instante base (perf_counter)"""
+    offsets = arrival_offsets(len(queries), qps, arrival, random.Random(seed)) if qps else None
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        base = time.perf_counter()
+        futures = []
+        for i, query_data in enumerate(queries):
+            scheduled_at = None
+            if offsets is not None:
+                scheduled_at = base + offsets[i]
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(query_api, query_data["query"], api_url, scheduled_at))
+        results = [future.result() for future in futures]
+    return results, base
+
 def main():
     parser = argparse.ArgumentParser(description="RAG Latency Smoke Test")
     parser.add_argument("--evalset", required=True, help="Path to evalset JSONL")
     parser.add_argument("--num_queries", type=int, default=20, help="Number of queries to test")
     parser.add_argument("--out", required=True, help="Output JSON file")
     parser.add_argument("--api_url", default="http://localhost:8000/query", help="RAG API URL")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent workers (keep-alive connection each)")
+    parser.add_argument("--qps", type=float, help="Target arrival rate (open-loop); omit for closed-loop")
+    parser.add_argument("--arrival", choices=["constant", "poisson"], default="constant", help="Arrival process with --qps")
+    parser.add_argument("--warmup", type=int, default=0, help="Warmup queries excluded from the metrics")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for Poisson arrivals")
+    parser.add_argument("--metrics_url", help="Prometheus endpoint for the per-stage breakdown (default: <api>/metrics)")
     
     args = parser.parse_args()
+    api_parts = urlsplit(args.api_url)
+    metrics_url = args.metrics_url or f"{api_parts.scheme}://{api_parts.netloc}/metrics"
+    load_mode = args.concurrency > 1 or args.qps is not None
     
     print("🚀 Starting RAG Latency Smoke Test")
     print(f"📊 Testing {args.num_queries} queries against {args.api_url}")
+    if load_mode:
+        rate = f"{args.qps:g} QPS {args.arrival}" if args.qps else "closed-loop"
+        print(f"⚡ Load: concurrency {args.concurrency}, {rate}, {args.warmup} warmup queries")
     
     # Cargar evalset
     evalset = load_evalset(args.evalset)
@@ -80,54 +221,96 @@ def main():
     
     print(f"📋 Loaded {len(evalset)} queries from evalset")
     
-    # Ejecutar queries
+    # Seleccionar queries (ciclar si es necesario); las de warmup van primero
+    total_queries = args.warmup + args.num_queries
+    queries = [evalset[i % len(evalset)] for i in range(total_queries)]
+    
+    # Ejecutar queries (las de warmup no entran en el desglose por etapa)
+    if args.warmup:
+        run_load(queries[:args.warmup], args.api_url, args.concurrency, None, args.arrival)
+    measured = queries[args.warmup:]
+    stages_before = scrape_stage_histograms(metrics_url, api_parts.path)
+    raw_results, base = run_load(measured, args.api_url, args.concurrency, args.qps, args.arrival, args.seed)
+    stages_after = scrape_stage_histograms(metrics_url, api_parts.path)
+    
     results = []
     latencies = []
+    queue_latencies = []
     successful_queries = 0
+    window_start = window_end = None
     
-    for i in range(args.num_queries):
-        # Seleccionar query (ciclar si es necesario)
-        query_data = evalset[i % len(evalset)]
+    for i, (query_data, result) in enumerate(zip(measured, raw_results)):
         query = query_data["query"]
+        completed_at = result.pop("completed_at")
+        sent_at = completed_at - result["latency_ms"] / 1000
+        window_start = sent_at if window_start is None else min(window_start, sent_at)
+        window_end = completed_at if window_end is None else max(window_end, completed_at)
         
-        print(f"🔍 Query {i+1}/{args.num_queries}: {query[:50]}...")
+        if not load_mode:
+            print(f"🔍 Query {i+1}/{args.num_queries}: {query[:50]}...")
         
-        result = query_api(query, args.api_url)
         results.append({
             "query_id": query_data["id"],
             "query": query,
+            "completed_s": round(completed_at - base, 4),
             **result
         })
         
         if result["success"]:
             latencies.append(result["latency_ms"])
+            queue_latencies.append(result["queue_ms"])
             successful_queries += 1
-            print(f"   ✅ {result['latency_ms']:.1f}ms")
-        else:
+            if not load_mode:
+                print(f"   ✅ {result['latency_ms']:.1f}ms")
+        elif not load_mode:
             print(f"   ❌ {result['error']}")
     
     # Calcular métricas
     if latencies:
         avg_latency = statistics.mean(latencies)
+        p50_latency = calculate_percentiles(latencies, 50)
         p95_latency = calculate_percentiles(latencies, 95)
         p99_latency = calculate_percentiles(latencies, 99)
         min_latency = min(latencies)
         max_latency = max(latencies)
     else:
-        avg_latency = p95_latency = p99_latency = min_latency = max_latency = 0
+        avg_latency = p50_latency = p95_latency = p99_latency = min_latency = max_latency = 0
+    
+    # QPS logrado: respuestas exitosas en la ventana medida (sin warmup)
+    elapsed_s = (window_end - window_start) if results else 0
+    achieved_qps = successful_queries / elapsed_s if elapsed_s > 0 else 0
+    
+    # Desglose por etapa (lado servidor): delta de los histogramas durante la corrida
+    stages = None
+    if stages_before is not None and stages_after is not None:
+        stages = stage_breakdown(stages_before, stages_after)
     
     # Resultados finales
     summary = {
         "total_queries": args.num_queries,
         "successful_queries": successful_queries,
         "success_rate": successful_queries / args.num_queries if args.num_queries > 0 else 0,
+        "load": {
+            "concurrency": args.concurrency,
+            "target_qps": args.qps,
+            "arrival": args.arrival if args.qps else "closed-loop",
+            "warmup_queries": args.warmup,
+            "achieved_qps": round(achieved_qps, 2),
+            "elapsed_s": round(elapsed_s, 3)
+        },
         "latency_ms": {
             "avg": round(avg_latency, 2),
+            "p50": round(p50_latency, 2),
             "p95": round(p95_latency, 2),
             "p99": round(p99_latency, 2),
             "min": round(min_latency, 2),
             "max": round(max_latency, 2)
         },
+        "queue_ms": {
+            "p50": round(calculate_percentiles(queue_latencies, 50), 2),
+            "p99": round(calculate_percentiles(queue_latencies, 99), 2)
+        },
+        "stages_ms": stages,
         "thresholds": {
             "p95_max_ms": 2500,
             "p99_max_ms": 4000,
@@ -149,11 +332,22 @@ def main():
     print("\n📊 Latency Test Results:")
     print(f"   Total queries: {summary['total_queries']}")
     print(f"   Successful: {summary['successful_queries']} ({summary['success_rate']:.1%})")
+    print(f"   Achieved QPS: {summary['load']['achieved_qps']:.2f}")
     print(f"   Average: {summary['latency_ms']['avg']:.1f}ms")
+    print(f"   P50: {summary['latency_ms']['p50']:.1f}ms")
     print(f"   P95: {summary['latency_ms']['p95']:.1f}ms")
     print(f"   P99: {summary['latency_ms']['p99']:.1f}ms")
     print(f"   Min: {summary['latency_ms']['min']:.1f}ms")
     print(f"   Max: {summary['latency_ms']['max']:.1f}ms")
+    if load_mode:
+        print(f"   Queue wait P99: {summary['queue_ms']['p99']:.1f}ms")
+    
+    if stages:
+        print(f"\n⏱️  Server stages ({metrics_url}, histogram estimates):")
+        for stage, stage_ms in sorted(stages.items(), key=lambda item: -item[1]["p99"]):
+            print(f"   {stage:<24} avg {stage_ms['avg']:>8.2f}ms  p50 {stage_ms['p50']:>8.2f}ms  p99 {stage_ms['p99']:>8.2f}ms")
+    elif stages is None:
+        print(f"\n⚠️  No per-stage breakdown: {metrics_url} not available")
     
     print("\n🎯 Thresholds:")
     print(f"   P95: {'✅' if summary['passed']['p95'] else '❌'} {summary['latency_ms']['p95']:.1f}ms <= 2500ms")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Chunk I/O - Formato de intercambio en streaming entre preprocess y embed
+JSON Lines (un chunk por línea), opcionalmente .gz/.zst; "-" = stdin/stdout
+para encadenar ambas etapas con un pipe. Los documentos borrados viajan
+como tombstones: {"tombstone": true, "metadata": {"doc_id": ...}}; un
+preprocess incremental cierra el stream con el estado de archivos que embed
+confirma en el manifest sólo tras upsertar y podar sin errores
+"""
+import io
+import sys
+import gzip
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # opcional: sólo necesario para archivos .zst
+    zstandard = None
+
+STDIO = "-"
+
+def tombstone(doc_id: str) -> Dict[str, Any]:
+    """Registro que indica que doc_id ya no existe (sus chunks deben borrarse)"""
+    return {'tombstone': True, 'metadata': {'doc_id': doc_id, 'deleted_at': datetime.now().isoformat()}}
+
+def is_tombstone(record: Dict[str, Any]) -> bool:
+    return bool(record.get('tombstone'))
+
+def file_manifest_update(manifest_path: str, source: str, config_hash: str,
+                         files: Dict[str, Tuple[int, int, str]], deleted: List[str]) -> Dict[str, Any]:
+    """Registro final de un preprocess incremental: estados de archivo procesados
+    (path -> size, mtime_ns, hash) y paths borrados, pendientes de confirmar"""
+    return {
+        'file_manifest': True,
+        'metadata': {
+            'manifest_path': manifest_path,
+            'source': source,
+            'config_hash': config_hash,
+            'files': {path: list(state) for path, state in files.items()},
+            'deleted': list(deleted)
+        }
+    }
+
+def is_file_manifest_update(record: Dict[str, Any]) -> bool:
+    return bool(record.get('file_manifest'))
+
+def _open_text(path: str, mode: str) -> IO[str]:
+    """Abre path en modo texto según su extensión (gzip/zstd/plano)"""
+    if path == STDIO:
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        return io.TextIOWrapper(stream.buffer, encoding='utf-8', write_through=True)
+
+    suffix = Path(path).suffix
+    if suffix == '.gz':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read/write .zst chunk files")
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def _release(path: str, f: IO[str]):
+    """Cierra el archivo; stdin/stdout sólo se desacoplan (siguen abiertos)"""
+    if path == STDIO:
+        f.flush()
+        f.detach()
+    else:
+        f.close()
+
+@contextmanager
+def _opened(path: str, mode: str) -> Iterator[IO[str]]:
+    f = _open_text(path, mode)
+    try:
+        yield f
+    finally:
+        _release(path, f)
+
+class ChunkWriter:
+    """Escribe chunks de a uno (JSONL compacto), sin retenerlos en memoria"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file: Optional[IO[str]] = None
+
+    def __enter__(self) -> "ChunkWriter":
+        if self.path != STDIO:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = _open_text(self.path, 'w')
+        return self
+
+    def write(self, chunk: Dict[str, Any]):
+        self._file.write(json.dumps(chunk, ensure_ascii=False, separators=(',', ':'), default=str))
+        self._file.write('\n')
+        self.count += 1
+
+    def write_many(self, chunks: Iterable[Dict[str, Any]]) -> int:
+        for chunk in chunks:
+            self.write(chunk)
+        return self.count
+
+    def __exit__(self, *exc):
+        _release(self.path, self._file)
+
+def read_chunks(path: str) -> Iterator[Dict[str, Any]]:
+    """Itera los chunks de un archivo JSONL (o del JSON array legado)"""
+    with _opened(path, 'r') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        if not first:
+            return
+
+        if first == '[':
+            # Formato anterior: un único array JSON (se carga completo)
+            yield from json.loads(first + f.read())
+            return
+
+        line = first + f.readline()
+        while line:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+            line = f.readline()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Chunking - Partición de documentos por presupuesto de tokens
+Respeta la jerarquía de separadores, solapa chunks consecutivos y trabaja con
+offsets sobre el texto original (sin concatenar strings)
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .rate_limit import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # opcional: tokenizer exacto de los modelos de OpenAI
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+TokenCounter = Callable[[str], int]
+
+def create_token_counter(embeddings_config: Dict[str, Any]) -> TokenCounter:
+    """Contador de tokens del modelo de embeddings (estimación si no hay tokenizer)"""
+    provider = embeddings_config.get('provider', 'openai')
+
+    if provider == 'openai' and tiktoken is not None:
+        model = embeddings_config.get('model', 'text-embedding-3-small')
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+    if provider == 'local':
+        local_config = embeddings_config.get('local', {})
+        try:
+            # Import diferido: el tokenizer del modelo local sólo si se usa ese proveedor
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(local_config.get('model', embeddings_config.get('model')))
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except ImportError:
+            pass
+
+    if provider != 'hash':
+        logger.warning(f"No tokenizer available for provider '{provider}'; estimating tokens from characters")
+    return estimate_tokens
+
+@dataclass
+class Span:
+    """Tramo [start, end) del texto con sus tokens; level = fuerza del corte
+    que lo cierra (índice del separador, -1 = fin del documento)"""
+    start: int
+    end: int
+    tokens: int
+    level: int
+
+@dataclass
+class TextChunk:
+    content: str
+    start: int
+    end: int
+    tokens: int
+
+class TextChunker:
+    """Chunks de a lo sumo max_tokens con overlap_tokens compartidos con el anterior"""
+
+    def __init__(self, max_tokens: int, overlap_tokens: int, separators: Sequence[str],
+                 count_tokens: TokenCounter = estimate_tokens):
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        self.separators = [separator for separator in separators if separator]
+        self.count_tokens = count_tokens
+
+    def split(self, text: str) -> List[TextChunk]:
+        spans = self._split(text, 0, len(text), 0, -1)
+        chunks: List[TextChunk] = []
+
+        i = 0
+        overlap_start: Optional[int] = None
+        overlap_tokens = 0
+        while i < len(spans):
+            # Acumular spans mientras entren en el presupuesto (al menos uno)
+            total = overlap_tokens
+            j = i
+            while j < len(spans) and (j == i or total + spans[j].tokens <= self.max_tokens):
+                total += spans[j].tokens
+                j += 1
+            cut = self._best_cut(spans, i, j, overlap_tokens) if j < len(spans) else j
+
+            # La suma por span es aproximada (el tokenizer no es aditivo): verificar el chunk real
+            start = spans[i].start if overlap_start is None else overlap_start
+            chunk = self._make_chunk(text, start, spans[cut - 1].end)
+            while chunk is not None and chunk.tokens > self.max_tokens and cut - 1 > i:
+                cut -= 1
+                chunk = self._make_chunk(text, start, spans[cut - 1].end)
+            if chunk is not None and chunk.tokens > self.max_tokens and overlap_start is not None:
+                start = spans[i].start
+                chunk = self._make_chunk(text, start, spans[cut - 1].end)
+            # Sólo overlap + espacios: no aporta nada que el anterior no tenga
+            if chunk is not None and (not chunks or chunk.end > chunks[-1].end):
+                chunks.append(chunk)
+
+            overlap_start, overlap_tokens = self._overlap(text, spans, i, cut)
+            if cut < len(spans) and overlap_tokens + spans[cut].tokens > self.max_tokens:
+                overlap_start, overlap_tokens = None, 0
+            i = cut
+
+        return chunks
+
+    def _split(self, text: str, start: int, end: int, level: int, end_level: int) -> List[Span]:
+        """Divide [start, end) con el separador más grueso que haga entrar cada tramo"""
+        tokens = self.count_tokens(text[start:end])
+        if tokens <= self.max_tokens:
+            return [Span(start, end, tokens, end_level)]
+
+        # Primer separador (desde level) presente en el tramo
+        while level < len(self.separators) and text.find(self.separators[level], start, end) == -1:
+            level += 1
+        if level == len(self.separators):
+            return self._hard_split(text, start, end, end_level)
+
+        separator = self.separators[level]
+        spans: List[Span] = []
+        position = start
+        while position < end:
+            found = text.find(separator, position, end)
+            # El separador queda al final del tramo que cierra: los tramos cubren el texto
+            segment_end = end if found == -1 else found + len(separator)
+            segment_level = end_level if segment_end == end else level
+            spans.extend(self._split(text, position, segment_end, level + 1, segment_level))
+            position = segment_end
+        return spans
+
+    def _fit(self, text: str, start: int, end: int, budget: int) -> int:
+        """Mayor fin e en (start, end] con tokens(text[start:e]) <= budget (búsqueda galopante)"""
+        low, high = start + 1, min(end, start + budget * 4)
+        while high < end and self.count_tokens(text[start:high]) <= budget:
+            low, high = high, min(end, start + (high - start) * 2)
+        if self.count_tokens(text[start:high]) <= budget:
+            return high
+        while low < high - 1:
+            middle = (low + high) // 2
+            if self.count_tokens(text[start:middle]) <= budget:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def _fit_tail(self, text: str, start: int, end: int, budget: int) -> int:
+        """Menor inicio s en [start, end) con tokens(text[s:end]) <= budget (galopando hacia atrás)"""
+        high, low = end - 1, max(start, end - budget * 4)
+        while low > start and self.count_tokens(text[low:end]) <= budget:
+            high, low = low, max(start, end - (end - low) * 2)
+        if self.count_tokens(text[low:end]) <= budget:
+            return low
+        while low < high - 1:
+            middle = (low + high) // 2
+            if self.count_tokens(text[middle:end]) <= budget:
+                high = middle
+            else:
+                low = middle
+        return high
+
+    def _hard_split(self, text: str, start: int, end: int, end_level: int) -> List[Span]:
+        """Sin separadores: cortes por presupuesto de tokens (nada se descarta)"""
+        spans: List[Span] = []
+        weakest = len(self.separators)
+        position = start
+        while position < end:
+            piece_end = self._fit(text, position, end, self.max_tokens)
+            spans.append(Span(position, piece_end, self.count_tokens(text[position:piece_end]),
+                              end_level if piece_end == end else weakest))
+            position = piece_end
+        return spans
+
+    def _best_cut(self, spans: List[Span], i: int, j: int, overlap_tokens: int) -> int:
+        """Corte más fuerte (párrafo antes que oración...) que deje el chunk al menos a medio llenar"""
+        floor = self.max_tokens // 2
+        best, best_level = j, spans[j - 1].level
+        total = overlap_tokens
+        for k in range(i, j):
+            total += spans[k].tokens
+            if total >= floor and spans[k].level <= best_level:
+                best, best_level = k + 1, spans[k].level
+        return best
+
+    def _overlap(self, text: str, spans: List[Span], i: int, cut: int):
+        """Inicio y tokens de la ventana final del chunk [i, cut) que se repite en el siguiente"""
+        if not self.overlap_tokens or cut >= len(spans):
+            return None, 0
+
+        # Spans completos desde el final (nunca el chunk entero)
+        total = 0
+        k = cut
+        while k - 1 > i and total + spans[k - 1].tokens <= self.overlap_tokens:
+            k -= 1
+            total += spans[k].tokens
+        # La suma por span es aproximada: verificar la ventana real
+        while k < cut:
+            total = self.count_tokens(text[spans[k].start:spans[cut - 1].end])
+            if total <= self.overlap_tokens:
+                return spans[k].start, total
+            k += 1
+
+        # El último span es mayor que la ventana: su cola, desde un límite de palabra
+        last = spans[cut - 1]
+        start = self._fit_tail(text, last.start, last.end, self.overlap_tokens)
+        while start > 0 and start < last.end and not text[start - 1].isspace():
+            start += 1
+        if start >= last.end:
+            return None, 0
+        return start, self.count_tokens(text[start:last.end])
+
+    def _make_chunk(self, text: str, start: int, end: int) -> Optional[TextChunk]:
+        """Chunk [start, end) sin espacios en los bordes (offsets ajustados)"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start == end:
+            return None
+        content = text[start:end]
+        return TextChunk(content, start, end, self.count_tokens(content))
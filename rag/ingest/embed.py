@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 """
 Embedding Pipeline - Crea/actualiza colección réplica con embeddings
-Genera embeddings y upserta a Qdrant con logging completo
+Genera embeddings y upserta al backend vectorial (Qdrant o local) con logging completo
 """
-import json
+import sys
+import time
+import random
 import hashlib
 import argparse
 import logging
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, Any, Optional, Set, Tuple
 from datetime import datetime
 
-import openai
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+if __package__ in (None, ''):
+    # Ejecutado como script (python rag/ingest/embed.py): registrar el paquete
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    __package__ = 'rag.ingest'
+
+from ..serve.bm25 import BM25Index
+from ..serve.embeddings import create_embedding_provider
+from ..serve.vector_store import create_vector_store
+from .chunk_io import is_file_manifest_update, is_tombstone, read_chunks
+from .manifest import ChunkKey, ChunkManifest, FileManifest
+from .rate_limit import RateLimiter, estimate_tokens
+from .upsert_log import UpsertLog
 
 # Configurar logging
 logging.basicConfig(
@@ -25,40 +40,78 @@ logger = logging.getLogger(__name__)
 class EmbeddingPipeline:
     """Pipeline de embeddings para RAG"""
     
+    # Intentos sobre un lote de varios chunks antes de partirlo en mitades
+    SPLIT_AFTER_ATTEMPTS = 2
+    # Sin BM25 ni manifest: chunk_idx consultados por documento en cada ronda al buscar sobrantes
+    SUPERSEDED_PROBE = 16
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.embeddings_config = config.get('embeddings', {})
         self.index_config = config.get('index', {})
         
-        # Configuración OpenAI
-        self.openai_client = openai.OpenAI(
-            api_key=self.embeddings_config.get('api_key') or openai.api_key
-        )
-        self.model = self.embeddings_config.get('model', 'text-embedding-3-small')
-        self.dimensions = self.embeddings_config.get('dimensions', 1536)
+        # Proveedor de embeddings (embeddings.provider: openai | local | hash)
+        self.embedding_provider = create_embedding_provider(self.embeddings_config)
+        self.model = self.embedding_provider.model
+        self.dimensions = self.embedding_provider.dimensions
         
-        # Configuración Qdrant
-        self.qdrant_url = self.index_config.get('url', 'http://localhost:6333')
+        # Backend vectorial (index.type: qdrant | local)
         self.collection_name = self.index_config.get('collection', 'quannex_docs_replica')
-        
-        self.qdrant_client = QdrantClient(url=self.qdrant_url)
+        self.vector_store = create_vector_store(self.index_config)
         
         # Configuración de batch
         self.batch_size = self.embeddings_config.get('batch_size', 100)
         self.rate_limit = self.embeddings_config.get('rate_limit', 3000)  # requests per minute
+        self.tokens_per_minute = self.embeddings_config.get('tokens_per_minute')
+        self.max_batch_tokens = self.embeddings_config.get('max_batch_tokens', 50000)
+        self.workers = max(1, self.embeddings_config.get('workers', 4))
+        self.max_retries = self.embeddings_config.get('max_retries', 5)
+        self.retry_base_s = self.embeddings_config.get('retry_base_s', 1.0)
+        self.retry_max_s = self.embeddings_config.get('retry_max_s', 30.0)
+        self.rate_limiter = RateLimiter(self.rate_limit, self.tokens_per_minute)
+        
+        # Índice léxico BM25 (se mantiene en la misma pasada que el backend vectorial)
+        self.bm25_config = config.get('bm25', {})
+        self.bm25_index_path = self.bm25_config.get('index_path')
+        self.bm25_index = self._load_bm25_index() if self.bm25_index_path else None
+        
+        # Ingesta incremental: sólo chunks nuevos/cambiados, según el manifest de hashes
+        self.ingest_config = config.get('ingest', {})
+        self.incremental = self.ingest_config.get('incremental', False)
+        self.manifest = ChunkManifest(
+            self.ingest_config.get('manifest_path', 'data/rag/ingest_manifest.sqlite'),
+            self.collection_name
+        ) if self.incremental else None
+        # Estado vivo del manifest durante una ingesta: (doc_id, chunk_idx) -> (hash, point_id)
+        self._known: Dict[ChunkKey, Tuple[str, str]] = {}
+        # Documentos con algún chunk sin indexar en la ingesta en curso
+        self._failed_docs: Set[str] = set()
         
-        # Logging de upserts
-        self.upsert_log = []
+        # Log de auditoría de upserts (se escribe en streaming si está abierto)
+        self.upsert_log: Optional[UpsertLog] = None
+    
+    def _load_bm25_index(self) -> BM25Index:
+        """Carga el índice BM25 existente o crea uno vacío"""
+        params = {
+            'k1': self.bm25_config.get('k1', 1.2),
+            'b': self.bm25_config.get('b', 0.75),
+            'epsilon': self.bm25_config.get('epsilon', 0.25),
+            'compact_ratio': self.bm25_config.get('compact_ratio', 0.2),
+        }
+        if Path(self.bm25_index_path).exists():
+            try:
+                index = BM25Index.load(self.bm25_index_path)
+                index.k1, index.b, index.epsilon = params['k1'], params['b'], params['epsilon']
+                index.compact_ratio = params['compact_ratio']
+                return index
+            except Exception as e:
+                logger.error(f"Error loading BM25 index, starting empty: {e}")
+        return BM25Index(**params)
     
     def generate_embedding(self, text: str) -> List[float]:
         """Genera embedding para un texto"""
         try:
-            response = self.openai_client.embeddings.create(
-                model=self.model,
-                input=text,
-                dimensions=self.dimensions
-            )
-            return response.data[0].embedding
+            return self.embedding_provider.embed([text])[0]
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
@@ -66,165 +119,427 @@ class EmbeddingPipeline:
     def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
         """Genera embeddings en batch para múltiples textos"""
         try:
-            response = self.openai_client.embeddings.create(
-                model=self.model,
-                input=texts,
-                dimensions=self.dimensions
-            )
-            return [data.embedding for data in response.data]
+            return self.embedding_provider.embed(texts)
         except Exception as e:
             logger.error(f"Error generating batch embeddings: {e}")
             raise
     
     def create_collection(self):
-        """Crea la colección en Qdrant si no existe"""
+        """Crea la colección en el backend vectorial si no existe"""
         try:
-            collections = self.qdrant_client.get_collections()
-            collection_names = [c.name for c in collections.collections]
-            
-            if self.collection_name not in collection_names:
-                logger.info(f"Creating collection: {self.collection_name}")
-                self.qdrant_client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(
-                        size=self.dimensions,
-                        distance=Distance.COSINE
-                    )
-                )
-                logger.info(f"✅ Collection {self.collection_name} created")
-            else:
-                logger.info(f"Collection {self.collection_name} already exists")
-                
+            self.vector_store.create_collection(self.dimensions)
         except Exception as e:
             logger.error(f"Error creating collection: {e}")
             raise
     
-    def upsert_chunks(self, chunks: List[Dict[str, Any]], replica_tag: str = None) -> Dict[str, Any]:
-        """Upserta chunks a la colección réplica"""
+    def _token_batches(self, chunks: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """Agrupa chunks en lotes acotados por número de inputs y por tokens"""
+        batch: List[Dict[str, Any]] = []
+        batch_tokens = 0
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk['content'])
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(chunk)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+    
+    def _backoff(self, attempt: int) -> float:
+        """Espera exponencial con jitter para el intento dado"""
+        delay = min(self.retry_max_s, self.retry_base_s * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+    
+    def _embed_with_retry(self, batch: List[Dict[str, Any]]) -> List[Optional[List[float]]]:
+        """Embeddings de un lote con reintentos; si el lote sigue fallando se
+        parte en mitades para aislar los chunks problemáticos (None = error)"""
+        texts = [chunk['content'] for chunk in batch]
+        tokens = sum(estimate_tokens(text) for text in texts)
+        attempts = self.max_retries + 1 if len(batch) == 1 else min(self.max_retries + 1, self.SPLIT_AFTER_ATTEMPTS)
+        
+        for attempt in range(attempts):
+            try:
+                self.rate_limiter.acquire(tokens)
+                embeddings = self.embedding_provider.embed(texts)
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"Provider returned {len(embeddings)} embeddings for {len(texts)} texts")
+                return embeddings
+            except Exception as e:
+                logger.warning(f"Embedding attempt {attempt + 1}/{attempts} failed for {len(batch)} chunks: {e}")
+                if attempt + 1 < attempts:
+                    time.sleep(self._backoff(attempt))
+        
+        if len(batch) == 1:
+            logger.error(f"❌ Giving up on chunk {batch[0]['metadata'].get('doc_id')}#{batch[0]['metadata'].get('chunk_idx')}")
+            return [None]
+        
+        middle = len(batch) // 2
+        return self._embed_with_retry(batch[:middle]) + self._embed_with_retry(batch[middle:])
+    
+    def _upsert_with_retry(self, point_ids: List[str], embeddings: List[List[float]],
+                           payloads: List[Dict[str, Any]]):
+        """Upsert al backend vectorial con reintentos exponenciales"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.vector_store.upsert(point_ids, embeddings, payloads)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Upsert attempt {attempt + 1} failed ({len(point_ids)} points): {e}")
+                time.sleep(self._backoff(attempt))
+    
+    def _write_batch(self, batch_num: int, batch: List[Dict[str, Any]],
+                     embeddings: List[Optional[List[float]]], replica_tag: str) -> Tuple[int, int, int]:
+        """Upserta un lote ya embebido; retorna (upserted, errors, lexical_changed)"""
+        embedded = [(chunk, embedding) for chunk, embedding in zip(batch, embeddings) if embedding is not None]
+        failed = len(batch) - len(embedded)
+        self._failed_docs.update(
+            chunk['metadata']['doc_id'] for chunk, embedding in zip(batch, embeddings) if embedding is None
+        )
+        if not embedded:
+            return 0, failed, 0
+        
+        # Crear puntos (id + payload) para el backend
+        point_ids = []
+        vectors = []
+        payloads = []
+        for chunk, embedding in embedded:
+            # Generar ID único
+            point_ids.append(self._generate_point_id(chunk))
+            vectors.append(embedding)
+            
+            # Metadatos del chunk
+            metadata = chunk['metadata'].copy()
+            metadata['content'] = chunk['content']
+            metadata['replica_tag'] = replica_tag
+            metadata['upserted_at'] = datetime.now().isoformat()
+            payloads.append(metadata)
+        
+        # Upsert al backend vectorial
+        logger.info(f"Upserting batch {batch_num} ({len(point_ids)} points)")
+        try:
+            self._upsert_with_retry(point_ids, vectors, payloads)
+        except Exception as e:
+            logger.error(f"❌ Error upserting batch {batch_num}: {e}")
+            self._failed_docs.update(chunk['metadata']['doc_id'] for chunk in batch)
+            return 0, len(batch), 0
+        
+        if self.manifest is not None:
+            self.manifest.record(
+                (payload['doc_id'], payload['chunk_idx'], payload['chunk_hash'], point_id, replica_tag)
+                for payload, point_id in zip(payloads, point_ids)
+            )
+            for payload, point_id in zip(payloads, point_ids):
+                self._known[(payload['doc_id'], payload['chunk_idx'])] = (payload['chunk_hash'], point_id)
+        
+        # Actualizar postings léxicos (reemplaza y marca tombstones)
+        lexical_changed = 0
+        if self.bm25_index is not None:
+            for payload in payloads:
+                if self.bm25_index.upsert(payload['content'], payload):
+                    lexical_changed += 1
+        
+        # Log de upsert (cada entrada con el timestamp de su propio payload)
+        if self.upsert_log is not None:
+            self.upsert_log.record(
+                {
+                    'point_id': point_id,
+                    'doc_id': payload['doc_id'],
+                    'chunk_idx': payload['chunk_idx'],
+                    'replica_tag': replica_tag,
+                    'content_hash': payload['chunk_hash'],
+                    'upserted_at': payload['upserted_at']
+                }
+                for payload, point_id in zip(payloads, point_ids)
+            )
+        
+        logger.info(f"✅ Batch {batch_num} upserted successfully")
+        return len(point_ids), failed, lexical_changed
+    
+    def _run_pipeline(self, chunks: Iterable[Dict[str, Any]], replica_tag: str, stats: Dict[str, int]):
+        """Embebe y upserta chunks con workers concurrentes"""
+        # Pipeline: los workers embeben los lotes siguientes mientras este hilo
+        # upserta el lote ya listo (ventana acotada a 2 lotes por worker)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed") as executor:
+            in_flight: Deque[Tuple[int, List[Dict[str, Any]], Future]] = deque()
+            numbered = enumerate(self._token_batches(chunks), 1)
+            for batch_num, batch in islice(numbered, self.workers * 2):
+                in_flight.append((batch_num, batch, executor.submit(self._embed_with_retry, batch)))
+            
+            while in_flight:
+                batch_num, batch, future = in_flight.popleft()
+                embeddings = future.result()
+                
+                for next_num, next_batch in islice(numbered, 1):
+                    in_flight.append((next_num, next_batch, executor.submit(self._embed_with_retry, next_batch)))
+                
+                upserted, errors, changed = self._write_batch(batch_num, batch, embeddings, replica_tag)
+                stats['upserted'] += upserted
+                stats['errors'] += errors
+                stats['lexical_changed'] += changed
+    
+    def _reuse_vectors(self, chunks: List[Dict[str, Any]], point_by_hash: Dict[str, ChunkKey],
+                       replica_tag: str, stats: Dict[str, int]) -> List[Dict[str, Any]]:
+        """Upserta chunks con vectores ya almacenados; retorna los que hay que embeber"""
         if not chunks:
-            logger.warning("No chunks to upsert")
-            return {"upserted": 0, "errors": 0}
+            return []
+        
+        sources = []
+        for chunk in chunks:
+            chunk_hash = chunk['metadata']['chunk_hash']
+            current = self._known.get(point_by_hash[chunk_hash])
+            # El punto de origen pudo sobrescribirse antes en esta misma ingesta
+            sources.append(current[1] if current is not None and current[0] == chunk_hash else None)
+        
+        stored = self.vector_store.get_vectors([point_id for point_id in dict.fromkeys(sources) if point_id])
+        reused = [(chunk, stored[point_id]) for chunk, point_id in zip(chunks, sources) if point_id in stored]
+        if reused:
+            upserted, errors, changed = self._write_batch(
+                0,
+                [chunk for chunk, _ in reused],
+                [vector for _, vector in reused],
+                replica_tag
+            )
+            stats['upserted'] += upserted
+            stats['errors'] += errors
+            stats['lexical_changed'] += changed
+            stats['reused_vectors'] += upserted
+        return [chunk for chunk, point_id in zip(chunks, sources) if point_id not in stored]
+    
+    def _incremental_stream(self, chunks: Iterable[Dict[str, Any]], replica_tag: str,
+                            stats: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+        """Filtra el stream contra el manifest: omite chunks sin cambios, reutiliza
+        vectores de contenido ya embebido y deja pasar sólo lo que hay que embeber"""
+        point_by_hash = {chunk_hash: key for key, (chunk_hash, _) in self._known.items()}
+        
+        reusable: List[Dict[str, Any]] = []
+        for chunk in chunks:
+            metadata = chunk['metadata']
+            key = (metadata['doc_id'], metadata['chunk_idx'])
+            current = self._known.get(key)
+            if current is not None and current[0] == metadata['chunk_hash']:
+                stats['unchanged'] += 1
+            elif metadata['chunk_hash'] in point_by_hash:
+                # Contenido ya embebido en otra posición (p.ej. chunks desplazados)
+                reusable.append(chunk)
+                if len(reusable) >= self.batch_size:
+                    yield from self._reuse_vectors(reusable, point_by_hash, replica_tag, stats)
+                    reusable = []
+            else:
+                yield chunk
+        
+        yield from self._reuse_vectors(reusable, point_by_hash, replica_tag, stats)
+    
+    def _delete_orphans(self, incoming: Set[ChunkKey], prune: bool, stats: Dict[str, int],
+                        deleted_docs: Set[str]):
+        """Borra chunks del manifest que ya no existen (con prune=False sólo
+        se consideran los documentos presentes en esta ingesta o con tombstone)"""
+        incoming_docs = {doc_id for doc_id, _ in incoming} | deleted_docs
+        orphans = [
+            key for key in self._known
+            if key not in incoming and (prune or key[0] in incoming_docs)
+        ]
+        if not orphans:
+            return
+        
+        self.vector_store.delete([self._known[key][1] for key in orphans])
+        if self.bm25_index is not None:
+            for doc_id, chunk_idx in orphans:
+                self.bm25_index.remove(doc_id, chunk_idx)
+        self.manifest.remove(orphans)
+        for key in orphans:
+            del self._known[key]
+        stats['deleted'] = len(orphans)
+        logger.info(f"🗑️ Deleted {len(orphans)} orphaned chunks")
+    
+    def _delete_superseded(self, incoming: Set[ChunkKey], stats: Dict[str, int]):
+        """Sin manifest: borra los chunks de los documentos reingestados que esta
+        corrida ya no trae (el documento se achicó); los documentos con errores
+        se conservan hasta la próxima corrida"""
+        seen: Dict[str, Set[int]] = {}
+        for doc_id, chunk_idx in incoming:
+            if doc_id not in self._failed_docs:
+                seen.setdefault(doc_id, set()).add(chunk_idx)
+        if not seen:
+            return
         
+        if self.bm25_index is not None:
+            stored = {doc_id: set(self.bm25_index.chunk_indices(doc_id)) for doc_id in seen}
+        else:
+            stored = self._probe_trailing_chunks(seen)
+        stale = [(doc_id, chunk_idx) for doc_id, indices in seen.items()
+                 for chunk_idx in stored.get(doc_id, set()) - indices]
+        if not stale:
+            return
+        
+        self.vector_store.delete([
+            self._generate_point_id({'metadata': {'doc_id': doc_id, 'chunk_idx': chunk_idx}})
+            for doc_id, chunk_idx in stale
+        ])
+        if self.bm25_index is not None:
+            for doc_id, chunk_idx in stale:
+                self.bm25_index.remove(doc_id, chunk_idx)
+        stats['deleted'] = len(stale)
+        logger.info(f"🗑️ Deleted {len(stale)} superseded chunks")
+    
+    def _probe_trailing_chunks(self, seen: Dict[str, Set[int]]) -> Dict[str, Set[int]]:
+        """chunk_idx almacenados después del último de cada documento (ids estables:
+        se consultan por ventanas contiguas hasta encontrar un hueco)"""
+        found: Dict[str, Set[int]] = {}
+        pending = {doc_id: max(indices) + 1 for doc_id, indices in seen.items()}
+        while pending:
+            probes = {
+                self._generate_point_id({'metadata': {'doc_id': doc_id, 'chunk_idx': chunk_idx}}): (doc_id, chunk_idx)
+                for doc_id, start in pending.items()
+                for chunk_idx in range(start, start + self.SUPERSEDED_PROBE)
+            }
+            stored = self.vector_store.get_vectors(list(probes))
+            hits: Dict[str, int] = {}
+            for point_id in stored:
+                doc_id, chunk_idx = probes[point_id]
+                found.setdefault(doc_id, set()).add(chunk_idx)
+                hits[doc_id] = hits.get(doc_id, 0) + 1
+            # Ventana completa: puede haber más chunks después
+            pending = {doc_id: start + self.SUPERSEDED_PROBE for doc_id, start in pending.items()
+                       if hits.get(doc_id) == self.SUPERSEDED_PROBE}
+        return found
+    
+    @staticmethod
+    def _counted(chunks: Iterable[Dict[str, Any]], stats: Dict[str, int], deleted_docs: Set[str],
+                 file_updates: List[Dict[str, Any]], incoming: Set[ChunkKey]) -> Iterator[Dict[str, Any]]:
+        """Cuenta los chunks (registrando su clave en incoming) y separa los tombstones
+        (documentos borrados en la fuente) y las actualizaciones del manifest de
+        archivos de un preprocess incremental"""
+        for chunk in chunks:
+            if is_tombstone(chunk):
+                deleted_docs.add(chunk['metadata']['doc_id'])
+                continue
+            if is_file_manifest_update(chunk):
+                file_updates.append(chunk['metadata'])
+                continue
+            stats['chunks'] += 1
+            incoming.add((chunk['metadata']['doc_id'], chunk['metadata']['chunk_idx']))
+            yield chunk
+    
+    def _commit_file_manifests(self, file_updates: List[Dict[str, Any]]):
+        """Confirma el manifest de archivos del preprocess una vez indexada la ingesta;
+        los archivos con chunks fallidos quedan pendientes para la próxima corrida"""
+        for update in file_updates:
+            states = {
+                path: tuple(state) for path, state in update['files'].items()
+                if path not in self._failed_docs
+            }
+            # Sin manifest de chunks los tombstones se ignoran: los borrados siguen pendientes
+            deleted = update['deleted'] if self.manifest is not None else []
+            manifest = FileManifest(update['manifest_path'], update['source'], update['config_hash'])
+            try:
+                manifest.commit(states, deleted)
+            finally:
+                manifest.close()
+            skipped = len(update['files']) - len(states)
+            logger.info(f"🗂️ File manifest updated: {len(states)} files, {len(deleted)} deleted"
+                        + (f", {skipped} left pending after errors" if skipped else ""))
+    
+    def upsert_chunks(self, chunks: Iterable[Dict[str, Any]], replica_tag: str = None,
+                      prune: bool = True) -> Dict[str, Any]:
+        """Upserta chunks (lista o stream) a la colección réplica (incremental si hay manifest)"""
         # Crear tag de réplica si no se proporciona
         if not replica_tag:
             replica_tag = f"ci-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
         
-        logger.info(f"Starting upsert of {len(chunks)} chunks with tag: {replica_tag}")
+        logger.info(f"Starting upsert with tag: {replica_tag} ({self.workers} embedding workers)")
         
-        upserted_count = 0
-        error_count = 0
+        stats = {"chunks": 0, "upserted": 0, "errors": 0, "lexical_changed": 0,
+                 "unchanged": 0, "reused_vectors": 0, "deleted": 0, "deleted_docs": 0}
+        deleted_docs: Set[str] = set()
+        file_updates: List[Dict[str, Any]] = []
+        self._failed_docs = set()
+        incoming: Set[ChunkKey] = set()
+        stream = self._counted(chunks, stats, deleted_docs, file_updates, incoming)
+        if self.manifest is not None:
+            self._known = self.manifest.entries()
+            stream = self._incremental_stream(stream, replica_tag, stats)
         
-        # Procesar en batches
-        for i in range(0, len(chunks), self.batch_size):
-            batch = chunks[i:i + self.batch_size]
-            batch_texts = [chunk['content'] for chunk in batch]
-            
-            try:
-                # Generar embeddings para el batch
-                logger.info(f"Generating embeddings for batch {i//self.batch_size + 1}")
-                embeddings = self.generate_embeddings_batch(batch_texts)
-                
-                # Crear puntos para Qdrant
-                points = []
-                for j, (chunk, embedding) in enumerate(zip(batch, embeddings)):
-                    # Generar ID único
-                    point_id = self._generate_point_id(chunk, replica_tag)
-                    
-                    # Metadatos del chunk
-                    metadata = chunk['metadata'].copy()
-                    metadata['replica_tag'] = replica_tag
-                    metadata['upserted_at'] = datetime.now().isoformat()
-                    
-                    point = PointStruct(
-                        id=point_id,
-                        vector=embedding,
-                        payload=metadata
-                    )
-                    points.append(point)
-                
-                # Upsert a Qdrant
-                logger.info(f"Upserting batch {i//self.batch_size + 1} ({len(points)} points)")
-                self.qdrant_client.upsert(
-                    collection_name=self.collection_name,
-                    points=points
-                )
-                
-                upserted_count += len(points)
-                
-                # Log de upsert
-                for chunk, point in zip(batch, points):
-                    self.upsert_log.append({
-                        'point_id': point.id,
-                        'doc_id': chunk['metadata']['doc_id'],
-                        'chunk_idx': chunk['metadata']['chunk_idx'],
-                        'replica_tag': replica_tag,
-                        'content_hash': chunk['metadata']['chunk_hash'],
-                        'upserted_at': metadata['upserted_at']
-                    })
-                
-                logger.info(f"✅ Batch {i//self.batch_size + 1} upserted successfully")
-                
-            except Exception as e:
-                logger.error(f"❌ Error upserting batch {i//self.batch_size + 1}: {e}")
-                error_count += len(batch)
+        self._run_pipeline(stream, replica_tag, stats)
+        
+        stats['deleted_docs'] = len(deleted_docs)
+        if not stats['chunks'] and not deleted_docs:
+            # Entrada vacía: no tocar el índice (ni podar todo como huérfano)
+            logger.warning("No chunks to upsert")
+            self._commit_file_manifests(file_updates)
+            return {**stats, "replica_tag": replica_tag, "collection": self.collection_name}
+        if deleted_docs and self.manifest is None:
+            logger.warning(f"Ignoring {len(deleted_docs)} tombstones: deleting documents requires ingest.incremental")
+        if self.manifest is not None:
+            # Con tombstones la entrada es parcial (preprocess incremental): nunca poda global
+            self._delete_orphans(incoming, prune and not deleted_docs, stats, deleted_docs)
+        else:
+            # Documentos reingestados con menos chunks: los sobrantes no se sobrescriben
+            self._delete_superseded(incoming, stats)
+        
+        # Publicar el lote para los retrievers (no-op en Qdrant)
+        self.vector_store.flush()
+        
+        if self.bm25_index is not None:
+            if stats['upserted'] or stats['deleted']:
+                self.bm25_index.replica_tag = replica_tag
+            self.bm25_index.save(self.bm25_index_path)
+            logger.info(f"📚 BM25 index updated: {stats['lexical_changed']} chunks added/replaced")
+        
+        # Último paso: sólo con upserts y poda ya aplicados se marcan los archivos como vistos
+        self._commit_file_manifests(file_updates)
         
         result = {
-            "upserted": upserted_count,
-            "errors": error_count,
+            **stats,
+            "rate_limit_wait_s": round(self.rate_limiter.waited_s, 3),
             "replica_tag": replica_tag,
             "collection": self.collection_name,
             "upserted_at": datetime.now().isoformat()
         }
         
-        logger.info(f"📊 Upsert completed: {upserted_count} successful, {error_count} errors")
+        logger.info(f"📊 Upsert completed: {stats['upserted']} successful, {stats['errors']} errors")
         return result
     
-    def _generate_point_id(self, chunk: Dict[str, Any], replica_tag: str) -> str:
-        """Genera ID único para el punto"""
+    @staticmethod
+    def _generate_point_id(chunk: Dict[str, Any]) -> str:
+        """ID estable por (doc_id, chunk_idx): reingestar sobrescribe el punto en su
+        sitio en vez de duplicarlo (replica_tag y chunk_hash viajan en el payload)"""
         doc_id = chunk['metadata']['doc_id']
         chunk_idx = chunk['metadata']['chunk_idx']
-        content_hash = chunk['metadata']['chunk_hash']
-        
-        # Crear ID único combinando doc_id, chunk_idx, replica_tag y hash
-        id_string = f"{doc_id}:{chunk_idx}:{replica_tag}:{content_hash}"
-        return hashlib.md5(id_string.encode()).hexdigest()
-    
-    def save_upsert_log(self, output_path: str):
-        """Guarda el log de upserts"""
-        log_data = {
-            "summary": {
-                "total_upserts": len(self.upsert_log),
-                "timestamp": datetime.now().isoformat()
-            },
-            "upserts": self.upsert_log
-        }
-        
-        with open(output_path, 'w') as f:
-            json.dump(log_data, f, indent=2)
-        
-        logger.info(f"💾 Upsert log saved to {output_path}")
+        return hashlib.md5(f"{doc_id}:{chunk_idx}".encode()).hexdigest()
+    
+    @contextmanager
+    def open_upsert_log(self, output_path: str) -> Iterator[UpsertLog]:
+        """Abre el log de upserts (JSONL en streaming, .gz/.zst comprimen); el
+        footer con el resumen se escribe al salir del bloque with, y a partir de
+        ahí el pipeline deja de registrar en él"""
+        with UpsertLog(output_path) as upsert_log:
+            self.upsert_log = upsert_log
+            try:
+                yield upsert_log
+            finally:
+                self.upsert_log = None
     
     def get_collection_info(self) -> Dict[str, Any]:
         """Obtiene información de la colección"""
         try:
-            collection_info = self.qdrant_client.get_collection(self.collection_name)
-            return {
-                "name": collection_info.config.params.vectors.size,
-                "vectors_count": collection_info.vectors_count,
-                "points_count": collection_info.points_count,
-                "status": collection_info.status
-            }
+            return self.vector_store.info()
         except Exception as e:
             logger.error(f"Error getting collection info: {e}")
             return {}
 
 def main():
     parser = argparse.ArgumentParser(description="RAG Embedding Pipeline")
-    parser.add_argument("--chunks", required=True, help="Input chunks JSON file")
-    parser.add_argument("--output", required=True, help="Output upsert log JSON file")
+    parser.add_argument("--chunks", required=True, help="Input chunks JSONL/JSON file (.gz/.zst supported, - for stdin)")
+    parser.add_argument("--output", required=True, help="Output upsert log JSONL file (.gz/.zst to compress)")
     parser.add_argument("--config", default="rag/config/retrieval.yaml", help="Config file")
     parser.add_argument("--replica-tag", help="Replica tag (auto-generated if not provided)")
     parser.add_argument("--api-key", help="OpenAI API key")
+    parser.add_argument("--provider", choices=["openai", "local", "hash"], help="Override embeddings.provider")
+    parser.add_argument("--incremental", action="store_true", help="Skip unchanged chunks using the ingest manifest")
+    parser.add_argument("--no-prune", action="store_true", help="Only delete orphans of documents present in the input")
     
     args = parser.parse_args()
     
@@ -236,10 +551,10 @@ def main():
     # Override API key si se proporciona
     if args.api_key:
         config['embeddings']['api_key'] = args.api_key
-    
-    # Cargar chunks
-    with open(args.chunks, 'r') as f:
-        chunks = json.load(f)
+    if args.provider:
+        config['embeddings']['provider'] = args.provider
+    if args.incremental:
+        config.setdefault('ingest', {})['incremental'] = True
     
     # Crear pipeline
     pipeline = EmbeddingPipeline(config)
@@ -247,23 +562,34 @@ def main():
     # Crear colección
     pipeline.create_collection()
     
-    # Upsert chunks
-    result = pipeline.upsert_chunks(chunks, args.replica_tag)
-    
-    # Guardar log
-    pipeline.save_upsert_log(args.output)
+    # Upsert chunks (leídos en streaming); la salida de un preprocess incremental
+    # sólo trae archivos cambiados: podar únicamente sus documentos
+    partial_input = config.get('preprocess', {}).get('incremental', False)
+    with pipeline.open_upsert_log(args.output) as upsert_log:
+        result = pipeline.upsert_chunks(read_chunks(args.chunks), args.replica_tag,
+                                        prune=not (args.no_prune or partial_input))
+        upsert_log.summary.update(result)
+    logger.info(f"💾 Upsert log saved to {args.output}")
     
     # Mostrar resumen
     collection_info = pipeline.get_collection_info()
     
     print("\n📊 Embedding Pipeline Results:")
-    print(f"   Chunks processed: {len(chunks)}")
+    print(f"   Chunks processed: {result['chunks']}")
     print(f"   Upserted: {result['upserted']}")
     print(f"   Errors: {result['errors']}")
+    if pipeline.incremental:
+        print(f"   Unchanged: {result['unchanged']}")
+        print(f"   Reused vectors: {result['reused_vectors']}")
+        print(f"   Deleted orphans: {result['deleted']}")
+        print(f"   Deleted documents: {result['deleted_docs']}")
+    else:
+        print(f"   Deleted superseded: {result['deleted']}")
     print(f"   Replica tag: {result['replica_tag']}")
     print(f"   Collection: {result['collection']}")
     
     if collection_info:
+        print(f"   Collection backend: {collection_info.get('backend', 'unknown')}")
         print(f"   Collection vectors: {collection_info.get('vectors_count', 'unknown')}")
         print(f"   Collection points: {collection_info.get('points_count', 'unknown')}")
     
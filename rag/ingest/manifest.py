@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Chunk Manifest - Estado persistente de la ingesta incremental
+(colección, doc_id, chunk_idx) -> chunk_hash + point_id en SQLite, para
+embeber sólo chunks nuevos/cambiados y detectar huérfanos; y
+(fuente, path) -> size/mtime/hash para preprocesar sólo archivos cambiados
+"""
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ChunkKey = Tuple[str, int]
+
+class ChunkManifest:
+    """Manifest de chunks indexados por colección"""
+
+    def __init__(self, path: str, collection_name: str):
+        self.path = path
+        self.collection_name = collection_name
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "collection TEXT NOT NULL, doc_id TEXT NOT NULL, chunk_idx INTEGER NOT NULL, "
+            "chunk_hash TEXT NOT NULL, point_id TEXT NOT NULL, replica_tag TEXT, updated_at TEXT NOT NULL, "
+            "PRIMARY KEY (collection, doc_id, chunk_idx))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_by_hash ON chunks (collection, chunk_hash)")
+        self._conn.commit()
+
+    def entries(self) -> Dict[ChunkKey, Tuple[str, str]]:
+        """(doc_id, chunk_idx) -> (chunk_hash, point_id) de la colección"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, chunk_idx, chunk_hash, point_id FROM chunks WHERE collection = ?",
+                (self.collection_name,)
+            ).fetchall()
+        return {(doc_id, chunk_idx): (chunk_hash, point_id) for doc_id, chunk_idx, chunk_hash, point_id in rows}
+
+    def record(self, rows: Iterable[Tuple[str, int, str, str, Optional[str]]]):
+        """Registra chunks ya upsertados: (doc_id, chunk_idx, chunk_hash, point_id, replica_tag)"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks "
+                "(collection, doc_id, chunk_idx, chunk_hash, point_id, replica_tag, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self.collection_name, doc_id, chunk_idx, chunk_hash, point_id, replica_tag, now)
+                 for doc_id, chunk_idx, chunk_hash, point_id, replica_tag in rows]
+            )
+            self._conn.commit()
+
+    def remove(self, keys: List[ChunkKey]):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE collection = ? AND doc_id = ? AND chunk_idx = ?",
+                [(self.collection_name, doc_id, chunk_idx) for doc_id, chunk_idx in keys]
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chunks WHERE collection = ?", (self.collection_name,)
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# (size, mtime_ns, content_hash) de un archivo fuente
+FileState = Tuple[int, int, str]
+
+class FileManifest:
+    """Manifest de archivos fuente por directorio: detecta cambios sin releerlos.
+    Guarda el hash de la config de limpieza/chunking con que se procesaron:
+    si cambia, ningún estado registrado sirve para saltarse un archivo"""
+
+    def __init__(self, path: str, source: str, config_hash: Optional[str] = None):
+        self.path = path
+        self.source = source
+        self.config_hash = config_hash
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "source TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "content_hash TEXT NOT NULL, updated_at TEXT NOT NULL, "
+            "PRIMARY KEY (source, path))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, config_hash TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def config_matches(self) -> bool:
+        """¿Los estados registrados se produjeron con la config actual?"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT config_hash FROM sources WHERE source = ?", (self.source,)
+            ).fetchone()
+        if row is None:
+            # Manifest vacío (primera corrida) o anterior al hash de config
+            return len(self) == 0
+        return row[0] == self.config_hash
+
+    def entries(self) -> Dict[str, FileState]:
+        """path -> (size, mtime_ns, content_hash) del directorio fuente"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, content_hash FROM files WHERE source = ?",
+                (self.source,)
+            ).fetchall()
+        return {path: (size, mtime_ns, content_hash) for path, size, mtime_ns, content_hash in rows}
+
+    def record(self, states: Dict[str, FileState]):
+        """Registra el estado de archivos ya procesados (o sólo tocados)"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (source, path, size, mtime_ns, content_hash, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(self.source, path, size, mtime_ns, content_hash, now)
+                 for path, (size, mtime_ns, content_hash) in states.items()]
+            )
+            self._conn.commit()
+
+    def remove(self, paths: List[str]):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM files WHERE source = ? AND path = ?",
+                [(self.source, path) for path in paths]
+            )
+            self._conn.commit()
+
+    def commit(self, states: Dict[str, FileState], deleted: List[str]):
+        """Confirma una corrida (ya indexada): estados procesados, paths borrados y
+        la config con que se procesaron; con otra config se descartan los estados previos"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "SELECT config_hash FROM sources WHERE source = ?", (self.source,)
+                ).fetchone()
+                if row is None or row[0] != self.config_hash:
+                    self._conn.execute("DELETE FROM files WHERE source = ?", (self.source,))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (source, path, size, mtime_ns, content_hash, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.source, path, size, mtime_ns, content_hash, now)
+                     for path, (size, mtime_ns, content_hash) in states.items()]
+                )
+                self._conn.executemany(
+                    "DELETE FROM files WHERE source = ? AND path = ?",
+                    [(self.source, path) for path in deleted]
+                )
+                if self.config_hash is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO sources (source, config_hash) VALUES (?, ?)",
+                        (self.source, self.config_hash)
+                    )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM files WHERE source = ?", (self.source,)
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -3,24 +3,146 @@
 Preprocessor para documentos RAG - Limpieza y preparación de contenido
 Limpia MD/HTML, quita navegación, TOCs duplicados, y normaliza metadatos
 """
+import io
+import os
 import re
+import sys
+import json
 import hashlib
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 import frontmatter
 import markdown
 
+if __package__ in (None, ''):
+    # Ejecutado como script (python rag/ingest/preprocess.py): registrar el paquete
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+    __package__ = 'rag.ingest'
+
+from .chunk_io import STDIO, ChunkWriter, file_manifest_update, tombstone
+from .chunking import TextChunk, TextChunker, create_token_counter
+from .manifest import FileManifest, FileState
+from .rate_limit import estimate_tokens
+
+# Archivos procesables (antes: un glob por patrón, con solapamientos posibles)
+FILE_PATTERNS = ['**/*.md', '**/*.markdown', '**/*.txt']
+
+def glob_to_regex(pattern: str) -> "re.Pattern[str]":
+    """Traduce un glob con ** (rutas relativas, separador /) a regex"""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
+
+class CleanupEngine:
+    """Reglas de limpieza precompiladas una vez (antes: re.sub por regla y por documento)
+
+    Las reglas de línea (^...$ con MULTILINE, reemplazo vacío, terminadas en '.*$') se
+    anclan en un '\\n' literal: el motor busca el literal en vez de probar '^' en cada
+    posición. Cada regla sigue siendo su propia pasada, en el orden declarado: el texto
+    que deja una regla puede coincidir con la siguiente (p.ej. un \\s* que cruza la
+    línea recién vaciada), así que no se fusionan en una alternación.
+    """
+
+    LINE_FLAGS = re.MULTILINE | re.IGNORECASE
+
+    MULTISPACE = re.compile(r'  +')
+
+    def __init__(self, rules: List[Tuple[str, str, int]]):
+        self.passes: List[Tuple["re.Pattern[str]", str, bool]] = []
+        for pattern, replacement, flags in rules:
+            if self._is_line_rule(pattern, replacement, flags):
+                self.passes.append((re.compile(r'\n(?:' + pattern[1:] + ')', flags), '\n', True))
+            else:
+                self.passes.append((re.compile(pattern, flags), replacement, False))
+
+    @classmethod
+    def _is_line_rule(cls, pattern: str, replacement: str, flags: int) -> bool:
+        return (pattern.startswith('^') and pattern.endswith('.*$') and replacement == ''
+                and bool(flags & re.MULTILINE) and not flags & ~cls.LINE_FLAGS)
+
+    def clean(self, content: str) -> str:
+        for regex, replacement, line_anchored in self.passes:
+            if line_anchored:
+                # '\n' inicial: la primera línea también queda precedida por el literal
+                content = regex.sub(replacement, '\n' + content)[1:]
+            else:
+                content = regex.sub(replacement, content)
+
+        # Limpieza final y normalización de espacios ([ \t]+ -> ' ', sin espacio tras salto)
+        content = content.strip().replace('\t', ' ')
+        content = self.MULTISPACE.sub(' ', content)
+        return content.replace('\n ', '\n')
+
+# Preprocesador de cada proceso del pool (creado una vez por worker)
+_worker_preprocessor: Optional["DocumentPreprocessor"] = None
+
+def _init_worker(config: Dict[str, Any]):
+    global _worker_preprocessor
+    _worker_preprocessor = DocumentPreprocessor(config)
+
+def _process_in_worker(file_path: str) -> Tuple[List[Dict[str, Any]], bool, str]:
+    """Procesa un archivo en un worker; el progreso se captura y lo imprime el padre en orden"""
+    output = io.StringIO()
+    with redirect_stdout(output):
+        chunks, ok = _worker_preprocessor._process_file(Path(file_path))
+    return chunks, ok, output.getvalue()
+
 class DocumentPreprocessor:
     """Preprocesador de documentos para pipeline RAG"""
     
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.chunking_config = config.get('chunking', {})
-        self.max_chars = self.chunking_config.get('max_chars', 1200)
-        self.overlap = self.chunking_config.get('overlap', 120)
         self.separators = self.chunking_config.get('separators', ['\n\n', '\n', '. ', ' ', ''])
         
+        # Presupuesto en tokens del modelo de embeddings (configs previas: max_chars/overlap en caracteres)
+        self.max_tokens = self.chunking_config.get('max_tokens') or self.chunking_config.get('max_chars', 1200) // 4
+        self.overlap_tokens = self.chunking_config.get('overlap_tokens')
+        if self.overlap_tokens is None:
+            self.overlap_tokens = self.chunking_config.get('overlap', 120) // 4
+        self.chunker = TextChunker(
+            self.max_tokens,
+            self.overlap_tokens,
+            self.separators,
+            create_token_counter(config.get('embeddings', {}))
+        )
+        
+        # Paralelismo (0 = un worker por CPU, 1 = serial)
+        self.preprocess_config = config.get('preprocess', {})
+        self.workers = self.preprocess_config.get('workers', 0) or os.cpu_count() or 1
+        self.task_chunksize = self.preprocess_config.get('task_chunksize', 16)
+        
+        # Incremental: sólo archivos nuevos/cambiados según el manifest de archivos
+        self.incremental = self.preprocess_config.get('incremental', False)
+        self.manifest_path = self.preprocess_config.get('manifest_path', 'data/rag/file_manifest.sqlite')
+        
+        # Globs de exclusión de las fuentes, aplicados durante el recorrido
+        self.include_patterns = [glob_to_regex(pattern) for pattern in FILE_PATTERNS]
+        self.exclude_patterns = [
+            glob_to_regex(pattern)
+            for source in config.get('sources', []) if isinstance(source, dict)
+            for pattern in source.get('exclude', [])
+        ]
+        
         # Regex patterns para limpieza
         self.cleanup_patterns = [
             # Navegación y TOCs
@@ -50,20 +172,24 @@ class DocumentPreprocessor:
             # Caracteres de control
             (r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', re.MULTILINE),
         ]
+        self.cleanup_engine = CleanupEngine(self.cleanup_patterns)
+        
+        # Huella de todo lo que determina los chunks de un archivo: si cambia, el
+        # manifest de archivos deja de valer y se reprocesa todo
+        embeddings_config = config.get('embeddings', {})
+        self.config_hash = hashlib.sha256(json.dumps({
+            'cleanup': self.cleanup_patterns,
+            'max_tokens': self.max_tokens,
+            'overlap_tokens': self.overlap_tokens,
+            'separators': self.separators,
+            'tokenizer': [embeddings_config.get('provider'), embeddings_config.get('model'),
+                          embeddings_config.get('local', {}).get('model'),
+                          self.chunker.count_tokens is estimate_tokens]
+        }, sort_keys=True).encode('utf-8')).hexdigest()
     
     def clean_content(self, content: str) -> str:
         """Limpia el contenido del documento"""
-        for pattern, replacement, flags in self.cleanup_patterns:
-            content = re.sub(pattern, replacement, content, flags=flags)
-        
-        # Limpieza final
-        content = content.strip()
-        
-        # Normalizar espacios
-        content = re.sub(r'[ \t]+', ' ', content)
-        content = re.sub(r'\n ', '\n', content)
-        
-        return content
+        return self.cleanup_engine.clean(content)
     
     def extract_metadata(self, file_path: Path, content: str) -> Dict[str, Any]:
         """Extrae metadatos del documento"""
@@ -99,69 +225,37 @@ class DocumentPreprocessor:
         }
     
     def semantic_chunk(self, content: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Chunking semántico del contenido"""
-        chunks = []
-        
-        # Estrategia: dividir por separadores jerárquicos
-        text = content
-        
-        # Primero dividir por párrafos dobles
-        paragraphs = re.split(r'\n\s*\n', text)
-        
-        current_chunk = ""
-        chunk_idx = 0
-        
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if not paragraph:
-                continue
-            
-            # Si agregar este párrafo excede el límite, crear chunk actual
-            if current_chunk and len(current_chunk) + len(paragraph) + 2 > self.max_chars:
-                if current_chunk:
-                    chunks.append(self._create_chunk(current_chunk, chunk_idx, metadata))
-                    chunk_idx += 1
-                    current_chunk = paragraph
-                else:
-                    # Párrafo muy largo, dividir por oraciones
-                    sentences = re.split(r'[.!?]+\s+', paragraph)
-                    for sentence in sentences:
-                        if len(current_chunk) + len(sentence) + 1 > self.max_chars:
-                            if current_chunk:
-                                chunks.append(self._create_chunk(current_chunk, chunk_idx, metadata))
-                                chunk_idx += 1
-                                current_chunk = sentence
-                            else:
-                                # Oración muy larga, truncar
-                                chunks.append(self._create_chunk(sentence[:self.max_chars], chunk_idx, metadata))
-                                chunk_idx += 1
-                        else:
-                            current_chunk += (" " if current_chunk else "") + sentence
-            else:
-                current_chunk += ("\n\n" if current_chunk else "") + paragraph
-        
-        # Agregar último chunk si existe
-        if current_chunk:
-            chunks.append(self._create_chunk(current_chunk, chunk_idx, metadata))
-        
-        return chunks
+        """Chunking semántico del contenido: presupuesto de tokens, cortes por la
+        jerarquía de separadores y solapamiento real entre chunks consecutivos"""
+        return [
+            self._create_chunk(chunk, chunk_idx, metadata)
+            for chunk_idx, chunk in enumerate(self.chunker.split(content))
+        ]
     
-    def _create_chunk(self, content: str, chunk_idx: int, metadata: Dict[str, Any]) -> Dict[str, Any]:
-        """Crea un chunk con metadatos"""
+    def _create_chunk(self, chunk: TextChunk, chunk_idx: int, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Crea un chunk con metadatos (offsets sobre el contenido limpio)"""
         chunk_metadata = metadata.copy()
         chunk_metadata.update({
             'chunk_idx': chunk_idx,
-            'chunk_size': len(content),
-            'chunk_hash': hashlib.sha256(content.encode('utf-8')).hexdigest()
+            'chunk_size': len(chunk.content),
+            'chunk_tokens': chunk.tokens,
+            'char_start': chunk.start,
+            'char_end': chunk.end,
+            'chunk_hash': hashlib.sha256(chunk.content.encode('utf-8')).hexdigest()
         })
         
         return {
-            'content': content,
+            'content': chunk.content,
             'metadata': chunk_metadata
         }
     
     def process_file(self, file_path: Path) -> List[Dict[str, Any]]:
         """Procesa un archivo individual"""
+        chunks, _ = self._process_file(file_path)
+        return chunks
+    
+    def _process_file(self, file_path: Path) -> Tuple[List[Dict[str, Any]], bool]:
+        """Como process_file, indicando además si terminó sin error"""
         try:
             # Leer archivo
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -177,24 +271,135 @@ class DocumentPreprocessor:
             chunks = self.semantic_chunk(cleaned_content, metadata)
             
             print(f"✅ Processed {file_path}: {len(chunks)} chunks")
-            return chunks
+            return chunks, True
             
         except Exception as e:
             print(f"❌ Error processing {file_path}: {e}")
-            return []
+            return [], False
     
-    def process_directory(self, source_dir: Path) -> List[Dict[str, Any]]:
-        """Procesa todos los archivos en un directorio"""
-        all_chunks = []
+    def _excluded(self, relative_path: str) -> bool:
+        return any(pattern.match(relative_path) for pattern in self.exclude_patterns)
+    
+    def discover_files(self, source_dir: Path) -> Iterator[Path]:
+        """Recorre source_dir en orden determinista, podando directorios excluidos;
+        cada archivo se emite una sola vez aunque coincida con varios patrones"""
+        seen = set()
+        for root, dirnames, filenames in os.walk(source_dir):
+            relative_root = Path(root).relative_to(source_dir).as_posix()
+            prefix = '' if relative_root == '.' else relative_root + '/'
+            
+            # Podar en el walk: no se desciende a node_modules/.git/...
+            dirnames[:] = sorted(name for name in dirnames if not self._excluded(f"{prefix}{name}/"))
+            
+            for filename in sorted(filenames):
+                relative_path = prefix + filename
+                if self._excluded(relative_path):
+                    continue
+                if not any(pattern.match(relative_path) for pattern in self.include_patterns):
+                    continue
+                file_path = Path(root) / filename
+                real_path = os.path.realpath(file_path)
+                if real_path in seen or not file_path.is_file():
+                    continue
+                seen.add(real_path)
+                yield file_path
+    
+    @staticmethod
+    def _file_hash(file_path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _scan_changes(self, files: List[Path], known: Dict[str, FileState], reprocess_all: bool = False
+                      ) -> Tuple[List[Path], Dict[str, FileState], Dict[str, FileState], List[str]]:
+        """Compara contra el manifest: mtime/size iguales -> sin cambios (no se lee);
+        si difieren se hashea y sólo un hash distinto obliga a reprocesar
+        (reprocess_all: la config cambió, todo archivo cuenta como cambiado).
+        Retorna (cambiados, sus estados, estados sólo tocados, borrados)"""
+        changed: List[Path] = []
+        changed_states: Dict[str, FileState] = {}
+        touched: Dict[str, FileState] = {}
         
-        # Buscar archivos según configuración
-        patterns = ['**/*.md', '**/*.markdown', '**/*.txt']
+        for file_path in files:
+            path = str(file_path)
+            stat = file_path.stat()
+            previous = None if reprocess_all else known.get(path)
+            if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            content_hash = self._file_hash(file_path)
+            state = (stat.st_size, stat.st_mtime_ns, content_hash)
+            if previous is not None and previous[2] == content_hash:
+                touched[path] = state
+            else:
+                changed.append(file_path)
+                changed_states[path] = state
         
-        for pattern in patterns:
-            for file_path in source_dir.glob(pattern):
-                if file_path.is_file():
-                    chunks = self.process_file(file_path)
-                    all_chunks.extend(chunks)
+        present = {str(file_path) for file_path in files}
+        deleted = sorted(path for path in known if path not in present)
+        return changed, changed_states, touched, deleted
+    
+    def _iter_files(self, files: List[Path], workers: int) -> Iterator[Tuple[Path, List[Dict[str, Any]], bool]]:
+        """(archivo, chunks, ok) en orden de recorrido, serial o con un pool de procesos"""
+        if workers <= 1 or len(files) < 2:
+            for file_path in files:
+                chunks, ok = self._process_file(file_path)
+                yield file_path, chunks, ok
+            return
+        
+        # map() conserva el orden de entrada: salida determinista con N procesos
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self.config,)) as executor:
+            results = executor.map(_process_in_worker, map(str, files), chunksize=self.task_chunksize)
+            for file_path, (chunks, ok, output) in zip(files, results):
+                print(output, end='')
+                yield file_path, chunks, ok
+    
+    def iter_directory(self, source_dir: Path, workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Genera los chunks de todos los archivos, en orden de recorrido; en modo
+        incremental sólo los de archivos cambiados, un tombstone por archivo borrado
+        (o que ya no produce chunks) y al final el registro file_manifest_update"""
+        files = list(self.discover_files(source_dir))
+        workers = self.workers if workers is None else workers
+        
+        if not self.incremental:
+            for _, chunks, _ in self._iter_files(files, workers):
+                yield from chunks
+            return
+        
+        manifest = FileManifest(self.manifest_path, str(source_dir), self.config_hash)
+        try:
+            known = manifest.entries()
+            reprocess_all = bool(known) and not manifest.config_matches()
+        finally:
+            manifest.close()
+        if reprocess_all:
+            print("🔁 Incremental: cleanup/chunking config changed, reprocessing every file")
+        
+        changed, changed_states, touched, deleted = self._scan_changes(files, known, reprocess_all)
+        print(f"🔁 Incremental: {len(changed)} changed, {len(files) - len(changed)} unchanged, "
+              f"{len(deleted)} deleted")
+        
+        # Un archivo con error no se registra: se reintenta en la próxima corrida
+        processed: Dict[str, FileState] = dict(touched)
+        for file_path, chunks, ok in self._iter_files(changed, workers):
+            path = str(file_path)
+            if ok:
+                processed[path] = changed_states[path]
+                if not chunks and path in known:
+                    # Sin chunks nuevos que lo reemplacen: borrar los anteriores
+                    yield tombstone(path)
+            yield from chunks
+        
+        for path in deleted:
+            yield tombstone(path)
+        
+        # El manifest no se toca aquí: embed lo confirma tras upsertar y podar sin errores
+        yield file_manifest_update(self.manifest_path, str(source_dir), self.config_hash, processed, deleted)
+    
+    def process_directory(self, source_dir: Path) -> List[Dict[str, Any]]:
+        """Procesa todos los archivos en un directorio"""
+        all_chunks = list(self.iter_directory(source_dir))
         
         print(f"📊 Total processed: {len(all_chunks)} chunks from {source_dir}")
         return all_chunks
@@ -202,8 +407,10 @@ class DocumentPreprocessor:
 def main():
     parser = argparse.ArgumentParser(description="RAG Document Preprocessor")
     parser.add_argument("--source", required=True, help="Source directory")
-    parser.add_argument("--output", required=True, help="Output JSON file")
+    parser.add_argument("--output", required=True, help="Output chunks JSONL file (.gz/.zst to compress, - for stdout)")
     parser.add_argument("--config", default="rag/config/retrieval.yaml", help="Config file")
+    parser.add_argument("--workers", type=int, help="Worker processes (0 = one per CPU, 1 = serial)")
+    parser.add_argument("--incremental", action="store_true", help="Only emit changed files (plus tombstones for deleted ones)")
     
     args = parser.parse_args()
     
@@ -212,6 +419,11 @@ def main():
     with open(args.config, 'r') as f:
         config = yaml.safe_load(f)
     
+    if args.workers is not None:
+        config.setdefault('preprocess', {})['workers'] = args.workers
+    if args.incremental:
+        config.setdefault('preprocess', {})['incremental'] = True
+    
     # Procesar documentos
     preprocessor = DocumentPreprocessor(config)
     source_dir = Path(args.source)
@@ -220,14 +432,17 @@ def main():
         print(f"❌ Source directory not found: {source_dir}")
         return 1
     
-    chunks = preprocessor.process_directory(source_dir)
-    
-    # Guardar resultados
-    import json
-    with open(args.output, 'w') as f:
-        json.dump(chunks, f, indent=2)
+    # Guardar resultados en streaming (con --output - el progreso va a stderr
+    # para no mezclarse con los chunks)
+    progress = sys.stderr if args.output == STDIO else sys.stdout
+    with ChunkWriter(args.output) as writer, redirect_stdout(progress):
+        writer.write_many(preprocessor.iter_directory(source_dir))
+        print(f"📊 Total processed: {writer.count} chunks from {source_dir}")
     
-    print(f"💾 Saved {len(chunks)} chunks to {args.output}")
+    print(f"💾 Saved {writer.count} chunks to {args.output}", file=progress)
+    if preprocessor.incremental:
+        print("ℹ️ Incremental output: embed it with --incremental --no-prune (or set preprocess.incremental); "
+              "the file manifest is updated only once embed succeeds", file=progress)
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Rate Limit - Token buckets para respetar límites de la API de embeddings
+Requests por minuto (RPM) y tokens por minuto (TPM), compartidos entre workers
+"""
+import time
+import threading
+from typing import Optional
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    """Estimación barata de tokens (sin tokenizer) para dimensionar lotes"""
+    return max(1, int(len(text) / chars_per_token))
+
+class TokenBucket:
+    """Bucket thread-safe: capacidad por minuto, recarga continua"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.refill_per_s = self.capacity / 60.0
+        self._available = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        self._available = min(self.capacity, self._available + elapsed * self.refill_per_s)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """Reserva amount y retorna los segundos a esperar antes de usarlo"""
+        # Un lote mayor que la capacidad pasa solo cuando el bucket está lleno
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= amount
+            if self._available >= 0:
+                return 0.0
+            return -self._available / self.refill_per_s
+
+class RateLimiter:
+    """Límite combinado RPM + TPM (None desactiva cada uno)"""
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.waited_s = 0.0
+
+    def acquire(self, tokens: int = 0):
+        """Bloquea hasta que una request de `tokens` tokens esté permitida"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            self.waited_s += wait
+            time.sleep(wait)
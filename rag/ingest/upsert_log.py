@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Upsert Log - Log de auditoría de la ingesta escrito en streaming
+JSON Lines: una línea por punto upsertado a medida que avanza la ingesta y,
+al cerrar, una línea final {"summary": {...}}; memoria constante
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from .chunk_io import ChunkWriter
+
+class UpsertLog:
+    """Writer append-only del log de upserts (context manager)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.summary: Dict[str, Any] = {}
+        self.started_at = datetime.now().isoformat()
+        self._writer: Optional[ChunkWriter] = None
+
+    def __enter__(self) -> "UpsertLog":
+        self._writer = ChunkWriter(self.path).__enter__()
+        return self
+
+    def record(self, entries: Iterable[Dict[str, Any]]):
+        """Agrega las entradas de un lote (se escriben de inmediato)"""
+        self.count = self._writer.write_many(entries)
+
+    def __exit__(self, exc_type, exc, tb):
+        # Footer: resumen de la corrida (también si terminó con error)
+        self._writer.write({
+            "summary": {
+                "total_upserts": self.count,
+                "status": "failed" if exc_type is not None else "completed",
+                "started_at": self.started_at,
+                "finished_at": datetime.now().isoformat(),
+                **self.summary
+            }
+        })
+        self._writer.__exit__(exc_type, exc, tb)
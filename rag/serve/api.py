@@ -3,46 +3,207 @@
 FastAPI Server para RAG Pipeline
 Endpoint local para smoke CI y testing
 """
+import json
+import math
 import time
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
+from typing import AsyncIterator, Dict, Any, Iterator, Optional, List, Sequence
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
-from .retriever import HybridRetriever, create_retriever
+try:
+    import orjson
+except ImportError:  # opcional: encoding JSON rápido de las respuestas
+    orjson = None
+
+from .async_retriever import AsyncHybridRetriever, create_async_retriever
+from .metrics import (
+    CONTENT_TYPE, IN_FLIGHT, REGISTRY, REQUEST_SECONDS, REQUESTS, STAGE_SECONDS,
+    Counter, Gauge, Metric, observe_timings
+)
+from .profiling import SamplingProfiler
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Global retriever instance
-retriever: Optional[HybridRetriever] = None
+retriever: Optional[AsyncHybridRetriever] = None
+# Sampling profiler opt-in (sección profiling)
+profiler: Optional[SamplingProfiler] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan manager para inicializar el retriever"""
-    global retriever
+    global retriever, profiler
     try:
         logger.info("Initializing RAG retriever...")
-        retriever = create_retriever()
+        retriever = create_async_retriever()
         logger.info("✅ RAG retriever initialized")
+        profiler = SamplingProfiler.from_config(retriever.config.get('profiling', {}))
+        if profiler:
+            logger.info(f"🔬 Request profiling enabled: {profiler.stats()}")
         yield
     except Exception as e:
         logger.error(f"❌ Error initializing retriever: {e}")
         raise
     finally:
         logger.info("Shutting down RAG retriever...")
+        if profiler:
+            profiler.close()
+            profiler = None
+        if retriever:
+            await retriever.aclose()
+
+def _encode_default(obj: Any) -> Any:
+    """Tipos que el encoder no conoce: modelos armados con model_construct y escalares numpy"""
+    if isinstance(obj, BaseModel):
+        return dict(obj)
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dump_json(content: Any) -> bytes:
+    """JSON compacto en UTF-8: orjson si está instalado, json estándar si no
+    (NaN/Inf: orjson escribe null y json estándar falla; los scores llegan
+    saneados por finite_score)"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_encode_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_encode_default, ensure_ascii=False,
+                      allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa los modelos de respuesta sin volver a validarlos"""
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+def json_response(content: Any, endpoint: str) -> FastJSONResponse:
+    """Respuesta JSON registrando su tiempo de serialización"""
+    start = time.perf_counter()
+    response = FastJSONResponse(content)
+    STAGE_SECONDS.labels(endpoint, "serialization").observe(time.perf_counter() - start)
+    return response
+
+class MetricsMiddleware:
+    """Requests en vuelo, duración y status por endpoint (middleware ASGI: en
+    streaming cuenta hasta el último chunk del cuerpo)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        # Label acotado a las rutas declaradas (paths desconocidos no crean series)
+        if self._paths is None:
+            self._paths = {route.path for route in app.routes}
+        endpoint = scope["path"] if scope["path"] in self._paths else "other"
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        in_flight = IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, status).inc()
+
+class ProfilingMiddleware:
+    """Perfila con el sampling profiler una fracción de las requests de consulta
+    y/o todas las que superen profiling.slow_threshold_ms (perfil por request;
+    con umbral se muestrean todas, o la fracción slow_sample_rate)"""
+
+    PATHS = {"/query", "/query/stream", "/query/batch", "/explain"}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if profiler is None or scope["type"] != "http" or scope["path"] not in self.PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        sample, keep = profiler.should_profile()
+        if not sample:
+            await self.app(scope, receive, send)
+            return
+        
+        active_profiler = profiler
+        session = active_profiler.start(f"{scope['method']} {scope['path']}", asyncio.current_task())
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            reason = active_profiler.finish(session, elapsed_ms, keep)
+            if reason is not None:
+                # Escritura fuera del loop: la request ya respondió
+                tag = scope["path"].strip("/").replace("/", "-")
+                future = asyncio.get_running_loop().run_in_executor(
+                    None, active_profiler.write, session, elapsed_ms, reason, tag
+                )
+                future.add_done_callback(_log_profile_error)
+
+def _log_profile_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Error writing profile: {future.exception()}")
+
+def cache_metrics() -> Iterator[Metric]:
+    """Hits, misses y hit ratio de los caches del retriever (desde sus stats, en cada lectura)"""
+    if retriever is None:
+        return
+    
+    caches = {}
+    stats = retriever.embedding_cache.stats()
+    # Un hit en disco es un miss de memoria: se cuenta como hit del cache
+    caches["embedding"] = (stats["hits"] + stats["disk_hits"], stats["misses"] - stats["disk_hits"])
+    if retriever.result_cache is not None:
+        stats = retriever.result_cache.stats()
+        # Un hit por similitud viene precedido del miss exacto de la misma lookup
+        caches["result"] = (stats["hits"], stats["misses"] - stats["semantic_hits"])
+    if retriever.rerank_engine is not None and retriever.rerank_engine.score_cache is not None:
+        stats = retriever.rerank_engine.score_cache.stats()
+        caches["rerank_score"] = (stats["hits"], stats["misses"])
+    
+    hits = Counter("rag_cache_hits_total", "Cache hits since startup", ("cache",))
+    misses = Counter("rag_cache_misses_total", "Cache misses since startup", ("cache",))
+    hit_ratio = Gauge("rag_cache_hit_ratio", "Cache hits / lookups since startup", ("cache",))
+    for name, (cache_hits, cache_misses) in caches.items():
+        hits.labels(name).inc(cache_hits)
+        misses.labels(name).inc(cache_misses)
+        lookups = cache_hits + cache_misses
+        hit_ratio.labels(name).set(cache_hits / lookups if lookups else 0.0)
+    yield from (hits, misses, hit_ratio)
+
+REGISTRY.set_collector("caches", cache_metrics)
 
 # FastAPI app
 app = FastAPI(
     title="RAG Pipeline API",
     description="API para pipeline RAG con recuperación híbrida",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Pydantic models
 class QueryRequest(BaseModel):
@@ -50,6 +211,8 @@ class QueryRequest(BaseModel):
     k: Optional[int] = None
     filters: Optional[Dict[str, Any]] = None
     explain: Optional[bool] = False
+    include_metadata: bool = True
+    fields: Optional[List[str]] = None  # claves de metadata a devolver (None = todas)
 
 class QueryResponse(BaseModel):
     query: str
@@ -58,6 +221,18 @@ class QueryResponse(BaseModel):
     timings_ms: Dict[str, float]
     metadata: Dict[str, Any]
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    k: Optional[int] = None
+    filters: Optional[Dict[str, Any]] = None
+    include_metadata: bool = True
+    fields: Optional[List[str]] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+    timings_ms: Dict[str, float]
+    metadata: Dict[str, Any]
+
 class HealthResponse(BaseModel):
     status: str
     retriever_ready: bool
@@ -89,6 +264,67 @@ async def health_check():
             retriever_ready=False
         )
 
+def project_metadata(metadata: Dict[str, Any], fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Proyección del payload: sólo las claves pedidas; el contenido nunca se
+    repite (ya viaja en el contexto)"""
+    if fields is None:
+        return {name: value for name, value in metadata.items() if name != 'content'}
+    return {name: metadata[name] for name in fields if name in metadata and name != 'content'}
+
+def finite_score(score: Optional[float]) -> Optional[float]:
+    """Score serializable igual con cualquier encoder: NaN/±Inf (reranker o
+    backend degenerados) viajan como null"""
+    if score is None or math.isfinite(score):
+        return score
+    logger.warning(f"Non-finite score {score} serialized as null")
+    return None
+
+def build_contexts(chunks, include_metadata: bool = True,
+                   fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """Contextos serializables de una lista de chunks"""
+    contexts = []
+    for chunk in chunks:
+        context = {
+            "content": chunk.content,
+            "score": finite_score(chunk.score),
+            "retrieval_method": chunk.retrieval_method
+        }
+        if include_metadata:
+            context["metadata"] = project_metadata(chunk.metadata, fields)
+        contexts.append(context)
+    return contexts
+
+def build_answer(contexts: List[Dict[str, Any]]) -> Optional[str]:
+    """Generar respuesta simple (en producción usarías un LLM)"""
+    if not contexts:
+        return None
+    # Respuesta básica basada en el mejor contexto
+    best_context = contexts[0]["content"]
+    return f"Basado en la documentación: {best_context[:200]}..."
+
+def build_metadata(contexts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "num_contexts": len(contexts),
+        "retriever_config": {
+            "hybrid": True,
+            "reranking": retriever.reranker is not None
+        }
+    }
+
+def build_query_response(query: str, chunks, timings_ms: Dict[str, float], include_metadata: bool = True,
+                         fields: Optional[Sequence[str]] = None) -> QueryResponse:
+    """Arma la respuesta de una query a partir de sus chunks finales (datos
+    internos: sin revalidar)"""
+    contexts = build_contexts(chunks, include_metadata, fields)
+    
+    return QueryResponse.model_construct(
+        query=query,
+        answer=build_answer(contexts),
+        contexts=contexts,
+        timings_ms=timings_ms,
+        metadata=build_metadata(contexts)
+    )
+
 @app.post("/query", response_model=QueryResponse)
 async def query_rag(request: QueryRequest):
     """Endpoint principal de consulta RAG"""
@@ -100,53 +336,127 @@ async def query_rag(request: QueryRequest):
     start_time = time.time()
     
     try:
-        # Recuperación
-        retrieval_start = time.time()
-        chunks = retriever.retrieve(
+        # Recuperación (con tiempos por pierna/etapa)
+        chunks, stage_timings = await retriever.aretrieve_with_timings(
             query=request.query,
             k=request.k,
             filters=request.filters
         )
-        retrieval_time = (time.time() - retrieval_start) * 1000
         
-        # Preparar contextos
-        contexts = []
-        for chunk in chunks:
-            contexts.append({
-                "content": chunk.content,
-                "score": chunk.score,
-                "retrieval_method": chunk.retrieval_method,
-                "metadata": chunk.metadata
-            })
+        total_time = (time.time() - start_time) * 1000
+        observe_timings("/query", stage_timings)
         
-        # Generar respuesta simple (en producción usarías un LLM)
-        answer = None
-        if contexts:
-            # Respuesta básica basada en el mejor contexto
-            best_context = contexts[0]["content"]
-            answer = f"Basado en la documentación: {best_context[:200]}..."
+        return json_response(build_query_response(
+            request.query, chunks, {**stage_timings, "total": total_time},
+            request.include_metadata, request.fields
+        ), "/query")
+        
+    except Exception as e:
+        logger.error(f"Query failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def format_event(event: str, data: Dict[str, Any], sse: bool) -> str:
+    """Un evento del stream: línea NDJSON o bloque server-sent event"""
+    if sse:
+        return f"event: {event}\ndata: {dump_json(data).decode('utf-8')}\n\n"
+    return dump_json({"event": event, **data}).decode('utf-8') + "\n"
+
+async def stream_query_events(request: QueryRequest, sse: bool) -> AsyncIterator[str]:
+    """Eventos de /query/stream: hits provisionales de cada pierna, lista final
+    (fusión + reranking) y tiempos por etapa al cierre"""
+    start_time = time.time()
+    serialization = 0.0
+    
+    try:
+        async for event, payload in retriever.astream_retrieve(
+            query=request.query,
+            k=request.k,
+            filters=request.filters
+        ):
+            stage_start = time.perf_counter()
+            if event == "final":
+                contexts = build_contexts(payload, request.include_metadata, request.fields)
+                data = {
+                    "query": request.query,
+                    "answer": build_answer(contexts),
+                    "contexts": contexts,
+                    "metadata": build_metadata(contexts)
+                }
+            elif event == "timings":
+                observe_timings("/query/stream", payload)
+                STAGE_SECONDS.labels("/query/stream", "serialization").observe(serialization)
+                data = {"timings_ms": {**payload, "total": (time.time() - start_time) * 1000}}
+            else:
+                # Provisional: orden de la pierna, antes de fusión y reranking
+                data = {"provisional": True, "contexts": build_contexts(payload, request.include_metadata, request.fields)}
+            line = format_event(event, data, sse)
+            serialization += time.perf_counter() - stage_start
+            yield line
+    
+    except Exception as e:
+        # El status 200 ya se envió: el error viaja como último evento
+        logger.error(f"Streaming query failed: {e}")
+        yield format_event("error", {"detail": str(e)}, sse)
+
+@app.post("/query/stream")
+async def query_rag_stream(request: QueryRequest, http_request: Request):
+    """Consulta RAG en streaming: NDJSON por defecto, server-sent events si el
+    cliente envía Accept: text/event-stream"""
+    global retriever
+    
+    if not retriever:
+        raise HTTPException(status_code=503, detail="Retriever not initialized")
+    
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    
+    return StreamingResponse(
+        stream_query_events(request, sse),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        # Sin buffering en proxies: cada evento sale apenas se produce
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_rag_batch(request: BatchQueryRequest):
+    """Varias queries en una request: embedding, búsqueda vectorial y reranking
+    compartidos por todo el lote (evaluación offline, agentes)"""
+    global retriever
+    
+    if not retriever:
+        raise HTTPException(status_code=503, detail="Retriever not initialized")
+    
+    max_batch_queries = retriever.retrieval_config.get('max_batch_queries', 256)
+    if len(request.queries) > max_batch_queries:
+        raise HTTPException(status_code=413, detail=f"Too many queries: {len(request.queries)} > {max_batch_queries}")
+    
+    start_time = time.time()
+    
+    try:
+        results, batch_timings = await retriever.aretrieve_many(
+            queries=request.queries,
+            k=request.k,
+            filters=request.filters
+        )
         
         total_time = (time.time() - start_time) * 1000
+        observe_timings("/query/batch", batch_timings)
         
-        return QueryResponse(
-            query=request.query,
-            answer=answer,
-            contexts=contexts,
+        return json_response(BatchQueryResponse.model_construct(
+            results=[
+                build_query_response(query, chunks, timings, request.include_metadata, request.fields)
+                for query, (chunks, timings) in zip(request.queries, results)
+            ],
             timings_ms={
-                "retrieval": retrieval_time,
+                **batch_timings,
                 "total": total_time
             },
             metadata={
-                "num_contexts": len(contexts),
-                "retriever_config": {
-                    "hybrid": True,
-                    "reranking": retriever.reranker is not None
-                }
+                "num_queries": len(request.queries)
             }
-        )
+        ), "/query/batch")
         
     except Exception as e:
-        logger.error(f"Query failed: {e}")
+        logger.error(f"Batch query failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/explain")
@@ -158,12 +468,18 @@ async def explain_query(request: QueryRequest):
         raise HTTPException(status_code=503, detail="Retriever not initialized")
     
     try:
-        explanation = retriever.explain(
+        explanation = await retriever.aexplain(
             query=request.query,
             k=request.k,
             filters=request.filters
         )
-        return explanation
+        for chunk in explanation["chunks"]:
+            if request.include_metadata:
+                chunk["metadata"] = project_metadata(chunk["metadata"], request.fields)
+            else:
+                del chunk["metadata"]
+        observe_timings("/explain", explanation["timings_ms"])
+        return json_response(explanation, "/explain")
         
     except Exception as e:
         logger.error(f"Explain failed: {e}")
@@ -192,14 +508,27 @@ async def get_stats():
                 "embedding_dimensions": retriever.embedding_dimensions
             },
             "cache": {
-                "embedding_cache_size": len(retriever.embedding_cache)
-            }
+                "embedding_cache_size": len(retriever.embedding_cache),
+                "embedding_cache": retriever.embedding_cache.stats(),
+                "result_cache": retriever.result_cache.stats() if retriever.result_cache else None
+            },
+            "reranker": retriever.rerank_engine.stats() if retriever.rerank_engine else None,
+            "batching": {
+                "embeddings": retriever.embedding_batcher.stats() if retriever.embedding_batcher else None,
+                "rerank": retriever.rerank_batcher.stats() if retriever.rerank_batcher else None
+            },
+            "profiling": profiler.stats() if profiler else None
         }
         
     except Exception as e:
         logger.error(f"Stats failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto Prometheus"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -209,8 +538,11 @@ async def root():
         "endpoints": {
             "health": "/health",
             "query": "/query",
+            "query_stream": "/query/stream",
+            "query_batch": "/query/batch",
             "explain": "/explain",
             "stats": "/stats",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Async Hybrid Retriever - Variante asyncio del retriever híbrido
+Usa clientes async (embeddings, backend vectorial) y delega el trabajo CPU a un executor;
+embeddings y reranking de requests concurrentes se agrupan en micro-batches
+"""
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+
+from .batching import MicroBatcher
+from .cache import ResultCache
+from .profiling import attributed
+from .reranker import chunk_identity
+from .retriever import HybridRetriever, Chunk
+
+logger = logging.getLogger(__name__)
+
+class AsyncHybridRetriever(HybridRetriever):
+    """Retriever híbrido que no bloquea el event loop"""
+
+    def __init__(self, config_path: str = "rag/config/retrieval.yaml"):
+        super().__init__(config_path)
+        self._setup_batchers()
+
+    def _setup_batchers(self):
+        """Micro-batchers compartidos por todas las requests en vuelo"""
+        batching_config = self.config.get('batching', {})
+        self.embedding_batcher = None
+        self.rerank_batcher = None
+        if not batching_config.get('enabled', False):
+            return
+
+        embeddings_batching = batching_config.get('embeddings', {})
+        self.embedding_batcher = MicroBatcher(
+            self._embed_batch,
+            max_batch_size=embeddings_batching.get('max_batch_size', 64),
+            max_wait_ms=embeddings_batching.get('max_wait_ms', 5),
+            name="embedding_batcher"
+        )
+
+        if self.rerank_engine is not None:
+            rerank_batching = batching_config.get('rerank', {})
+            self.rerank_batcher = MicroBatcher(
+                self.rerank_engine.predict_pairs,
+                max_batch_size=rerank_batching.get('max_batch_size', 128),
+                max_wait_ms=rerank_batching.get('max_wait_ms', 5),
+                executor=self.executor,
+                name="rerank_batcher"
+            )
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Una sola llamada de embeddings para los textos de varias requests"""
+        unique_texts = list(dict.fromkeys(texts))
+        embeddings = await self.embedding_provider.aembed(unique_texts)
+        by_text = dict(zip(unique_texts, embeddings))
+        return [by_text[text] for text in texts]
+
+    async def _run_cpu(self, fn, *args):
+        """Ejecuta trabajo CPU-bound (BM25, reranking) fuera del event loop; con
+        el profiler activo, el worker se atribuye a la request que lo encoló"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, attributed(fn), *args)
+
+    async def aget_embedding(self, text: str) -> List[float]:
+        """Obtiene embedding para un texto (con cache)"""
+        cached = self.embedding_cache.get_memory(text)
+        if cached is None and self.embedding_cache.disk is not None:
+            # El tier SQLite es I/O: fuera del event loop
+            cached = await self._run_cpu(self.embedding_cache.get_disk, text)
+        if cached is not None:
+            return cached
+
+        try:
+            if self.embedding_batcher is not None:
+                embedding = await self.embedding_batcher.submit(text)
+            else:
+                embedding = (await self.embedding_provider.aembed([text]))[0]
+            self.embedding_cache.put_memory(text, embedding)
+            if self.embedding_cache.disk is not None:
+                # Escritura SQLite (y poda periódica) fuera del event loop, sin demorar la respuesta
+                asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.embedding_cache.put_disk, text, embedding
+                )
+            return embedding
+        except Exception as e:
+            logger.error(f"Error getting embedding: {e}")
+            raise
+
+    async def arerank_chunks(self, query: str, chunks: List[Chunk], top_k: int) -> List[Chunk]:
+        """Rerankea chunks; con batching los pares se agrupan con otras requests"""
+        if self.rerank_batcher is None:
+            return await self._run_cpu(self.rerank_chunks, query, chunks, top_k)
+        if not chunks:
+            return chunks[:top_k]
+
+        try:
+            candidates = self._rerank_candidates(chunks)
+            rerank_scores = await self.rerank_engine.ascore(
+                query,
+                [chunk.content for chunk in candidates],
+                [chunk_identity(chunk.content, chunk.metadata) for chunk in candidates],
+                self.rerank_batcher
+            )
+            return self._apply_rerank_scores(candidates, rerank_scores, top_k)
+
+        except Exception as e:
+            logger.error(f"Error in reranking: {e}")
+            return chunks[:top_k]
+
+    async def avector_search(self, query: str, k: int, filters: Optional[Dict] = None,
+                             query_embedding: Optional[List[float]] = None) -> List[Chunk]:
+        """Búsqueda vectorial en el backend configurado (async)"""
+        try:
+            if query_embedding is None:
+                query_embedding = await self.aget_embedding(query)
+
+            search_results = await self.vector_store.asearch(query_embedding, k, filters)
+
+            chunks = self._to_vector_chunks(search_results)
+            logger.info(f"Vector search returned {len(chunks)} chunks")
+            return chunks
+
+        except Exception as e:
+            logger.error(f"Error in vector search: {e}")
+            return []
+
+    async def _avector_leg(self, query: str, k: int, filters: Optional[Dict], timings: Dict[str, float]) -> List[Chunk]:
+        """Pierna vectorial: embedding de la query + búsqueda en el backend"""
+        start = time.perf_counter()
+        try:
+            query_embedding = await self.aget_embedding(query)
+        except Exception:
+            timings['embedding'] = (time.perf_counter() - start) * 1000
+            return []
+        embedded = time.perf_counter()
+        timings['embedding'] = (embedded - start) * 1000
+
+        chunks = await self.avector_search(query, k, filters, query_embedding=query_embedding)
+        timings['vector_search'] = (time.perf_counter() - embedded) * 1000
+        return chunks
+
+    async def _asearch_legs(self, query: str, filters: Optional[Dict], timings: Dict[str, float]) -> Tuple[List[Chunk], List[Chunk]]:
+        """Ejecuta las piernas vector y BM25 solapadas"""
+        vector_k = self.retrieval_config.get('top_k_vector', 12)
+        bm25_k = self.retrieval_config.get('top_k_bm25', 12)
+
+        start = time.perf_counter()
+        vector_chunks, bm25_chunks = await asyncio.gather(
+            self._avector_leg(query, vector_k, filters, timings),
+            self._run_cpu(self._bm25_leg, query, bm25_k, filters, timings)
+        )
+        timings['search_legs'] = (time.perf_counter() - start) * 1000
+
+        return vector_chunks, bm25_chunks
+
+    async def _acached_or_none(self, query: str, k: Optional[int], filters: Optional[Dict],
+                               timings: Dict[str, float]) -> Tuple[Optional[str], Optional[List[Chunk]]]:
+        """Scope de cache y resultado cacheado (si lo hay) para la query"""
+        if self.result_cache is None:
+            return None, None
+
+        if self._bm25_reload_due():
+            # stat() y la carga del índice son I/O: fuera del event loop
+            await self._run_cpu(self._maybe_reload_bm25)
+        scope = ResultCache.scope(self.config_hash, k, filters)
+
+        cached = self._lookup_result_cache(query, scope, timings)
+        if cached is None and self.result_cache.similarity_threshold is not None:
+            stage_start = time.perf_counter()
+            try:
+                query_embedding = await self.aget_embedding(query)
+            except Exception:
+                query_embedding = None
+            timings['result_cache_embedding'] = (time.perf_counter() - stage_start) * 1000
+            cached = self._lookup_result_cache(query, scope, timings, query_embedding)
+        return scope, cached
+
+    async def _afuse_and_rerank(self, query: str, scope: Optional[str], vector_chunks: List[Chunk],
+                                bm25_chunks: List[Chunk], timings: Dict[str, float]) -> List[Chunk]:
+        """Fusión RRF + reranking de las piernas; guarda el resultado en cache"""
+        # Fusión RRF (barata, se queda en el loop)
+        stage_start = time.perf_counter()
+        fusion_k = self.retrieval_config.get('fusion_k', 60)
+        fused_chunks = self.reciprocal_rank_fusion({'vector': vector_chunks, 'bm25': bm25_chunks}, fusion_k)
+        timings['fusion'] = (time.perf_counter() - stage_start) * 1000
+
+        # Reranking (executor o micro-batch compartido)
+        stage_start = time.perf_counter()
+        rerank_top_k = self.reranker_config.get('top_k', 8)
+        final_chunks = await self.arerank_chunks(query, fused_chunks, rerank_top_k)
+        timings['rerank'] = (time.perf_counter() - stage_start) * 1000
+
+        if scope is not None:
+            self._store_result_cache(query, scope, final_chunks)
+        return final_chunks
+
+    async def astream_retrieve(self, query: str, k: int = None, filters: Optional[Dict] = None
+                               ) -> AsyncIterator[Tuple[str, Any]]:
+        """Recuperación por etapas: emite ('vector' | 'bm25', hits) a medida que termina
+        cada pierna, luego ('final', chunks) y por último ('timings', tiempos en ms).
+        Los hits provisionales se reutilizan en la fusión: serializarlos antes de
+        pedir el siguiente evento"""
+        timings: Dict[str, float] = {}
+        start_time = time.perf_counter()
+
+        scope, cached = await self._acached_or_none(query, k, filters, timings)
+        if cached is not None:
+            yield 'final', cached
+            timings['retrieval'] = (time.perf_counter() - start_time) * 1000
+            yield 'timings', timings
+            return
+
+        vector_k = self.retrieval_config.get('top_k_vector', 12)
+        bm25_k = self.retrieval_config.get('top_k_bm25', 12)
+
+        stage_start = time.perf_counter()
+        legs = {
+            asyncio.ensure_future(self._avector_leg(query, vector_k, filters, timings)): 'vector',
+            asyncio.ensure_future(self._run_cpu(self._bm25_leg, query, bm25_k, filters, timings)): 'bm25'
+        }
+        leg_chunks: Dict[str, List[Chunk]] = {}
+        try:
+            pending = set(legs)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    leg_chunks[legs[task]] = task.result()
+                    if len(leg_chunks) == 1:
+                        timings['first_hits'] = (time.perf_counter() - start_time) * 1000
+                    yield legs[task], leg_chunks[legs[task]]
+        finally:
+            # Cliente desconectado a mitad del stream: no dejar piernas huérfanas
+            for task in legs:
+                task.cancel()
+        timings['search_legs'] = (time.perf_counter() - stage_start) * 1000
+
+        final_chunks = await self._afuse_and_rerank(query, scope, leg_chunks['vector'], leg_chunks['bm25'], timings)
+        yield 'final', final_chunks
+
+        timings['retrieval'] = (time.perf_counter() - start_time) * 1000
+        yield 'timings', timings
+
+    async def aretrieve_with_timings(self, query: str, k: int = None, filters: Optional[Dict] = None) -> Tuple[List[Chunk], Dict[str, float]]:
+        """Recuperación híbrida async retornando tiempos por etapa (ms)"""
+        timings: Dict[str, float] = {}
+        start_time = time.perf_counter()
+
+        scope, cached = await self._acached_or_none(query, k, filters, timings)
+        if cached is not None:
+            timings['retrieval'] = (time.perf_counter() - start_time) * 1000
+            logger.info(f"Retrieval served from result cache in {timings['retrieval']:.1f}ms")
+            return cached, timings
+
+        if k is None:
+            k = self.retrieval_config.get('top_k_vector', 12)
+
+        vector_chunks, bm25_chunks = await self._asearch_legs(query, filters, timings)
+        final_chunks = await self._afuse_and_rerank(query, scope, vector_chunks, bm25_chunks, timings)
+
+        timings['retrieval'] = (time.perf_counter() - start_time) * 1000
+
+        logger.info(
+            f"Retrieval completed in {timings['retrieval']:.1f}ms "
+            f"(vector leg {timings.get('embedding', 0) + timings.get('vector_search', 0):.1f}ms, "
+            f"bm25 leg {timings.get('bm25', 0):.1f}ms)"
+        )
+
+        return final_chunks, timings
+
+    async def aretrieve(self, query: str, k: int = None, filters: Optional[Dict] = None) -> List[Chunk]:
+        """Método principal de recuperación híbrida (async)"""
+        chunks, _ = await self.aretrieve_with_timings(query, k, filters)
+        return chunks
+
+    async def aretrieve_many(self, queries: List[str], k: int = None, filters: Optional[Dict] = None
+                             ) -> Tuple[List[Tuple[List[Chunk], Dict[str, float]]], Dict[str, float]]:
+        """retrieve_many() fuera del event loop: el lote ya comparte embedding,
+        búsqueda y reranking, no necesita los micro-batchers. Corre en el executor
+        del retriever (no en el pool por defecto) para compartir su límite de
+        concurrencia; retrieve_many no encola trabajo en ese mismo executor"""
+        return await self._run_cpu(self.retrieve_many, queries, k, filters)
+
+    async def aexplain(self, query: str, k: int = None, filters: Optional[Dict] = None) -> Dict[str, Any]:
+        """Explica el proceso de recuperación (async)"""
+        timings: Dict[str, float] = {}
+        vector_chunks, bm25_chunks = await self._asearch_legs(query, filters, timings)
+        explanation = self._explain_legs(query, vector_chunks, bm25_chunks)
+
+        fusion_k = self.retrieval_config.get('fusion_k', 60)
+        fused_chunks = self.reciprocal_rank_fusion({'vector': vector_chunks, 'bm25': bm25_chunks}, fusion_k)
+        explanation["fused"] = self._explain_stage(fused_chunks[:5])
+
+        rerank_top_k = self.reranker_config.get('top_k', 8)
+        final_chunks = await self.arerank_chunks(query, fused_chunks, rerank_top_k)
+
+        return self._explain_final(explanation, final_chunks, timings)
+
+    async def aclose(self):
+        """Cierra clientes async y el executor"""
+        await self.vector_store.aclose()
+        await self.embedding_provider.aclose()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.embedding_cache.close()
+
+def create_async_retriever(config_path: str = "rag/config/retrieval.yaml") -> AsyncHybridRetriever:
+    """Factory function para crear retriever async"""
+    return AsyncHybridRetriever(config_path)
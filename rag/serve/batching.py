@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Micro-batching - Agrupa trabajo de requests concurrentes en llamadas por lote
+Retiene items unos milisegundos y reparte los resultados a cada llamador
+"""
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """Coalesce de items de muchas corrutinas en lotes de batch_fn"""
+
+    def __init__(self, batch_fn: Callable[[List[Any]], Any], max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0, executor: Optional[Executor] = None,
+                 name: str = "batcher"):
+        # batch_fn: función (o corrutina) que recibe la lista de items y
+        # retorna la lista de resultados en el mismo orden
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.name = name
+        self._is_async = asyncio.iscoroutinefunction(batch_fn)
+
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Encola un item y espera su resultado"""
+        results = await self.submit_many([item])
+        return results[0]
+
+    async def submit_many(self, items: Sequence[Any]) -> List[Any]:
+        """Encola varios items y espera sus resultados (en orden)"""
+        if not items:
+            return []
+
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in items]
+        self._pending.extend(zip(items, futures))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self):
+        """Despacha todo lo pendiente en lotes de max_batch_size"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), self.max_batch_size):
+            task = asyncio.get_running_loop().create_task(
+                self._run(pending[start:start + self.max_batch_size])
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        """Ejecuta un lote y reparte resultados/errores a cada future"""
+        items = [item for item, _ in batch]
+        self.batches += 1
+        self.items += len(items)
+
+        try:
+            if self._is_async:
+                results = await self.batch_fn(items)
+            else:
+                loop = asyncio.get_running_loop()
+                results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+            if len(results) != len(items):
+                raise ValueError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error(f"Error in {self.name} batch of {len(items)}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms
+        }
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+BM25 Index - Índice invertido persistente para recuperación léxica
+Implementa BM25 Okapi (idf, k1, b, epsilon) con postings en memoria
+y mantenimiento incremental por (doc_id, chunk_idx) con tombstones
+"""
+import os
+import re
+import math
+import heapq
+import pickle
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple, Iterable, Set
+
+logger = logging.getLogger(__name__)
+
+# Tokenización: palabras unicode en minúsculas
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    """Tokeniza un texto para indexado/búsqueda"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """Índice invertido BM25 con frecuencias de documento y longitudes"""
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, epsilon: float = 0.25,
+                 compact_ratio: float = 0.2):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        # Fracción de tombstones sobre docs vivos que dispara compactación
+        self.compact_ratio = compact_ratio
+
+        # term -> {doc interno -> tf}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # term -> número de documentos vivos que lo contienen
+        self._doc_freqs: Dict[str, int] = {}
+        self._doc_lens: Dict[int, int] = {}
+        self._payloads: Dict[int, Dict[str, Any]] = {}
+        # Términos distintos de cada doc (para descontar df al reemplazar)
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        # doc_id -> {chunk_idx -> doc interno}
+        self._keys: Dict[str, Dict[int, int]] = {}
+        # Docs reemplazados/eliminados cuyos postings aún no se compactaron
+        self._tombstones: Set[int] = set()
+        self._total_len = 0
+        self._next_id = 0
+        # Último replica_tag de ingesta aplicado (invalida caches del retriever)
+        self.replica_tag: Optional[str] = None
+
+        # Cache de idf promedio (se invalida al mutar el índice)
+        self._average_idf: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._doc_lens)
+
+    @property
+    def avgdl(self) -> float:
+        """Longitud promedio de documento"""
+        return self._total_len / len(self._doc_lens) if self._doc_lens else 0.0
+
+    def add(self, content: str, payload: Dict[str, Any]) -> int:
+        """Agrega un documento al índice y retorna su id interno"""
+        doc = self._next_id
+        self._next_id += 1
+
+        term_freqs: Dict[str, int] = {}
+        tokens = tokenize(content)
+        for token in tokens:
+            term_freqs[token] = term_freqs.get(token, 0) + 1
+
+        for term, tf in term_freqs.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+            postings[doc] = tf
+            self._doc_freqs[term] = self._doc_freqs.get(term, 0) + 1
+
+        self._doc_lens[doc] = len(tokens)
+        self._payloads[doc] = payload
+        self._doc_terms[doc] = tuple(term_freqs)
+        self._total_len += len(tokens)
+        self._average_idf = None
+
+        doc_id = payload.get('doc_id')
+        if doc_id is not None:
+            chunks = self._keys.setdefault(doc_id, {})
+            previous = chunks.get(payload.get('chunk_idx'))
+            if previous is not None:
+                self._tombstone(previous)
+            chunks[payload.get('chunk_idx')] = doc
+        return doc
+
+    def upsert(self, content: str, payload: Dict[str, Any]) -> bool:
+        """Agrega o reemplaza el chunk (doc_id, chunk_idx); False si no cambió"""
+        doc_id = payload.get('doc_id')
+        current = self._keys.get(doc_id, {}).get(payload.get('chunk_idx'))
+        if current is not None and self._payloads[current].get('chunk_hash') == payload.get('chunk_hash'):
+            # Mismo contenido: sólo refrescar payload (replica_tag, upserted_at...)
+            self._payloads[current] = payload
+            return False
+
+        self.add(content, payload)
+        return True
+
+    def remove(self, doc_id: str, chunk_idx: Optional[int] = None) -> int:
+        """Elimina un chunk, o todo el documento si chunk_idx es None"""
+        chunks = self._keys.get(doc_id)
+        if not chunks:
+            return 0
+
+        if chunk_idx is None:
+            targets = list(chunks)
+        else:
+            targets = [chunk_idx] if chunk_idx in chunks else []
+
+        for idx in targets:
+            self._tombstone(chunks.pop(idx))
+        if not chunks:
+            del self._keys[doc_id]
+        return len(targets)
+
+    def chunk_indices(self, doc_id: str) -> List[Any]:
+        """chunk_idx indexados de un documento"""
+        return list(self._keys.get(doc_id, ()))
+
+    def _tombstone(self, doc: int):
+        """Marca un doc como eliminado y descuenta sus estadísticas"""
+        for term in self._doc_terms.pop(doc):
+            df = self._doc_freqs[term] - 1
+            if df:
+                self._doc_freqs[term] = df
+            else:
+                del self._doc_freqs[term]
+        self._total_len -= self._doc_lens.pop(doc)
+        del self._payloads[doc]
+        self._tombstones.add(doc)
+        self._average_idf = None
+
+    @property
+    def needs_compaction(self) -> bool:
+        return len(self._tombstones) > self.compact_ratio * max(len(self._doc_lens), 1)
+
+    def compact(self):
+        """Purga de los postings los docs con tombstone"""
+        if not self._tombstones:
+            return
+        tombstones = self._tombstones
+        for term in list(self._postings):
+            postings = self._postings[term]
+            for doc in tombstones.intersection(postings):
+                del postings[doc]
+            if not postings:
+                del self._postings[term]
+        logger.info(f"BM25 index compacted: {len(tombstones)} tombstones purged")
+        self._tombstones = set()
+
+    def add_many(self, items: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Agrega múltiples (content, payload) y retorna cuántos se indexaron"""
+        count = 0
+        for content, payload in items:
+            self.add(content, payload)
+            count += 1
+        return count
+
+    def _idf(self, df: int) -> float:
+        """IDF BM25 Okapi sin suavizar"""
+        n = len(self._doc_lens)
+        return math.log(n - df + 0.5) - math.log(df + 0.5)
+
+    def _get_average_idf(self) -> float:
+        """IDF promedio del vocabulario (para acotar idf negativos con epsilon)"""
+        if self._average_idf is None:
+            if self._doc_freqs:
+                total = sum(self._idf(df) for df in self._doc_freqs.values())
+                self._average_idf = total / len(self._doc_freqs)
+            else:
+                self._average_idf = 0.0
+        return self._average_idf
+
+    def idf(self, term: str) -> float:
+        """IDF de un término con piso epsilon * idf promedio"""
+        df = self._doc_freqs.get(term, 0)
+        if df == 0:
+            return 0.0
+        value = self._idf(df)
+        if value < 0:
+            value = self.epsilon * self._get_average_idf()
+        return value
+
+    def search(self, query: str, k: int, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """Top-k (payload, score) recorriendo sólo los postings de la query"""
+        if not self._doc_lens or k <= 0:
+            return []
+
+        avgdl = self.avgdl or 1.0
+        k1 = self.k1
+        b = self.b
+        doc_lens = self._doc_lens
+        tombstones = self._tombstones
+
+        scores: Dict[int, float] = {}
+        for term in tokenize(query):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc, tf in postings.items():
+                if doc in tombstones:
+                    continue
+                norm = k1 * (1 - b + b * doc_lens[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * (tf * (k1 + 1)) / (tf + norm)
+
+        if filters:
+            scores = {
+                doc: score for doc, score in scores.items()
+                if self._matches(self._payloads[doc], filters)
+            }
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self._payloads[doc], score) for doc, score in top if score > 0]
+
+    @staticmethod
+    def _matches(payload: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+        """Match exacto de filtros (equivalente a MatchValue de Qdrant)"""
+        return all(payload.get(key) == value for key, value in filters.items())
+
+    def save(self, path: str):
+        """Persiste el índice de forma atómica"""
+        if self.needs_compaction:
+            self.compact()
+
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_suffix(target.suffix + ".tmp")
+
+        state = {
+            "version": self.FORMAT_VERSION,
+            "params": {"k1": self.k1, "b": self.b, "epsilon": self.epsilon},
+            "postings": self._postings,
+            "doc_freqs": self._doc_freqs,
+            "doc_lens": self._doc_lens,
+            "payloads": self._payloads,
+            "doc_terms": self._doc_terms,
+            "keys": self._keys,
+            "tombstones": self._tombstones,
+            "total_len": self._total_len,
+            "next_id": self._next_id,
+            "replica_tag": self.replica_tag,
+        }
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, target)
+
+        logger.info(f"💾 BM25 index saved to {path} ({len(self)} docs, {len(self._postings)} terms)")
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Carga un índice persistido con save()"""
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+
+        if state.get("version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported BM25 index version: {state.get('version')}")
+
+        index = cls(**state["params"])
+        index._postings = state["postings"]
+        index._doc_freqs = state["doc_freqs"]
+        index._doc_lens = state["doc_lens"]
+        index._payloads = state["payloads"]
+        index._doc_terms = state["doc_terms"]
+        index._keys = state["keys"]
+        index._tombstones = state["tombstones"]
+        index._total_len = state["total_len"]
+        index._next_id = state["next_id"]
+        index.replica_tag = state.get("replica_tag")
+
+        logger.info(f"BM25 index loaded from {path} ({len(index)} docs)")
+        return index
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Caches del retriever - LRU acotado en memoria + tier opcional en SQLite
+Embeddings guardados como blobs float32, claves por modelo/dimensiones/texto
+y cache de resultados finales con reutilización por similitud de query
+"""
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Normaliza un texto para usarlo como clave de cache"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+class LRUCache:
+    """LRU thread-safe acotado por número de entradas, bytes y TTL"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: Optional[int] = None,
+                 ttl_s: Optional[float] = None, sizeof: Callable[[Any], int] = lambda value: 1,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._sizeof = sizeof
+        # Notificado (bajo el lock) cuando una entrada sale por LRU o TTL
+        self._on_evict = on_evict
+
+        # key -> (value, size, stored_at)
+        self._data: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, stored_at = entry
+            if self.ttl_s is not None and time.time() - stored_at > self.ttl_s:
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                if self._on_evict is not None:
+                    self._on_evict(key)
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Lectura interna: no cuenta hits/misses ni cambia el orden LRU"""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, _, stored_at = entry
+        if self.ttl_s is not None and time.time() - stored_at > self.ttl_s:
+            return None
+        return value
+
+    def put(self, key: str, value: Any):
+        size = self._sizeof(value)
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+
+            self._data[key] = (value, size, time.time())
+            self._bytes += size
+
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                evicted_key, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                if self._on_evict is not None:
+                    self._on_evict(evicted_key)
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+class SQLiteVectorStore:
+    """Tier persistente: vectores float32 en SQLite (sobrevive a reinicios)"""
+
+    PRUNE_EVERY = 1000
+    # Filas borradas por poda como máximo (el resto queda para la siguiente)
+    PRUNE_BATCH = 5000
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, ttl_s: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, stored_at REAL NOT NULL)"
+        )
+        # La poda recorre las entradas por antigüedad sin ordenar la tabla
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_stored_at ON vectors (stored_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, stored_at FROM vectors WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        blob, stored_at = row
+        if self.ttl_s is not None and time.time() - stored_at > self.ttl_s:
+            return None
+        vector = array('f')
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def put(self, key: str, vector: List[float]):
+        blob = array('f', vector).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vectors (key, vector, stored_at) VALUES (?, ?, ?)",
+                (key, blob, time.time())
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self):
+        """Elimina entradas expiradas y las más antiguas sobre max_entries (por el
+        índice de stored_at, en tandas de a lo sumo PRUNE_BATCH filas)"""
+        if self.ttl_s is not None:
+            self._delete_oldest("stored_at < ?", time.time() - self.ttl_s)
+        if self.max_entries is not None:
+            # stored_at de la primera entrada que sobra (la max_entries + 1 más reciente)
+            row = self._conn.execute(
+                "SELECT stored_at FROM vectors ORDER BY stored_at DESC LIMIT 1 OFFSET ?",
+                (self.max_entries,)
+            ).fetchone()
+            if row is not None:
+                self._delete_oldest("stored_at <= ?", row[0])
+        self._conn.commit()
+
+    def _delete_oldest(self, condition: str, cutoff: float):
+        self._conn.execute(
+            "DELETE FROM vectors WHERE rowid IN ("
+            f"SELECT rowid FROM vectors WHERE {condition} ORDER BY stored_at LIMIT ?)",
+            (cutoff, self.PRUNE_BATCH)
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class EmbeddingCache:
+    """Cache de embeddings: LRU en memoria (float32) + tier opcional en disco"""
+
+    def __init__(self, model: str, dimensions: int, max_entries: int = 10000,
+                 max_bytes: Optional[int] = None, ttl_s: Optional[float] = None,
+                 disk_path: Optional[str] = None, disk_max_entries: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+        # Vectores en memoria como array('f'): 4 bytes por dimensión
+        self.memory = LRUCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl_s=ttl_s,
+            sizeof=lambda vector: vector.itemsize * len(vector)
+        )
+        self.disk = SQLiteVectorStore(disk_path, disk_max_entries, ttl_s) if disk_path else None
+        self.disk_hits = 0
+
+    @classmethod
+    def from_config(cls, model: str, dimensions: int, cache_config: Dict[str, Any]) -> "EmbeddingCache":
+        """Crea el cache desde la sección embeddings.cache"""
+        return cls(
+            model=model,
+            dimensions=dimensions,
+            max_entries=cache_config.get('max_entries', 10000),
+            max_bytes=cache_config.get('max_bytes'),
+            ttl_s=cache_config.get('ttl_s'),
+            disk_path=cache_config.get('disk_path'),
+            disk_max_entries=cache_config.get('disk_max_entries')
+        )
+
+    def key(self, text: str) -> str:
+        """Clave estable por modelo, dimensiones y texto normalizado"""
+        raw = f"{self.model}\x1f{self.dimensions}\x1f{normalize_text(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        vector = self.get_memory(text)
+        if vector is None:
+            vector = self.get_disk(text)
+        return vector
+
+    def get_memory(self, text: str) -> Optional[List[float]]:
+        """Sólo el tier en memoria (no bloquea: apto para el event loop)"""
+        vector = self.memory.get(self.key(text))
+        return vector.tolist() if vector is not None else None
+
+    def peek(self, text: str) -> Optional[List[float]]:
+        """Lectura interna del tier en memoria, sin contar en las stats"""
+        vector = self.memory.peek(self.key(text))
+        return vector.tolist() if vector is not None else None
+
+    def get_disk(self, text: str) -> Optional[List[float]]:
+        """Tier en disco (I/O SQLite); promueve el vector a memoria"""
+        if self.disk is None:
+            return None
+        key = self.key(text)
+        stored = self.disk.get(key)
+        if stored is not None:
+            self.disk_hits += 1
+            self.memory.put(key, array('f', stored))
+        return stored
+
+    def put(self, text: str, embedding: List[float]):
+        self.put_memory(text, embedding)
+        self.put_disk(text, embedding)
+
+    def put_memory(self, text: str, embedding: List[float]):
+        """Sólo el tier en memoria (no bloquea: apto para el event loop)"""
+        self.memory.put(self.key(text), array('f', embedding))
+
+    def put_disk(self, text: str, embedding: List[float]):
+        """Tier en disco (INSERT + commit SQLite y poda periódica)"""
+        if self.disk is None:
+            return
+        try:
+            self.disk.put(self.key(text), embedding)
+        except sqlite3.Error as e:
+            logger.error(f"Error writing embedding cache to disk: {e}")
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        if self.disk is not None:
+            stats["disk_entries"] = len(self.disk)
+        return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+class ResultCache:
+    """Cache de listas finales de chunks, con modo near-duplicate por coseno"""
+
+    def __init__(self, max_entries: int = 2000, ttl_s: Optional[float] = None,
+                 similarity_threshold: Optional[float] = None):
+        self.similarity_threshold = similarity_threshold
+        self._entries = LRUCache(max_entries=max_entries, ttl_s=ttl_s, on_evict=self._forget)
+
+        # Modo near-duplicate: embeddings normalizados en una matriz preasignada
+        # (una fila por key); put y evict tocan una sola fila
+        self._capacity = max(1, max_entries)
+        self._matrix: Optional[np.ndarray] = None
+        self._live = np.zeros(self._capacity, dtype=bool)
+        self._rows: Dict[str, int] = {}
+        self._row_keys: List[Optional[str]] = [None] * self._capacity
+        self._row_scopes: List[Optional[str]] = [None] * self._capacity
+        self._free: List[int] = list(range(self._capacity - 1, -1, -1))
+        self._vectors_lock = threading.Lock()
+
+        self.generation: Optional[str] = None
+        self.semantic_hits = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def scope(config_hash: str, k: Optional[int], filters: Optional[Dict[str, Any]]) -> str:
+        """Ámbito de reutilización: configuración, k y filtros"""
+        return hashlib.sha256(
+            json.dumps([config_hash, k, filters or {}], sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+    @staticmethod
+    def key(query: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\x1f{normalize_text(query).casefold()}".encode('utf-8')).hexdigest()
+
+    def _forget(self, key: str):
+        with self._vectors_lock:
+            row = self._rows.pop(key, None)
+            if row is not None:
+                self._live[row] = False
+                self._row_keys[row] = self._row_scopes[row] = None
+                self._free.append(row)
+
+    def _store_vector(self, key: str, scope: str, vector: np.ndarray):
+        """Escribe el embedding normalizado en la fila de key (o en una libre)"""
+        with self._vectors_lock:
+            if self._matrix is None or self._matrix.shape[1] != len(vector):
+                self._reset_vectors(len(vector))
+            row = self._rows.get(key)
+            if row is None:
+                if not self._free:
+                    self._grow()
+                row = self._free.pop()
+                self._rows[key] = row
+            self._matrix[row] = vector
+            self._live[row] = True
+            self._row_keys[row] = key
+            self._row_scopes[row] = scope
+
+    def _reset_vectors(self, dimensions: int):
+        self._matrix = np.zeros((self._capacity, dimensions), dtype=np.float32)
+        self._live[:] = False
+        self._rows.clear()
+        self._row_keys = [None] * self._capacity
+        self._row_scopes = [None] * self._capacity
+        self._free = list(range(self._capacity - 1, -1, -1))
+
+    def _grow(self):
+        """Duplica la capacidad (sólo si el LRU admite más entradas que filas)"""
+        old = self._capacity
+        self._capacity *= 2
+        matrix = np.zeros((self._capacity, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:old] = self._matrix
+        self._matrix = matrix
+        self._live = np.concatenate([self._live, np.zeros(old, dtype=bool)])
+        self._row_keys.extend([None] * old)
+        self._row_scopes.extend([None] * old)
+        self._free.extend(range(self._capacity - 1, old - 1, -1))
+
+    def set_generation(self, generation: Optional[str]):
+        """Invalida todo si cambió la réplica indexada (replica_tag)"""
+        if generation != self.generation:
+            if len(self):
+                self.clear()
+                self.invalidations += 1
+                logger.info(f"Result cache invalidated: replica {self.generation} -> {generation}")
+            self.generation = generation
+
+    def get(self, query: str, scope: str) -> Optional[List[Any]]:
+        return self._entries.get(self.key(query, scope))
+
+    def get_similar(self, embedding: List[float], scope: str) -> Optional[List[Any]]:
+        """Busca una query cacheada cuyo embedding supere el umbral de coseno"""
+        if self.similarity_threshold is None:
+            return None
+
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return None
+
+        with self._vectors_lock:
+            if not self._rows or self._matrix.shape[1] != len(query_vector):
+                return None
+            similarities = self._matrix @ (query_vector / norm)
+            # Sólo filas vivas sobre el umbral (pocas): se ordenan únicamente esas
+            candidates = np.flatnonzero(self._live & (similarities >= self.similarity_threshold))
+            candidates = candidates[np.argsort(-similarities[candidates])]
+            matches = [self._row_keys[row] for row in candidates if self._row_scopes[row] == scope]
+
+        for key in matches:
+            # El lookup ya contó (miss exacto + semantic_hits): sin doble conteo
+            result = self._entries.peek(key)
+            if result is not None:
+                self.semantic_hits += 1
+                return result
+        return None
+
+    def put(self, query: str, scope: str, chunks: List[Any], embedding: Optional[List[float]] = None):
+        key = self.key(query, scope)
+        self._entries.put(key, chunks)
+
+        if self.similarity_threshold is not None and embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                self._store_vector(key, scope, vector / norm)
+
+    def clear(self):
+        self._entries.clear()
+        with self._vectors_lock:
+            self._matrix = None
+            self._rows.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._entries.stats()
+        stats["semantic_hits"] = self.semantic_hits
+        stats["invalidations"] = self.invalidations
+        stats["generation"] = self.generation
+        return stats
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Embedding Providers - Proveedores de embeddings intercambiables
+OpenAI (remoto), modelo local sentence-transformers/ONNX en CPU con lotes
+ordenados por longitud e int8 opcional, o stub determinista por hashing
+"""
+import re
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import openai
+
+from .metrics import count_errors
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingProvider:
+    """Interfaz común: textos -> vectores (mismo orden)"""
+
+    name = "base"
+
+    def __init__(self, model: str, dimensions: int):
+        self.model = model
+        self.dimensions = dimensions
+
+    @property
+    def cache_namespace(self) -> str:
+        """Prefijo de clave de cache: vectores de proveedores distintos no se mezclan"""
+        return f"{self.name}:{self.model}"
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def aembed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embeddings sin bloquear el event loop (por defecto, en el executor)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.embed, list(texts))
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        self.close()
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings vía API de OpenAI (clientes sync y async)"""
+
+    name = "openai"
+
+    def __init__(self, model: str, dimensions: int, api_key: Optional[str] = None):
+        super().__init__(model, dimensions)
+        self.api_key = api_key or openai.api_key
+        self.client = openai.OpenAI(api_key=self.api_key)
+        self._async_client: Optional[openai.AsyncOpenAI] = None
+
+    @property
+    def cache_namespace(self) -> str:
+        # Sin prefijo: conserva las claves de caches persistidos previamente
+        return self.model
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(api_key=self.api_key)
+        return self._async_client
+
+    def embed(self, texts):
+        with count_errors('openai', 'embeddings'):
+            response = self.client.embeddings.create(
+                model=self.model,
+                input=list(texts),
+                dimensions=self.dimensions
+            )
+        return [data.embedding for data in response.data]
+
+    async def aembed(self, texts):
+        with count_errors('openai', 'embeddings'):
+            response = await self.async_client.embeddings.create(
+                model=self.model,
+                input=list(texts),
+                dimensions=self.dimensions
+            )
+        return [data.embedding for data in response.data]
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+        self.close()
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """Modelo sentence-transformers (torch u ONNX) en CPU, por lotes ordenados por longitud"""
+
+    name = "local"
+
+    def __init__(self, model: str, dimensions: Optional[int] = None, backend: str = 'torch',
+                 batch_size: int = 32, max_length: Optional[int] = 512, length_sort: bool = True,
+                 quantize_int8: bool = False, normalize: bool = True, device: str = 'cpu',
+                 onnx_file: Optional[str] = None):
+        # Import diferido: torch/sentence-transformers sólo si se usa este proveedor
+        from sentence_transformers import SentenceTransformer
+
+        model_kwargs = {'file_name': onnx_file} if backend == 'onnx' and onnx_file else None
+        self.encoder = SentenceTransformer(
+            model,
+            device=device,
+            backend=backend,
+            truncate_dim=dimensions,
+            model_kwargs=model_kwargs
+        )
+        if max_length:
+            self.encoder.max_seq_length = max_length
+        # truncate_dim nunca amplía: dimensiones reales del modelo (Matryoshka si son menos)
+        super().__init__(model, self.encoder.get_sentence_embedding_dimension())
+
+        if quantize_int8 and backend == 'torch':
+            # Cuantización dinámica de las capas lineales (pesos int8, activaciones float)
+            import torch
+            self.encoder = torch.quantization.quantize_dynamic(self.encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        elif quantize_int8:
+            logger.warning("quantize_int8 only applies to the torch backend; use a quantized onnx_file instead")
+
+        self.batch_size = batch_size
+        self.length_sort = length_sort
+        self.normalize = normalize
+        self.quantize_int8 = quantize_int8
+        logger.info(f"✅ Local embedding model loaded: {model} ({backend}, {self.dimensions} dims)")
+
+    @property
+    def cache_namespace(self) -> str:
+        suffix = ":int8" if self.quantize_int8 else ""
+        return f"{self.name}:{self.model}:{self.dimensions}{suffix}"
+
+    def embed(self, texts):
+        if not texts:
+            return []
+
+        order = list(range(len(texts)))
+        if self.length_sort and len(texts) > 1:
+            # Textos de longitud parecida en el mismo lote: menos padding
+            order.sort(key=lambda idx: len(texts[idx]))
+
+        encoded = self.encoder.encode(
+            [texts[idx] for idx in order],
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize,
+            show_progress_bar=False
+        )
+
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for idx, vector in zip(order, encoded):
+            vectors[idx] = vector.astype(np.float32).tolist()
+        return vectors
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """Stub determinista (feature hashing de tokens): tests y CI sin red ni modelo"""
+
+    name = "hash"
+
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, model: str = 'hash', dimensions: int = 256):
+        super().__init__(model, dimensions)
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in self.TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed(self, texts):
+        return [self._vector(text) for text in texts]
+
+    async def aembed(self, texts):
+        return self.embed(texts)
+
+def create_embedding_provider(embeddings_config: Dict[str, Any]) -> EmbeddingProvider:
+    """Crea el proveedor declarado en embeddings.provider"""
+    provider = embeddings_config.get('provider', 'openai')
+    model = embeddings_config.get('model', 'text-embedding-3-small')
+    dimensions = embeddings_config.get('dimensions', 1536)
+
+    if provider == 'openai':
+        return OpenAIEmbeddingProvider(model, dimensions, api_key=embeddings_config.get('api_key'))
+
+    if provider == 'local':
+        local_config = embeddings_config.get('local', {})
+        return LocalEmbeddingProvider(
+            local_config.get('model', model),
+            dimensions=dimensions,
+            backend=local_config.get('backend', 'torch'),
+            batch_size=local_config.get('batch_size', 32),
+            max_length=local_config.get('max_length', 512),
+            length_sort=local_config.get('length_sort', True),
+            quantize_int8=local_config.get('quantize_int8', False),
+            normalize=local_config.get('normalize', True),
+            device=local_config.get('device', 'cpu'),
+            onnx_file=local_config.get('onnx_file')
+        )
+
+    if provider == 'hash':
+        return HashEmbeddingProvider(model, dimensions)
+
+    raise ValueError(f"Unsupported embeddings.provider: {provider}")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Metrics - Instrumentación del servicio RAG sin dependencias externas
+Counters, gauges e histogramas con labels, exportados en formato de texto
+Prometheus (/metrics) y legibles en proceso (snapshot)
+"""
+import math
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Segundos: de 100µs (serialización, fusión) a 10s (embeddings remotos con reintentos)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+def bucket_quantile(q: float, buckets: Sequence[Tuple[float, float]]) -> Optional[float]:
+    """Cuantil estimado desde buckets acumulados [(le, count)] con interpolación
+    lineal dentro del bucket (como histogram_quantile de Prometheus)"""
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+class _Value:
+    """Valor numérico de un counter/gauge para una combinación de labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = float(value)
+
+class _HistogramValue:
+    """Conteos por bucket (no acumulados), suma y total de observaciones"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, float]]:
+        """Buckets acumulados [(le, count)], el último con le=+Inf"""
+        with self._lock:
+            counts = list(self.counts)
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+class Metric:
+    """Familia de series con los mismos labels; sin labels se usa directamente"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, Any] = {}
+
+    def _new_child(self) -> Any:
+        return _Value()
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def children(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        for key, child in self.children():
+            yield self.name, list(zip(self.labelnames, key)), child.value
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {"labels": dict(zip(self.labelnames, key)), "value": child.value}
+            for key, child in self.children()
+        ]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets if not math.isinf(bound)))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        for key, child in self.children():
+            labels = list(zip(self.labelnames, key))
+            buckets = child.cumulative()
+            for bound, count in buckets:
+                yield f"{self.name}_bucket", labels + [("le", _format_value(bound))], count
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, buckets[-1][1]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        series = []
+        for key, child in self.children():
+            buckets = child.cumulative()
+            series.append({
+                "labels": dict(zip(self.labelnames, key)),
+                "count": buckets[-1][1],
+                "sum": child.sum,
+                "p50": bucket_quantile(0.5, buckets),
+                "p95": bucket_quantile(0.95, buckets),
+                "p99": bucket_quantile(0.99, buckets),
+                "buckets": {_format_value(bound): count for bound, count in buckets}
+            })
+        return series
+
+Collector = Callable[[], Iterable[Metric]]
+
+class Registry:
+    """Métricas registradas + collectors evaluados en cada lectura (p.ej. stats de caches)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: Dict[str, Collector] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def set_collector(self, name: str, collector: Optional[Collector]):
+        """Registra (o reemplaza / quita con None) un collector"""
+        with self._lock:
+            if collector is None:
+                self._collectors.pop(name, None)
+            else:
+                self._collectors[name] = collector
+
+    def collect(self) -> Iterator[Metric]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        yield from metrics
+        for collector in collectors:
+            yield from collector()
+
+    def render(self) -> str:
+        """Exposición en formato de texto Prometheus 0.0.4"""
+        lines = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Vista en proceso: {nombre: {type, series}} (histogramas con p50/p95/p99 estimados)"""
+        return {
+            metric.name: {"type": metric.kind, "series": metric.snapshot()}
+            for metric in self.collect()
+        }
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each retrieval stage (embedding, vector_search, bm25, fusion, rerank, serialization, ...)",
+    ("endpoint", "stage")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_request_duration_seconds",
+    "End-to-end HTTP request duration, including streamed bodies",
+    ("endpoint",)
+)
+REQUESTS = REGISTRY.counter(
+    "rag_requests_total",
+    "HTTP requests by endpoint and status code",
+    ("endpoint", "status")
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "rag_requests_in_flight",
+    "HTTP requests currently being served",
+    ("endpoint",)
+)
+BACKEND_ERRORS = REGISTRY.counter(
+    "rag_backend_errors_total",
+    "Errors raised by external backends (qdrant, openai) by operation and exception type",
+    ("backend", "operation", "error")
+)
+
+def observe_timings(endpoint: str, timings_ms: Dict[str, float]):
+    """Registra un dict de tiempos por etapa (ms, como timings_ms) en el histograma"""
+    for stage, elapsed_ms in timings_ms.items():
+        STAGE_SECONDS.labels(endpoint, stage).observe(elapsed_ms / 1000)
+
+@contextmanager
+def count_errors(backend: str, operation: str):
+    """Cuenta (y re-lanza) las excepciones de una llamada a un backend externo"""
+    try:
+        yield
+    except Exception as e:
+        BACKEND_ERRORS.labels(backend, operation, type(e).__name__).inc()
+        raise
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Profiling - Sampling profiler por request para el API RAG
+Un hilo muestrea los stacks de todos los hilos (sys._current_frames) mientras
+haya requests perfiladas; cada request se guarda como collapsed stacks o
+speedscope JSON en un directorio con retención acotada. Con slow_threshold_ms
+se muestrea toda request (fracción slow_sample_rate) porque la duración recién
+se conoce al final: el sampler queda activo mientras haya tráfico.
+Cada muestra lleva el hilo y su atribución: en el hilo del loop [request],
+[other task], [loop] o [idle]; en los demás hilos [request] si ejecutan trabajo
+encolado por esta request (attributed), [other request] si es de otra request
+perfilada y [shared] si no tiene dueño (micro-batchers, pools ajenos)
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import inspect
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Hilos ociosos (workers del executor esperando trabajo): no aportan al perfil
+_IDLE_FILES = ('threading.py', 'queue.py', 'thread.py')
+# Loop esperando eventos (select/epoll): ninguna task en ejecución
+_LOOP_IDLE_FILES = ('selectors.py',)
+# Frames que sólo existen dentro de una task (corrutinas y generadores async)
+_TASK_CODE_FLAGS = inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+Frame = Tuple[str, str, int]
+
+# Sesión de la request en curso (la fija start en el contexto de su task)
+_CURRENT_SESSION: ContextVar[Optional["ProfileSession"]] = ContextVar("rag_profile_session", default=None)
+# Hilo -> sesión dueña del trabajo que ejecuta en este momento
+_THREAD_SESSIONS: Dict[int, "ProfileSession"] = {}
+
+def attributed(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve trabajo que se encola en un executor desde una request (llamar en
+    su task): mientras corre, el hilo del worker se atribuye a esa request"""
+    session = _CURRENT_SESSION.get()
+    if session is None:
+        return fn
+
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        _THREAD_SESSIONS[ident] = session
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _THREAD_SESSIONS.pop(ident, None)
+    return run
+
+class ProfileSession:
+    """Muestras tomadas durante una request: (hilo, stack raíz -> hoja, peso en ms)"""
+
+    def __init__(self, name: str, max_samples: int, task: Optional[asyncio.Task] = None):
+        self.name = name
+        self.task = task
+        # Frame raíz de la task: está en el stack del hilo del loop sólo mientras corre
+        self.task_frame = getattr(task.get_coro(), 'cr_frame', None) if task is not None else None
+        self.loop_thread = threading.get_ident() if task is not None else None
+        self.max_samples = max_samples
+        self.started_at = time.perf_counter()
+        self.samples: List[Tuple[str, Tuple[Frame, ...], float]] = []
+        self.dropped = 0
+        self._token = None
+
+    def add(self, thread: str, stack: Tuple[Frame, ...], weight_ms: float):
+        if len(self.samples) >= self.max_samples:
+            self.dropped += 1
+            return
+        self.samples.append((thread, stack, weight_ms))
+
+    def collapsed(self) -> str:
+        """Formato collapsed stacks (flamegraph.pl, speedscope, inferno): 'a;b;c <ms>'"""
+        totals: Counter = Counter()
+        for thread, stack, weight_ms in self.samples:
+            names = [thread] + [f"{function} ({Path(filename).name}:{line})" for function, filename, line in stack]
+            totals[";".join(names)] += weight_ms
+        return "".join(f"{stack} {round(weight)}\n" for stack, weight in totals.items() if round(weight) > 0)
+
+    def speedscope(self, elapsed_ms: float) -> Dict[str, Any]:
+        """Perfil speedscope 'sampled': un perfil por hilo, frames compartidos"""
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[Frame, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+        for thread, stack, weight_ms in self.samples:
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    function, filename, line = frame
+                    frames.append({"name": function, "file": filename, "line": line})
+                indices.append(frame_index[frame])
+            profile = profiles.setdefault(thread, {
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(elapsed_ms, 3),
+                "samples": [],
+                "weights": []
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(round(weight_ms, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "rag-serve-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values())
+        }
+
+class SamplingProfiler:
+    """Sampler compartido: muestrea sólo mientras haya sesiones abiertas"""
+
+    def __init__(self, output_dir: str, interval_ms: float = 10.0, sample_rate: float = 0.0,
+                 slow_threshold_ms: Optional[float] = None, output_format: str = 'speedscope',
+                 max_files: int = 200, max_samples: int = 20000, max_depth: int = 128,
+                 slow_sample_rate: float = 1.0):
+        if output_format not in ('speedscope', 'collapsed'):
+            raise ValueError(f"Unsupported profiling.format: {output_format}")
+        self.output_dir = Path(output_dir)
+        self.interval_s = interval_ms / 1000
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_sample_rate = slow_sample_rate
+        self.output_format = output_format
+        self.max_files = max_files
+        self.max_samples = max_samples
+        self.max_depth = max_depth
+
+        self._lock = threading.Lock()
+        self._sessions: List[ProfileSession] = []
+        self._active = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.profiles_written = 0
+
+    @classmethod
+    def from_config(cls, profiling_config: Dict[str, Any]) -> Optional["SamplingProfiler"]:
+        """Profiler desde la sección profiling (None si está desactivado)"""
+        if not profiling_config.get('enabled', False):
+            return None
+        return cls(
+            output_dir=profiling_config.get('output_dir', 'artifacts/profiles'),
+            interval_ms=profiling_config.get('interval_ms', 10),
+            sample_rate=profiling_config.get('sample_rate', 0.0),
+            slow_threshold_ms=profiling_config.get('slow_threshold_ms'),
+            slow_sample_rate=profiling_config.get('slow_sample_rate', 1.0),
+            output_format=profiling_config.get('format', 'speedscope'),
+            max_files=profiling_config.get('max_files', 200),
+            max_samples=profiling_config.get('max_samples', 20000)
+        )
+
+    def should_profile(self) -> Tuple[bool, bool]:
+        """(muestrear, guardar siempre): con umbral la duración se conoce al final,
+        así que se muestrea la fracción slow_sample_rate de las requests (1.0 = todas)"""
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        watched = self.slow_threshold_ms is not None and random.random() < self.slow_sample_rate
+        return sampled or watched, sampled
+
+    def start(self, name: str, task: Optional[asyncio.Task] = None) -> ProfileSession:
+        """Abre una sesión; task = la de la request (asyncio.current_task() en el
+        middleware) para distinguirla de otras tasks en el hilo del loop"""
+        session = ProfileSession(name, self.max_samples, task)
+        session._token = _CURRENT_SESSION.set(session)
+        if task is None:
+            # Sin task (llamada síncrona): el hilo que la abre es el de la request
+            _THREAD_SESSIONS[threading.get_ident()] = session
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rag-profiler", daemon=True)
+                self._thread.start()
+            self._sessions.append(session)
+            self._active.set()
+        return session
+
+    def stop(self, session: ProfileSession):
+        if session._token is not None:
+            try:
+                _CURRENT_SESSION.reset(session._token)
+            except ValueError:  # stop desde otro contexto: la task ya no lo usa
+                pass
+            session._token = None
+        for ident, owner in list(_THREAD_SESSIONS.items()):
+            if owner is session:
+                _THREAD_SESSIONS.pop(ident, None)
+        with self._lock:
+            self._sessions.remove(session)
+            if not self._sessions:
+                self._active.clear()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        last = time.perf_counter()
+        while not self._closed:
+            if not self._active.is_set():
+                self._active.wait(1.0)
+                last = time.perf_counter()
+                continue
+            time.sleep(self.interval_s)
+            now = time.perf_counter()
+            weight_ms = (now - last) * 1000
+            last = now
+            with self._lock:
+                sessions = list(self._sessions)
+            if sessions:
+                self._sample(sessions, own_ident, weight_ms)
+
+    @staticmethod
+    def _loop_state(frame, task_frame) -> str:
+        """Qué corre en el hilo del loop: la request, otra task (bloqueándola),
+        el loop fuera de toda task (callbacks; también la espera en uvloop) o nada"""
+        if frame.f_code.co_filename.endswith(_LOOP_IDLE_FILES):
+            return "idle"
+        in_task = False
+        while frame is not None:
+            if frame is task_frame:
+                return "request"
+            in_task = in_task or bool(frame.f_code.co_flags & _TASK_CODE_FLAGS)
+            frame = frame.f_back
+        return "other task" if in_task else "loop"
+
+    def _stack(self, frame) -> Tuple[Frame, ...]:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append((getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _sample(self, sessions: List[ProfileSession], own_ident: int, weight_ms: float):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        loop_threads = {session.loop_thread for session in sessions}
+        owners = dict(_THREAD_SESSIONS)
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            if ident not in loop_threads and frame.f_code.co_filename.endswith(_IDLE_FILES):
+                continue
+            stack = self._stack(frame)
+            thread = names.get(ident, f"thread-{ident}")
+            owner = owners.get(ident)
+            for session in sessions:
+                if ident == session.loop_thread and session.task_frame is not None:
+                    state = self._loop_state(frame, session.task_frame)
+                elif owner is None:
+                    state = "shared"
+                else:
+                    state = "request" if owner is session else "other request"
+                session.add(f"{thread} [{state}]", stack, weight_ms)
+
+    def finish(self, session: ProfileSession, elapsed_ms: float, keep: bool) -> Optional[str]:
+        """Cierra la sesión; motivo para guardarla ('slow' | 'sampled') o None si se descarta"""
+        self.stop(session)
+        if not session.samples:
+            return None
+        if self.slow_threshold_ms is not None and elapsed_ms >= self.slow_threshold_ms:
+            return "slow"
+        return "sampled" if keep else None
+
+    def write(self, session: ProfileSession, elapsed_ms: float, reason: str, tag: str) -> Path:
+        """Escribe el perfil de la sesión y aplica la retención del directorio"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        suffix = '.speedscope.json' if self.output_format == 'speedscope' else '.collapsed.txt'
+        path = self.output_dir / f"{stamp}_{tag}_{elapsed_ms:.0f}ms_{reason}{suffix}"
+
+        if self.output_format == 'speedscope':
+            content = json.dumps(session.speedscope(elapsed_ms))
+        else:
+            content = session.collapsed()
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(content, encoding='utf-8')
+        os.replace(tmp_path, path)
+
+        self.profiles_written += 1
+        if session.dropped:
+            logger.warning(f"Profile {path.name} truncated: {session.dropped} samples over max_samples")
+        logger.info(f"🔬 Profile written: {path} ({len(session.samples)} samples, {elapsed_ms:.0f}ms)")
+        self._enforce_retention()
+        return path
+
+    def _enforce_retention(self):
+        """Conserva sólo los max_files perfiles más recientes"""
+        profiles = [path for path in self.output_dir.iterdir()
+                    if path.name.endswith(('.speedscope.json', '.collapsed.txt'))]
+        if len(profiles) <= self.max_files:
+            return
+        profiles.sort(key=lambda path: path.name)
+        for path in profiles[:len(profiles) - self.max_files]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self._sessions),
+            "profiles_written": self.profiles_written,
+            "sample_rate": self.sample_rate,
+            "slow_threshold_ms": self.slow_threshold_ms,
+            "slow_sample_rate": self.slow_sample_rate,
+            "interval_ms": self.interval_s * 1000,
+            "format": self.output_format,
+            "output_dir": str(self.output_dir)
+        }
+
+    def close(self):
+        self._closed = True
+        self._active.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
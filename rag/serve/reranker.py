@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Rerank Engine - Reranking con cross-encoder por lotes
+Ordena pares por longitud para minimizar padding, respeta batch_size/max_length
+y cachea scores por (query, chunk_hash); opcionalmente agrupa entre requests
+"""
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sentence_transformers import CrossEncoder
+
+from .batching import MicroBatcher
+from .cache import LRUCache, normalize_text
+
+logger = logging.getLogger(__name__)
+
+def chunk_identity(content: str, metadata: Dict[str, Any]) -> str:
+    """Identidad estable de un chunk (chunk_hash o hash del contenido)"""
+    chunk_hash = metadata.get('chunk_hash')
+    if chunk_hash:
+        return chunk_hash
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+class RerankEngine:
+    """Cross-encoder con batching por longitud, presupuesto y cache de scores"""
+
+    def __init__(self, model, batch_size: int = 32, max_length: Optional[int] = 512,
+                 max_candidates: Optional[int] = None, cache_entries: int = 50000,
+                 length_sort: bool = True):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.max_candidates = max_candidates
+        self.length_sort = length_sort
+        self.score_cache = LRUCache(max_entries=cache_entries) if cache_entries else None
+
+        # Contadores actualizados desde los hilos del executor
+        self._stats_lock = threading.Lock()
+        self.pairs_scored = 0
+        self.pairs_cached = 0
+
+    @classmethod
+    def from_config(cls, reranker_config: Dict[str, Any]) -> Optional["RerankEngine"]:
+        """Carga el CrossEncoder declarado en la sección reranker"""
+        if not reranker_config.get('enabled', False):
+            logger.info("Reranker disabled")
+            return None
+
+        model_name = reranker_config['model']
+        max_length = reranker_config.get('max_length', 512)
+        try:
+            model = CrossEncoder(model_name, max_length=max_length)
+            logger.info(f"✅ Reranker loaded: {model_name}")
+        except Exception as e:
+            logger.error(f"❌ Error loading reranker: {e}")
+            return None
+
+        return cls(
+            model,
+            batch_size=reranker_config.get('batch_size', 32),
+            max_length=max_length,
+            max_candidates=reranker_config.get('max_candidates'),
+            cache_entries=reranker_config.get('score_cache_entries', 50000),
+            length_sort=reranker_config.get('length_sort', True)
+        )
+
+    @staticmethod
+    def _pair_lengths(pairs: Sequence[Tuple[str, str]]) -> List[int]:
+        """Longitud aproximada de cada par en caracteres (proxy de tokens: tokenizar
+        aquí duplicaría el trabajo que ya hace CrossEncoder.predict)"""
+        return [len(query) + len(content) for query, content in pairs]
+
+    def predict_pairs(self, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+        """Scorea pares (query, contenido) ordenados por longitud; retorna en el orden original"""
+        if not pairs:
+            return []
+
+        order = list(range(len(pairs)))
+        if self.length_sort and len(pairs) > 1:
+            lengths = self._pair_lengths(pairs)
+            order.sort(key=lengths.__getitem__)
+
+        # Orden por longitud: cada lote de batch_size queda con padding mínimo
+        predicted = self.model.predict(
+            [list(pairs[idx]) for idx in order],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+
+        scores = [0.0] * len(pairs)
+        for idx, value in zip(order, predicted):
+            scores[idx] = float(value)
+        with self._stats_lock:
+            self.pairs_scored += len(pairs)
+        return scores
+
+    def _lookup(self, query: str, identities: Sequence[str]) -> Tuple[str, List[Optional[float]], List[int]]:
+        """Scores cacheados y posiciones pendientes de scorear"""
+        query_key = hashlib.sha256(normalize_text(query).encode('utf-8')).hexdigest()
+        scores: List[Optional[float]] = [None] * len(identities)
+
+        pending: List[int] = []
+        for idx, identity in enumerate(identities):
+            cached = self.score_cache.get(f"{query_key}:{identity}") if self.score_cache else None
+            if cached is None:
+                pending.append(idx)
+            else:
+                scores[idx] = cached
+        with self._stats_lock:
+            self.pairs_cached += len(identities) - len(pending)
+        return query_key, scores, pending
+
+    def _store(self, query_key: str, identities: Sequence[str], pending: List[int],
+               predicted: Sequence[float], scores: List[Optional[float]]):
+        """Completa los scores pendientes y los cachea"""
+        for idx, value in zip(pending, predicted):
+            scores[idx] = value
+            if self.score_cache is not None:
+                self.score_cache.put(f"{query_key}:{identities[idx]}", value)
+
+    def score(self, query: str, contents: Sequence[str], identities: Sequence[str]) -> List[float]:
+        """Scores del cross-encoder para cada contenido (con cache)"""
+        query_key, scores, pending = self._lookup(query, identities)
+        if pending:
+            predicted = self.predict_pairs([(query, contents[idx]) for idx in pending])
+            self._store(query_key, identities, pending, predicted, scores)
+        return scores
+
+    def score_many(self, requests: Sequence[Tuple[str, Sequence[str], Sequence[str]]]) -> List[List[float]]:
+        """score() de varias queries [(query, contents, identities)] con una sola
+        pasada del cross-encoder sobre todos los pares pendientes"""
+        lookups = [self._lookup(query, identities) for query, _, identities in requests]
+        pairs = [
+            (query, contents[idx])
+            for (query, contents, _), (_, _, pending) in zip(requests, lookups)
+            for idx in pending
+        ]
+        predicted = self.predict_pairs(pairs)
+
+        offset = 0
+        results = []
+        for (_, _, identities), (query_key, scores, pending) in zip(requests, lookups):
+            self._store(query_key, identities, pending, predicted[offset:offset + len(pending)], scores)
+            offset += len(pending)
+            results.append(scores)
+        return results
+
+    async def ascore(self, query: str, contents: Sequence[str], identities: Sequence[str],
+                     batcher: MicroBatcher) -> List[float]:
+        """Como score(), pero los pares pendientes viajan por el micro-batcher
+        compartido con otras requests en vuelo"""
+        query_key, scores, pending = self._lookup(query, identities)
+        if pending:
+            predicted = await batcher.submit_many([(query, contents[idx]) for idx in pending])
+            self._store(query_key, identities, pending, predicted, scores)
+        return scores
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batch_size": self.batch_size,
+            "max_length": self.max_length,
+            "max_candidates": self.max_candidates,
+            "pairs_scored": self.pairs_scored,
+            "pairs_cached": self.pairs_cached,
+            "score_cache": self.score_cache.stats() if self.score_cache else None
+        }
@@ -4,18 +4,24 @@ Hybrid Retriever - BM25 + Vector + Reranking
 Implementa recuperación híbrida con fusión RRF y reranking
 """
 import time
+import json
+import threading
 import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
-from collections import defaultdict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Hashable
+from dataclasses import dataclass, replace
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
-import openai
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from sentence_transformers import CrossEncoder
 import yaml
 
+from .bm25 import BM25Index
+from .cache import EmbeddingCache, ResultCache
+from .embeddings import create_embedding_provider
+from .reranker import RerankEngine, chunk_identity
+from .vector_store import create_vector_store
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,6 +33,7 @@ class Chunk:
     metadata: Dict[str, Any]
     score: float = 0.0
     retrieval_method: str = ""
+    point_id: Optional[Any] = None
 
 class HybridRetriever:
     """Retriever híbrido BM25 + Vector + Reranking"""
@@ -44,106 +51,126 @@ class HybridRetriever:
         # Configurar clientes
         self._setup_clients()
         
-        # Configurar BM25 (simulado con tf-idf básico)
+        # Cache de resultados finales (invalidado por replica_tag del índice)
+        self.result_cache_config = self.config.get('result_cache', {})
+        self.result_cache = ResultCache(
+            max_entries=self.result_cache_config.get('max_entries', 2000),
+            ttl_s=self.result_cache_config.get('ttl_s'),
+            similarity_threshold=self.result_cache_config.get('similarity_threshold')
+        ) if self.result_cache_config.get('enabled', False) else None
+        self.config_hash = hashlib.sha256(
+            json.dumps(
+                {key: self.config.get(key) for key in ('index', 'retrieval', 'reranker', 'embeddings', 'bm25')},
+                sort_keys=True, default=str
+            ).encode('utf-8')
+        ).hexdigest()
+        
+        # Configurar BM25 (índice invertido persistente)
         self.bm25_config = self.config.get('bm25', {})
         self.k1 = self.bm25_config.get('k1', 1.2)
         self.b = self.bm25_config.get('b', 0.75)
+        self.epsilon = self.bm25_config.get('epsilon', 0.25)
+        self.bm25_index_path = self.bm25_config.get('index_path')
+        self.bm25_reload_interval = self.bm25_config.get('reload_interval_s', 30)
+        self._bm25_mtime = 0.0
+        self._bm25_checked_at = time.time()
+        # Un solo hilo recarga; el resto sigue con el índice actual
+        self._bm25_lock = threading.Lock()
+        self.bm25_index = self._load_bm25_index()
         
         # Configurar reranker
         self._setup_reranker()
         
-        # Cache de embeddings
-        self.embedding_cache = {}
+        # Cache de embeddings (LRU acotado + tier opcional en disco)
+        self.embedding_cache = EmbeddingCache.from_config(
+            self.embedding_provider.cache_namespace,
+            self.embedding_dimensions,
+            self.embeddings_config.get('cache', {})
+        )
+        
+        # Ejecución concurrente de las piernas vector/BM25
+        self.parallel = self.retrieval_config.get('parallel', True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.retrieval_config.get('max_workers', 4),
+            thread_name_prefix="retriever"
+        ) if self.parallel else None
     
     def _setup_clients(self):
         """Configura clientes de servicios externos"""
-        # Qdrant
-        self.qdrant_client = QdrantClient(url=self.index_config.get('url', 'http://localhost:6333'))
+        # Backend vectorial (index.type: qdrant | local)
+        self.vector_store = create_vector_store(self.index_config)
         self.collection_name = self.index_config['collection']
         
-        # OpenAI
-        self.openai_client = openai.OpenAI(
-            api_key=self.embeddings_config.get('api_key')
-        )
-        self.embedding_model = self.embeddings_config['model']
-        self.embedding_dimensions = self.embeddings_config['dimensions']
+        # Embeddings (embeddings.provider: openai | local | hash)
+        self.embedding_provider = create_embedding_provider(self.embeddings_config)
+        self.embedding_model = self.embedding_provider.model
+        self.embedding_dimensions = self.embedding_provider.dimensions
     
     def _setup_reranker(self):
         """Configura el modelo de reranking"""
-        if self.reranker_config.get('enabled', False):
-            model_name = self.reranker_config['model']
-            try:
-                self.reranker = CrossEncoder(model_name)
-                logger.info(f"✅ Reranker loaded: {model_name}")
-            except Exception as e:
-                logger.error(f"❌ Error loading reranker: {e}")
-                self.reranker = None
-        else:
-            self.reranker = None
-            logger.info("Reranker disabled")
+        self.rerank_engine = RerankEngine.from_config(self.reranker_config)
+        self.reranker = self.rerank_engine.model if self.rerank_engine else None
     
     def get_embedding(self, text: str) -> List[float]:
         """Obtiene embedding para un texto (con cache)"""
-        # Cache key
-        cache_key = hashlib.md5(text.encode()).hexdigest()
-        
-        if cache_key in self.embedding_cache:
-            return self.embedding_cache[cache_key]
+        cached = self.embedding_cache.get(text)
+        if cached is not None:
+            return cached
         
         try:
-            response = self.openai_client.embeddings.create(
-                model=self.embedding_model,
-                input=text,
-                dimensions=self.embedding_dimensions
-            )
-            embedding = response.data[0].embedding
+            embedding = self.embedding_provider.embed([text])[0]
             
             # Cachear
-            self.embedding_cache[cache_key] = embedding
+            self.embedding_cache.put(text, embedding)
             
             return embedding
         except Exception as e:
             logger.error(f"Error getting embedding: {e}")
             raise
     
-    def vector_search(self, query: str, k: int, filters: Optional[Dict] = None) -> List[Chunk]:
-        """Búsqueda vectorial en Qdrant"""
-        try:
-            # Obtener embedding de la query
-            query_embedding = self.get_embedding(query)
-            
-            # Construir filtros
-            qdrant_filter = None
-            if filters:
-                conditions = []
-                for key, value in filters.items():
-                    conditions.append(
-                        FieldCondition(
-                            key=key,
-                            match=MatchValue(value=value)
-                        )
-                    )
-                qdrant_filter = Filter(must=conditions)
-            
-            # Buscar en Qdrant
-            search_results = self.qdrant_client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=k,
-                query_filter=qdrant_filter
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings de varios textos: los que faltan en cache, en la menor cantidad
+        de llamadas al proveedor (batch_size inputs por llamada)"""
+        embeddings = [self.embedding_cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if not missing:
+            return embeddings
+        
+        batch_size = self.embeddings_config.get('batch_size', 100)
+        computed: Dict[str, List[float]] = {}
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            computed.update(zip(batch, self.embedding_provider.embed(batch)))
+        for text, embedding in computed.items():
+            self.embedding_cache.put(text, embedding)
+        return [embedding if embedding is not None else computed[text] for text, embedding in zip(texts, embeddings)]
+    
+    @staticmethod
+    def _to_vector_chunks(search_results) -> List[Chunk]:
+        """Convierte hits del backend vectorial a Chunks"""
+        chunks = []
+        for result in search_results:
+            chunk = Chunk(
+                content=result.payload.get('content', ''),
+                metadata=result.payload,
+                score=result.score,
+                retrieval_method="vector",
+                point_id=result.id
             )
+            chunks.append(chunk)
+        return chunks
+    
+    def vector_search(self, query: str, k: int, filters: Optional[Dict] = None,
+                      query_embedding: Optional[List[float]] = None) -> List[Chunk]:
+        """Búsqueda vectorial en el backend configurado"""
+        try:
+            # Obtener embedding de la query (salvo que venga precalculado)
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query)
             
-            # Convertir a Chunks
-            chunks = []
-            for result in search_results:
-                chunk = Chunk(
-                    content=result.payload.get('content', ''),
-                    metadata=result.payload,
-                    score=result.score,
-                    retrieval_method="vector"
-                )
-                chunks.append(chunk)
+            search_results = self.vector_store.search(query_embedding, k, filters)
             
+            chunks = self._to_vector_chunks(search_results)
             logger.info(f"Vector search returned {len(chunks)} chunks")
             return chunks
             
@@ -151,45 +178,97 @@ class HybridRetriever:
             logger.error(f"Error in vector search: {e}")
             return []
     
-    def bm25_search(self, query: str, k: int, filters: Optional[Dict] = None) -> List[Chunk]:
-        """Búsqueda BM25 (simulada)"""
-        # Para simplificar, simulamos BM25 con búsqueda por texto
-        # En producción usarías Elasticsearch o similar
+    def _load_bm25_index(self) -> BM25Index:
+        """Carga el índice BM25 persistido o lo construye desde el backend vectorial"""
+        if self.bm25_index_path and Path(self.bm25_index_path).exists():
+            try:
+                self._bm25_mtime = Path(self.bm25_index_path).stat().st_mtime
+                index = BM25Index.load(self.bm25_index_path)
+                # Los parámetros de scoring vienen siempre de la configuración
+                index.k1, index.b, index.epsilon = self.k1, self.b, self.epsilon
+                if self.result_cache is not None:
+                    self.result_cache.set_generation(index.replica_tag)
+                return index
+            except Exception as e:
+                logger.error(f"Error loading BM25 index, rebuilding: {e}")
+        
+        return self.rebuild_bm25_index()
+    
+    def rebuild_bm25_index(self) -> BM25Index:
+        """Reconstruye el índice BM25 recorriendo todos los payloads del backend"""
+        index = BM25Index(
+            k1=self.k1, b=self.b, epsilon=self.epsilon,
+            compact_ratio=self.bm25_config.get('compact_ratio', 0.2)
+        )
+        scroll_batch = self.bm25_config.get('scroll_batch', 1000)
+        
         try:
-            # Obtener todos los puntos (limitado para demo)
-            scroll_results = self.qdrant_client.scroll(
-                collection_name=self.collection_name,
-                limit=1000,
-                with_payload=True
-            )
+            # Quedarse con la versión más reciente de cada (doc_id, chunk_idx)
+            latest: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+            offset = None
+            while True:
+                points, offset = self.vector_store.scroll(scroll_batch, offset)
+                for point in points:
+                    payload = point.payload or {}
+                    key = (payload.get('doc_id', point.id), payload.get('chunk_idx'))
+                    current = latest.get(key)
+                    if current is None or payload.get('upserted_at', '') >= current.get('upserted_at', ''):
+                        latest[key] = payload
+                if offset is None:
+                    break
             
-            # Simular scoring BM25
-            query_terms = query.lower().split()
-            scored_chunks = []
+            index.add_many((payload.get('content', ''), payload) for payload in latest.values())
+            if latest:
+                newest = max(latest.values(), key=lambda payload: payload.get('upserted_at', ''))
+                index.replica_tag = newest.get('replica_tag')
+            logger.info(f"✅ BM25 index built: {len(index)} chunks")
             
-            for point in scroll_results[0]:
-                content = point.payload.get('content', '').lower()
-                
-                # Calcular score BM25 simplificado
-                score = 0.0
-                for term in query_terms:
-                    term_freq = content.count(term)
-                    if term_freq > 0:
-                        # TF-IDF simplificado
-                        score += term_freq / (term_freq + self.k1 * (1 - self.b + self.b * len(content.split()) / 100))
-                
-                if score > 0:
-                    chunk = Chunk(
-                        content=point.payload.get('content', ''),
-                        metadata=point.payload,
-                        score=score,
-                        retrieval_method="bm25"
-                    )
-                    scored_chunks.append(chunk)
+            if self.bm25_index_path:
+                index.save(self.bm25_index_path)
+                self._bm25_mtime = Path(self.bm25_index_path).stat().st_mtime
+        except Exception as e:
+            logger.error(f"Error building BM25 index: {e}")
+        
+        self.bm25_index = index
+        if self.result_cache is not None:
+            self.result_cache.set_generation(index.replica_tag)
+        return index
+    
+    def _bm25_reload_due(self) -> bool:
+        """¿Pasó el intervalo desde la última comprobación del índice en disco?"""
+        return bool(self.bm25_index_path) and time.time() - self._bm25_checked_at >= self.bm25_reload_interval
+    
+    def _maybe_reload_bm25(self):
+        """Recarga el índice si la ingesta lo actualizó en disco"""
+        if not self._bm25_reload_due() or not self._bm25_lock.acquire(blocking=False):
+            return
+        try:
+            if not self._bm25_reload_due():
+                return
+            self._bm25_checked_at = time.time()
             
-            # Ordenar por score y tomar top-k
-            scored_chunks.sort(key=lambda x: x.score, reverse=True)
-            chunks = scored_chunks[:k]
+            try:
+                mtime = Path(self.bm25_index_path).stat().st_mtime
+            except OSError:
+                return
+            if mtime > self._bm25_mtime:
+                self.bm25_index = self._load_bm25_index()
+        finally:
+            self._bm25_lock.release()
+    
+    def bm25_search(self, query: str, k: int, filters: Optional[Dict] = None) -> List[Chunk]:
+        """Búsqueda BM25 sobre el índice invertido"""
+        try:
+            self._maybe_reload_bm25()
+            chunks = [
+                Chunk(
+                    content=payload.get('content', ''),
+                    metadata=payload,
+                    score=score,
+                    retrieval_method="bm25"
+                )
+                for payload, score in self.bm25_index.search(query, k, filters)
+            ]
             
             logger.info(f"BM25 search returned {len(chunks)} chunks")
             return chunks
@@ -198,175 +277,379 @@ class HybridRetriever:
             logger.error(f"Error in BM25 search: {e}")
             return []
     
-    def reciprocal_rank_fusion(self, vector_chunks: List[Chunk], bm25_chunks: List[Chunk], k: int = 60) -> List[Chunk]:
-        """Fusión RRF (Reciprocal Rank Fusion)"""
-        # Crear mapas de contenido a score
-        vector_scores = {}
-        bm25_scores = {}
-        
-        for i, chunk in enumerate(vector_chunks):
-            content_key = chunk.content[:100]  # Usar inicio del contenido como key
-            vector_scores[content_key] = 1.0 / (k + i + 1)
-        
-        for i, chunk in enumerate(bm25_chunks):
-            content_key = chunk.content[:100]
-            bm25_scores[content_key] = 1.0 / (k + i + 1)
-        
-        # Fusionar scores
-        fused_scores = defaultdict(float)
-        all_chunks = {}
-        
-        # Agregar chunks vectoriales
-        for chunk in vector_chunks:
-            content_key = chunk.content[:100]
-            fused_scores[content_key] += vector_scores[content_key]
-            all_chunks[content_key] = chunk
-        
-        # Agregar chunks BM25
-        for chunk in bm25_chunks:
-            content_key = chunk.content[:100]
-            fused_scores[content_key] += bm25_scores[content_key]
-            if content_key not in all_chunks:
-                all_chunks[content_key] = chunk
-        
-        # Ordenar por score fusionado
-        sorted_chunks = sorted(
-            all_chunks.items(),
-            key=lambda x: fused_scores[x[0]],
-            reverse=True
-        )
+    @staticmethod
+    def fusion_key(chunk: Chunk) -> Hashable:
+        """Identidad del chunk, la misma en ambas piernas: (doc_id, chunk_idx)
+        del payload o, si falta, el contenido"""
+        metadata = chunk.metadata
+        doc_id = metadata.get('doc_id')
+        chunk_idx = metadata.get('chunk_idx')
+        if doc_id is not None and chunk_idx is not None:
+            return (doc_id, chunk_idx)
+        return chunk.content
+    
+    def reciprocal_rank_fusion(self, legs: Dict[str, List[Chunk]], k: int = 60,
+                               weights: Optional[Dict[str, float]] = None) -> List[Chunk]:
+        """Fusión RRF (Reciprocal Rank Fusion) ponderada sobre N piernas"""
+        if weights is None:
+            weights = self.retrieval_config.get('fusion_weights') or {}
         
-        # Crear chunks fusionados
-        fused_chunks = []
-        for content_key, chunk in sorted_chunks:
-            fused_chunk = Chunk(
-                content=chunk.content,
-                metadata=chunk.metadata,
-                score=fused_scores[content_key],
-                retrieval_method="hybrid_rrf"
-            )
-            fused_chunks.append(fused_chunk)
+        # Una sola pasada: key -> [score acumulado, primer chunk visto]
+        fused: Dict[Hashable, List[Any]] = {}
+        for leg_name, chunks in legs.items():
+            weight = weights.get(leg_name, 1.0)
+            for rank, chunk in enumerate(chunks):
+                key = self.fusion_key(chunk)
+                contribution = weight / (k + rank + 1)
+                entry = fused.get(key)
+                if entry is None:
+                    fused[key] = [contribution, chunk]
+                else:
+                    entry[0] += contribution
+        
+        ordered = sorted(fused.values(), key=itemgetter(0), reverse=True)
+        
+        # Copias: los chunks de las piernas (ya emitidos en streaming) no se mutan
+        fused_chunks = [
+            replace(chunk, score=score, retrieval_method="hybrid_rrf")
+            for score, chunk in ordered
+        ]
         
         logger.info(f"RRF fusion returned {len(fused_chunks)} chunks")
         return fused_chunks
     
+    def _rerank_candidates(self, chunks: List[Chunk]) -> List[Chunk]:
+        """Presupuesto: sólo los mejores candidatos de la fusión pasan al cross-encoder"""
+        max_candidates = self.rerank_engine.max_candidates
+        return chunks[:max_candidates] if max_candidates else chunks
+    
+    @staticmethod
+    def _apply_rerank_scores(candidates: List[Chunk], rerank_scores: List[float], top_k: int) -> List[Chunk]:
+        """Actualiza scores de reranking y ordena"""
+        reranked_chunks = []
+        for chunk, score in zip(candidates, rerank_scores):
+            chunk.score = score
+            chunk.retrieval_method = f"{chunk.retrieval_method}_reranked"
+            reranked_chunks.append(chunk)
+        
+        # Ordenar por score de reranking
+        reranked_chunks.sort(key=lambda x: x.score, reverse=True)
+        
+        logger.info(f"Reranking returned {len(reranked_chunks)} chunks")
+        return reranked_chunks[:top_k]
+    
     def rerank_chunks(self, query: str, chunks: List[Chunk], top_k: int) -> List[Chunk]:
         """Rerankea chunks usando modelo de reranking"""
-        if not self.reranker or not chunks:
+        if not self.rerank_engine or not chunks:
             return chunks[:top_k]
         
         try:
-            # Preparar pares query-chunk para reranking
-            pairs = []
-            for chunk in chunks:
-                pairs.append([query, chunk.content])
-            
-            # Reranking
-            rerank_scores = self.reranker.predict(pairs)
-            
-            # Actualizar scores y ordenar
-            reranked_chunks = []
-            for chunk, score in zip(chunks, rerank_scores):
-                chunk.score = float(score)
-                chunk.retrieval_method = f"{chunk.retrieval_method}_reranked"
-                reranked_chunks.append(chunk)
-            
-            # Ordenar por score de reranking
-            reranked_chunks.sort(key=lambda x: x.score, reverse=True)
-            
-            logger.info(f"Reranking returned {len(reranked_chunks)} chunks")
-            return reranked_chunks[:top_k]
+            candidates = self._rerank_candidates(chunks)
+            rerank_scores = self.rerank_engine.score(
+                query,
+                [chunk.content for chunk in candidates],
+                [chunk_identity(chunk.content, chunk.metadata) for chunk in candidates]
+            )
+            return self._apply_rerank_scores(candidates, rerank_scores, top_k)
             
         except Exception as e:
             logger.error(f"Error in reranking: {e}")
             return chunks[:top_k]
     
-    def retrieve(self, query: str, k: int = None, filters: Optional[Dict] = None) -> List[Chunk]:
-        """Método principal de recuperación híbrida"""
-        if k is None:
-            k = self.retrieval_config.get('top_k_vector', 12)
+    def rerank_many(self, queries: List[str], chunk_lists: List[List[Chunk]], top_k: int) -> List[List[Chunk]]:
+        """rerank_chunks() de varias queries en una sola pasada del cross-encoder"""
+        if not self.rerank_engine:
+            return [chunks[:top_k] for chunks in chunk_lists]
         
-        start_time = time.time()
+        try:
+            candidate_lists = [self._rerank_candidates(chunks) for chunks in chunk_lists]
+            score_lists = self.rerank_engine.score_many([
+                (
+                    query,
+                    [chunk.content for chunk in candidates],
+                    [chunk_identity(chunk.content, chunk.metadata) for chunk in candidates]
+                )
+                for query, candidates in zip(queries, candidate_lists)
+            ])
+            return [
+                self._apply_rerank_scores(candidates, scores, top_k)
+                for candidates, scores in zip(candidate_lists, score_lists)
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error in batch reranking: {e}")
+            return [chunks[:top_k] for chunks in chunk_lists]
+    
+    def _vector_leg(self, query: str, k: int, filters: Optional[Dict], timings: Dict[str, float]) -> List[Chunk]:
+        """Pierna vectorial: embedding de la query + búsqueda en el backend"""
+        start = time.perf_counter()
+        try:
+            query_embedding = self.get_embedding(query)
+        except Exception:
+            timings['embedding'] = (time.perf_counter() - start) * 1000
+            return []
+        embedded = time.perf_counter()
+        timings['embedding'] = (embedded - start) * 1000
         
-        # Búsquedas paralelas
+        chunks = self.vector_search(query, k, filters, query_embedding=query_embedding)
+        timings['vector_search'] = (time.perf_counter() - embedded) * 1000
+        return chunks
+    
+    def _bm25_leg(self, query: str, k: int, filters: Optional[Dict], timings: Dict[str, float]) -> List[Chunk]:
+        """Pierna léxica sobre el índice BM25"""
+        start = time.perf_counter()
+        chunks = self.bm25_search(query, k, filters)
+        timings['bm25'] = (time.perf_counter() - start) * 1000
+        return chunks
+    
+    def _search_legs(self, query: str, filters: Optional[Dict], timings: Dict[str, float]) -> Tuple[List[Chunk], List[Chunk]]:
+        """Ejecuta las piernas vector y BM25 (solapadas si parallel está activo)"""
         vector_k = self.retrieval_config.get('top_k_vector', 12)
         bm25_k = self.retrieval_config.get('top_k_bm25', 12)
         
-        # Vector search
-        vector_chunks = self.vector_search(query, vector_k, filters)
+        start = time.perf_counter()
+        if self.executor is not None:
+            # El embedding de la query se pide primero; BM25 corre mientras tanto
+            vector_future = self.executor.submit(self._vector_leg, query, vector_k, filters, timings)
+            bm25_chunks = self._bm25_leg(query, bm25_k, filters, timings)
+            vector_chunks = vector_future.result()
+        else:
+            vector_chunks = self._vector_leg(query, vector_k, filters, timings)
+            bm25_chunks = self._bm25_leg(query, bm25_k, filters, timings)
+        timings['search_legs'] = (time.perf_counter() - start) * 1000
+        
+        return vector_chunks, bm25_chunks
+    
+    def _lookup_result_cache(self, query: str, scope: str, timings: Dict[str, float],
+                             query_embedding: Optional[List[float]] = None) -> Optional[List[Chunk]]:
+        """Busca resultados cacheados: exacto o, con el embedding (tras un miss
+        exacto), near-duplicate; cada lookup cuenta una sola vez en las stats"""
+        start = time.perf_counter()
+        if query_embedding is None:
+            cached = self.result_cache.get(query, scope)
+        else:
+            cached = self.result_cache.get_similar(query_embedding, scope)
+        timings['result_cache'] = timings.get('result_cache', 0.0) + (time.perf_counter() - start) * 1000
+        
+        if cached is None:
+            return None
+        # Copias: quien llama puede mutar score/retrieval_method
+        return [replace(chunk) for chunk in cached]
+    
+    def _store_result_cache(self, query: str, scope: str, chunks: List[Chunk]):
+        """Guarda la lista final (con el embedding de la query si ya está cacheado)"""
+        query_embedding = None
+        if self.result_cache.similarity_threshold is not None:
+            query_embedding = self.embedding_cache.peek(query)
+        self.result_cache.put(query, scope, [replace(chunk) for chunk in chunks], query_embedding)
+    
+    def _cached_or_none(self, query: str, k: Optional[int], filters: Optional[Dict],
+                        timings: Dict[str, float]) -> Tuple[Optional[str], Optional[List[Chunk]]]:
+        """Scope de cache y resultado cacheado (si lo hay) para la query"""
+        if self.result_cache is None:
+            return None, None
+        
+        # Detecta ingestas nuevas antes de confiar en el cache
+        self._maybe_reload_bm25()
+        scope = ResultCache.scope(self.config_hash, k, filters)
+        
+        cached = self._lookup_result_cache(query, scope, timings)
+        if cached is None and self.result_cache.similarity_threshold is not None:
+            stage_start = time.perf_counter()
+            try:
+                query_embedding = self.get_embedding(query)
+            except Exception:
+                query_embedding = None
+            timings['result_cache_embedding'] = (time.perf_counter() - stage_start) * 1000
+            cached = self._lookup_result_cache(query, scope, timings, query_embedding)
+        return scope, cached
+    
+    def get_collection_info(self) -> Dict[str, Any]:
+        """Información de la colección en el backend vectorial"""
+        return self.vector_store.info()
+    
+    def retrieve_with_timings(self, query: str, k: int = None, filters: Optional[Dict] = None) -> Tuple[List[Chunk], Dict[str, float]]:
+        """Recuperación híbrida retornando también tiempos por etapa (ms)"""
+        timings: Dict[str, float] = {}
+        start_time = time.perf_counter()
+        
+        scope, cached = self._cached_or_none(query, k, filters, timings)
+        if cached is not None:
+            timings['retrieval'] = (time.perf_counter() - start_time) * 1000
+            logger.info(f"Retrieval served from result cache in {timings['retrieval']:.1f}ms")
+            return cached, timings
         
-        # BM25 search
-        bm25_chunks = self.bm25_search(query, bm25_k, filters)
+        if k is None:
+            k = self.retrieval_config.get('top_k_vector', 12)
+        
+        vector_chunks, bm25_chunks = self._search_legs(query, filters, timings)
         
         # Fusión RRF
+        stage_start = time.perf_counter()
         fusion_k = self.retrieval_config.get('fusion_k', 60)
-        fused_chunks = self.reciprocal_rank_fusion(vector_chunks, bm25_chunks, fusion_k)
+        fused_chunks = self.reciprocal_rank_fusion({'vector': vector_chunks, 'bm25': bm25_chunks}, fusion_k)
+        timings['fusion'] = (time.perf_counter() - stage_start) * 1000
         
         # Reranking
+        stage_start = time.perf_counter()
         rerank_top_k = self.reranker_config.get('top_k', 8)
         final_chunks = self.rerank_chunks(query, fused_chunks, rerank_top_k)
+        timings['rerank'] = (time.perf_counter() - stage_start) * 1000
+        
+        if scope is not None:
+            self._store_result_cache(query, scope, final_chunks)
         
-        end_time = time.time()
-        retrieval_time = (end_time - start_time) * 1000  # ms
+        timings['retrieval'] = (time.perf_counter() - start_time) * 1000
         
-        logger.info(f"Retrieval completed in {retrieval_time:.1f}ms")
+        logger.info(
+            f"Retrieval completed in {timings['retrieval']:.1f}ms "
+            f"(vector leg {timings.get('embedding', 0) + timings.get('vector_search', 0):.1f}ms, "
+            f"bm25 leg {timings.get('bm25', 0):.1f}ms)"
+        )
         
-        return final_chunks
+        return final_chunks, timings
+    
+    def retrieve(self, query: str, k: int = None, filters: Optional[Dict] = None) -> List[Chunk]:
+        """Método principal de recuperación híbrida"""
+        chunks, _ = self.retrieve_with_timings(query, k, filters)
+        return chunks
+    
+    def retrieve_many(self, queries: List[str], k: int = None, filters: Optional[Dict] = None
+                      ) -> Tuple[List[Tuple[List[Chunk], Dict[str, float]]], Dict[str, float]]:
+        """Recuperación híbrida de varias queries con las etapas caras compartidas: un
+        embedding por lote, búsqueda vectorial batch en el backend y una sola pasada de
+        reranking. Retorna [(chunks, tiempos de la query)] y los tiempos del lote (ms);
+        los tiempos de etapas compartidas se repiten en cada query"""
+        batch_timings: Dict[str, float] = {}
+        query_timings: List[Dict[str, float]] = [{} for _ in queries]
+        results: List[Optional[List[Chunk]]] = [None] * len(queries)
+        start_time = time.perf_counter()
+        
+        # Cache de resultados (match exacto; near-duplicate tras el embedding)
+        scope = None
+        if self.result_cache is not None:
+            self._maybe_reload_bm25()
+            scope = ResultCache.scope(self.config_hash, k, filters)
+            for idx, query in enumerate(queries):
+                results[idx] = self._lookup_result_cache(query, scope, query_timings[idx])
+        pending = [idx for idx, cached in enumerate(results) if cached is None]
+        
+        # Embeddings de todas las queries pendientes
+        stage_start = time.perf_counter()
+        try:
+            embeddings = self.get_embeddings([queries[idx] for idx in pending]) if pending else []
+        except Exception as e:
+            logger.error(f"Error getting batch embeddings: {e}")
+            embeddings = None
+        batch_timings['embedding'] = (time.perf_counter() - stage_start) * 1000
+        
+        if embeddings is not None and scope is not None and self.result_cache.similarity_threshold is not None:
+            for idx, embedding in zip(pending, embeddings):
+                results[idx] = self._lookup_result_cache(queries[idx], scope, query_timings[idx], embedding)
+            embeddings = [embedding for idx, embedding in zip(pending, embeddings) if results[idx] is None]
+            pending = [idx for idx in pending if results[idx] is None]
+        
+        # Pierna vectorial: una búsqueda batch en el backend
+        stage_start = time.perf_counter()
+        vector_lists: List[List[Chunk]] = [[] for _ in pending]
+        if embeddings:
+            try:
+                hits = self.vector_store.search_batch(embeddings, self.retrieval_config.get('top_k_vector', 12), filters)
+                vector_lists = [self._to_vector_chunks(query_hits) for query_hits in hits]
+            except Exception as e:
+                logger.error(f"Error in batch vector search: {e}")
+        batch_timings['vector_search'] = (time.perf_counter() - stage_start) * 1000
+        
+        # Pierna BM25 y fusión por query
+        bm25_k = self.retrieval_config.get('top_k_bm25', 12)
+        fusion_k = self.retrieval_config.get('fusion_k', 60)
+        fused_lists = []
+        for idx, vector_chunks in zip(pending, vector_lists):
+            timings = query_timings[idx]
+            bm25_chunks = self._bm25_leg(queries[idx], bm25_k, filters, timings)
+            stage_start = time.perf_counter()
+            fused_lists.append(self.reciprocal_rank_fusion({'vector': vector_chunks, 'bm25': bm25_chunks}, fusion_k))
+            timings['fusion'] = (time.perf_counter() - stage_start) * 1000
+        batch_timings['bm25'] = sum(query_timings[idx].get('bm25', 0.0) for idx in pending)
+        batch_timings['fusion'] = sum(query_timings[idx].get('fusion', 0.0) for idx in pending)
+        
+        # Reranking: todos los pares (query, chunk) del lote en una pasada
+        stage_start = time.perf_counter()
+        final_lists = self.rerank_many([queries[idx] for idx in pending], fused_lists, self.reranker_config.get('top_k', 8))
+        batch_timings['rerank'] = (time.perf_counter() - stage_start) * 1000
+        
+        for idx, final_chunks in zip(pending, final_lists):
+            results[idx] = final_chunks
+            query_timings[idx].update({stage: batch_timings[stage] for stage in ('embedding', 'vector_search', 'rerank')})
+            if scope is not None:
+                self._store_result_cache(queries[idx], scope, final_chunks)
+        
+        batch_timings['retrieval'] = (time.perf_counter() - start_time) * 1000
+        logger.info(
+            f"Batch retrieval of {len(queries)} queries completed in {batch_timings['retrieval']:.1f}ms "
+            f"({len(queries) - len(pending)} from result cache)"
+        )
+        return list(zip(results, query_timings)), batch_timings
     
     def explain(self, query: str, k: int = None, filters: Optional[Dict] = None) -> Dict[str, Any]:
         """Explica el proceso de recuperación"""
         if k is None:
             k = self.retrieval_config.get('top_k_vector', 12)
         
-        vector_k = self.retrieval_config.get('top_k_vector', 12)
-        bm25_k = self.retrieval_config.get('top_k_bm25', 12)
-        
         # Ejecutar recuperación paso a paso
-        vector_chunks = self.vector_search(query, vector_k, filters)
-        bm25_chunks = self.bm25_search(query, bm25_k, filters)
+        timings: Dict[str, float] = {}
+        vector_chunks, bm25_chunks = self._search_legs(query, filters, timings)
+        # Fusión y reranking reutilizan los mismos chunks: capturar antes cada etapa
+        explanation = self._explain_legs(query, vector_chunks, bm25_chunks)
         
         fusion_k = self.retrieval_config.get('fusion_k', 60)
-        fused_chunks = self.reciprocal_rank_fusion(vector_chunks, bm25_chunks, fusion_k)
+        fused_chunks = self.reciprocal_rank_fusion({'vector': vector_chunks, 'bm25': bm25_chunks}, fusion_k)
+        explanation["fused"] = self._explain_stage(fused_chunks[:5])
         
         rerank_top_k = self.reranker_config.get('top_k', 8)
         final_chunks = self.rerank_chunks(query, fused_chunks, rerank_top_k)
         
+        return self._explain_final(explanation, final_chunks, timings)
+    
+    @staticmethod
+    def _explain_stage(chunks: List[Chunk]) -> List[Tuple[Chunk, float]]:
+        """Captura (chunk, score) de una etapa: fusión y reranking reescriben los scores"""
+        return [(chunk, chunk.score) for chunk in chunks]
+    
+    def _explain_legs(self, query: str, vector_chunks: List[Chunk], bm25_chunks: List[Chunk]) -> Dict[str, Any]:
+        """Inicia la respuesta de explain() con los hits de cada pierna"""
         return {
             "query": query,
-            "bm25_hits": [
-                {
-                    "content": chunk.content[:200] + "...",
-                    "score": chunk.score,
-                    "metadata": chunk.metadata
-                }
-                for chunk in bm25_chunks[:5]
-            ],
-            "vector_hits": [
-                {
-                    "content": chunk.content[:200] + "...",
-                    "score": chunk.score,
-                    "metadata": chunk.metadata
-                }
-                for chunk in vector_chunks[:5]
-            ],
-            "fused": [
-                {
-                    "content": chunk.content[:200] + "...",
-                    "score": chunk.score,
-                    "metadata": chunk.metadata
-                }
-                for chunk in fused_chunks[:5]
-            ],
-            "rerank_scores": [
-                {
-                    "content": chunk.content[:200] + "...",
-                    "score": chunk.score,
-                    "metadata": chunk.metadata
-                }
-                for chunk in final_chunks
-            ],
-            "total_results": len(final_chunks)
+            "bm25_hits": self._explain_stage(bm25_chunks[:5]),
+            "vector_hits": self._explain_stage(vector_chunks[:5])
         }
+    
+    def _explain_final(self, explanation: Dict[str, Any], final_chunks: List[Chunk],
+                       timings: Dict[str, float]) -> Dict[str, Any]:
+        """Completa la respuesta de explain(): cada chunk aparece una sola vez en
+        "chunks" y los hits de cada etapa lo referencian por índice"""
+        explanation["rerank_scores"] = self._explain_stage(final_chunks)
+        
+        chunks: List[Dict[str, Any]] = []
+        refs: Dict[Hashable, int] = {}
+        for stage in ("bm25_hits", "vector_hits", "fused", "rerank_scores"):
+            hits = []
+            for chunk, score in explanation[stage]:
+                key = self.fusion_key(chunk)
+                if key not in refs:
+                    refs[key] = len(chunks)
+                    chunks.append({
+                        "content": chunk.content[:200] + "...",
+                        # El contenido completo no se repite dentro de la metadata
+                        "metadata": {name: value for name, value in chunk.metadata.items() if name != 'content'}
+                    })
+                hits.append({"chunk": refs[key], "score": score})
+            explanation[stage] = hits
+        
+        explanation["chunks"] = chunks
+        explanation["total_results"] = len(final_chunks)
+        explanation["timings_ms"] = timings
+        return explanation
 
 # Para uso como módulo
 def create_retriever(config_path: str = "rag/config/retrieval.yaml") -> HybridRetriever:
@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+"""
+Vector Store - Backends vectoriales intercambiables para retriever y embedder
+Qdrant (remoto) o almacén local embebido: vectores en archivo memory-mapped,
+payloads en SQLite, búsqueda exacta por bloques NumPy o grafo HNSW
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PointIdsList, HnswConfigDiff,
+    Filter, FieldCondition, MatchValue
+)
+
+try:
+    import hnswlib
+except ImportError:  # opcional: sin hnswlib el almacén local usa búsqueda exacta
+    hnswlib = None
+
+from .metrics import count_errors
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class VectorHit:
+    """Resultado de búsqueda/scroll de un backend"""
+    id: Any
+    score: float
+    payload: Dict[str, Any]
+
+def matches_filters(payload: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """Match exacto de filtros (equivalente a MatchValue de Qdrant)"""
+    if not filters:
+        return True
+    return all(payload.get(key) == value for key, value in filters.items())
+
+class VectorBackend:
+    """Interfaz común de los almacenes vectoriales"""
+
+    collection_name: str
+
+    def create_collection(self, dimensions: int):
+        raise NotImplementedError
+
+    def upsert(self, ids: Sequence[Any], vectors: Sequence[Sequence[float]], payloads: Sequence[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def delete(self, ids: Sequence[Any]):
+        raise NotImplementedError
+
+    def get_vectors(self, ids: Sequence[Any]) -> Dict[Any, List[float]]:
+        """Vectores almacenados de los ids dados (los ausentes se omiten)"""
+        raise NotImplementedError
+
+    def search(self, vector: Sequence[float], k: int, filters: Optional[Dict[str, Any]] = None) -> List[VectorHit]:
+        raise NotImplementedError
+
+    def search_batch(self, vectors: Sequence[Sequence[float]], k: int,
+                     filters: Optional[Dict[str, Any]] = None) -> List[List[VectorHit]]:
+        """Búsqueda de varias queries (por defecto, una a una)"""
+        return [self.search(vector, k, filters) for vector in vectors]
+
+    async def asearch(self, vector: Sequence[float], k: int, filters: Optional[Dict[str, Any]] = None) -> List[VectorHit]:
+        """Búsqueda sin bloquear el event loop (por defecto, en el executor)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search, vector, k, filters)
+
+    def scroll(self, limit: int, offset: Optional[Any] = None) -> Tuple[List[VectorHit], Optional[Any]]:
+        """Página de puntos (payload) y offset siguiente (None al terminar)"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Publica escrituras pendientes para otros procesos"""
+
+    def info(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        self.close()
+
+class QdrantBackend(VectorBackend):
+    """Backend remoto sobre Qdrant"""
+
+    def __init__(self, url: str, collection_name: str, distance: str = 'cosine',
+                 hnsw_config: Optional[Dict[str, Any]] = None):
+        self.url = url
+        self.collection_name = collection_name
+        self.distance = distance
+        self.hnsw_config = hnsw_config or {}
+        # location: URL del servidor o ":memory:" (modo embebido del cliente, para tests)
+        self.client = QdrantClient(location=url)
+        self._async_client: Optional[AsyncQdrantClient] = None
+
+    @property
+    def async_client(self) -> AsyncQdrantClient:
+        if self._async_client is None:
+            self._async_client = AsyncQdrantClient(location=self.url)
+        return self._async_client
+
+    @staticmethod
+    def build_filter(filters: Optional[Dict[str, Any]]) -> Optional[Filter]:
+        """Construye el filtro Qdrant (match exacto por campo)"""
+        if not filters:
+            return None
+        conditions = []
+        for key, value in filters.items():
+            conditions.append(
+                FieldCondition(
+                    key=key,
+                    match=MatchValue(value=value)
+                )
+            )
+        return Filter(must=conditions)
+
+    @staticmethod
+    def _hits(points) -> List[VectorHit]:
+        return [VectorHit(id=point.id, score=getattr(point, 'score', 0.0) or 0.0, payload=point.payload or {}) for point in points]
+
+    def create_collection(self, dimensions: int):
+        """Crea la colección en Qdrant si no existe"""
+        collections = self.client.get_collections()
+        collection_names = [c.name for c in collections.collections]
+
+        if self.collection_name not in collection_names:
+            logger.info(f"Creating collection: {self.collection_name}")
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=VectorParams(
+                    size=dimensions,
+                    distance=Distance.DOT if self.distance == 'dot' else Distance.COSINE
+                ),
+                hnsw_config=HnswConfigDiff(**self.hnsw_config) if self.hnsw_config else None
+            )
+            logger.info(f"✅ Collection {self.collection_name} created")
+        else:
+            logger.info(f"Collection {self.collection_name} already exists")
+
+    def upsert(self, ids, vectors, payloads):
+        points = [
+            PointStruct(id=point_id, vector=list(vector), payload=payload)
+            for point_id, vector, payload in zip(ids, vectors, payloads)
+        ]
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def delete(self, ids):
+        if ids:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=list(ids))
+            )
+
+    @staticmethod
+    def _id_key(point_id: Any) -> str:
+        """Forma canónica del id (Qdrant devuelve UUIDs con guiones)"""
+        try:
+            return uuid.UUID(str(point_id)).hex
+        except ValueError:
+            return str(point_id)
+
+    def get_vectors(self, ids):
+        if not ids:
+            return {}
+        requested = {self._id_key(point_id): point_id for point_id in ids}
+        points = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=list(ids),
+            with_payload=False,
+            with_vectors=True
+        )
+        return {requested[self._id_key(point.id)]: list(point.vector) for point in points
+                if self._id_key(point.id) in requested and point.vector is not None}
+
+    def search(self, vector, k, filters=None):
+        # Query API en clientes recientes (que ya no tienen search)
+        with count_errors('qdrant', 'search'):
+            if hasattr(self.client, 'query_points'):
+                response = self.client.query_points(
+                    collection_name=self.collection_name,
+                    query=list(vector),
+                    limit=k,
+                    query_filter=self.build_filter(filters),
+                    with_payload=True
+                )
+                return self._hits(response.points)
+            return self._hits(self.client.search(
+                collection_name=self.collection_name,
+                query_vector=list(vector),
+                limit=k,
+                query_filter=self.build_filter(filters)
+            ))
+
+    def search_batch(self, vectors, k, filters=None):
+        # Una sola request para todas las queries (query API en clientes recientes)
+        query_filter = self.build_filter(filters)
+        with count_errors('qdrant', 'search_batch'):
+            if hasattr(self.client, 'query_batch_points'):
+                responses = self.client.query_batch_points(
+                    collection_name=self.collection_name,
+                    requests=[
+                        models.QueryRequest(query=list(vector), filter=query_filter, limit=k, with_payload=True)
+                        for vector in vectors
+                    ]
+                )
+                return [self._hits(response.points) for response in responses]
+            results = self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=[
+                    models.SearchRequest(vector=list(vector), filter=query_filter, limit=k, with_payload=True)
+                    for vector in vectors
+                ]
+            )
+            return [self._hits(points) for points in results]
+
+    async def asearch(self, vector, k, filters=None):
+        client = self.async_client
+        with count_errors('qdrant', 'search'):
+            if hasattr(client, 'query_points'):
+                response = await client.query_points(
+                    collection_name=self.collection_name,
+                    query=list(vector),
+                    limit=k,
+                    query_filter=self.build_filter(filters),
+                    with_payload=True
+                )
+                return self._hits(response.points)
+            return self._hits(await client.search(
+                collection_name=self.collection_name,
+                query_vector=list(vector),
+                limit=k,
+                query_filter=self.build_filter(filters)
+            ))
+
+    def scroll(self, limit, offset=None):
+        points, next_offset = self.client.scroll(
+            collection_name=self.collection_name,
+            limit=limit,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False
+        )
+        return self._hits(points), next_offset
+
+    def info(self):
+        with count_errors('qdrant', 'info'):
+            collection_info = self.client.get_collection(self.collection_name)
+        return {
+            "name": self.collection_name,
+            "backend": "qdrant",
+            "vector_size": collection_info.config.params.vectors.size,
+            # vectors_count ya no existe en clientes recientes (un vector por punto)
+            "vectors_count": getattr(collection_info, 'vectors_count', collection_info.points_count),
+            "points_count": collection_info.points_count,
+            "status": str(collection_info.status)
+        }
+
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+        self.close()
+
+class LocalVectorStore(VectorBackend):
+    """Almacén embebido: matriz memory-mapped + payloads SQLite + HNSW opcional"""
+
+    FORMAT_VERSION = 1
+    MIN_CAPACITY = 1024
+
+    def __init__(self, path: str, collection_name: str, distance: str = 'cosine',
+                 dtype: str = 'float32', search_mode: str = 'auto',
+                 full_scan_threshold: int = 10000, hnsw_config: Optional[Dict[str, Any]] = None,
+                 reload_interval_s: float = 5.0, block_rows: int = 65536):
+        self.collection_name = collection_name
+        self.root = Path(path) / collection_name
+        self.distance = distance
+        self.dtype = np.dtype(dtype)
+        self.search_mode = search_mode
+        self.full_scan_threshold = full_scan_threshold
+        self.hnsw_config = hnsw_config or {}
+        self.reload_interval_s = reload_interval_s
+        self.block_rows = block_rows
+
+        self._meta_path = self.root / 'meta.json'
+        self._vectors_path = self.root / 'vectors.bin'
+        self._hnsw_path = self.root / 'hnsw.bin'
+        self._lock = threading.RLock()
+
+        self.dimensions: Optional[int] = None
+        self._capacity = 0
+        self._count = 0  # filas usadas (vivas + libres)
+        self._vectors: Optional[np.memmap] = None
+        self._rows: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._live = np.zeros(0, dtype=bool)
+        self._hnsw = None
+        self._dirty = False
+        self._meta_mtime = 0.0
+        self._checked_at = 0.0
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / 'payloads.sqlite'), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS points ("
+            "id TEXT PRIMARY KEY, row INTEGER NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+        if self._meta_path.exists():
+            self._load()
+
+    # --- persistencia -------------------------------------------------
+
+    def _load(self):
+        """Carga meta, mapeo id<->fila y (si existe) el grafo HNSW"""
+        with open(self._meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != self.FORMAT_VERSION:
+            raise ValueError(f"Unsupported local vector store version: {meta.get('version')}")
+
+        self._meta_mtime = self._meta_path.stat().st_mtime
+        self.dimensions = meta['dimensions']
+        self.dtype = np.dtype(meta['dtype'])
+        self.distance = meta['distance']
+        self._count = meta['count']
+        self._capacity = meta['capacity']
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode='r+',
+                                  shape=(self._capacity, self.dimensions))
+
+        self._ids = [None] * self._capacity
+        self._rows = {}
+        self._live = np.zeros(self._capacity, dtype=bool)
+        for point_id, row in self._db.execute("SELECT id, row FROM points WHERE row < ?", (self._count,)):
+            self._rows[point_id] = row
+            self._ids[row] = point_id
+            self._live[row] = True
+        self._free = [row for row in range(self._count) if not self._live[row]]
+
+        self._hnsw = None
+        if hnswlib is not None and self._hnsw_path.exists() and meta.get('hnsw'):
+            index = hnswlib.Index(space='ip', dim=self.dimensions)
+            index.load_index(str(self._hnsw_path), max_elements=self._capacity)
+            index.set_ef(self.hnsw_config.get('ef', 64))
+            self._hnsw = index
+
+    def _maybe_reload(self):
+        """Recarga si otro proceso (ingesta) publicó cambios"""
+        now = time.monotonic()
+        if self._dirty or now - self._checked_at < self.reload_interval_s:
+            return
+        self._checked_at = now
+        try:
+            mtime = self._meta_path.stat().st_mtime
+        except OSError:
+            return
+        if mtime > self._meta_mtime:
+            with self._lock:
+                self._load()
+                logger.info(f"Local vector store reloaded: {len(self._rows)} points")
+
+    def flush(self):
+        """Persiste meta (y grafo HNSW) de forma atómica"""
+        with self._lock:
+            if not self._dirty or self.dimensions is None:
+                return
+            self._vectors.flush()
+            if self._hnsw is not None:
+                self._hnsw.save_index(str(self._hnsw_path))
+
+            meta = {
+                "version": self.FORMAT_VERSION,
+                "dimensions": self.dimensions,
+                "dtype": self.dtype.name,
+                "distance": self.distance,
+                "count": self._count,
+                "capacity": self._capacity,
+                "hnsw": self._hnsw is not None
+            }
+            tmp_path = self._meta_path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._meta_path)
+            self._meta_mtime = self._meta_path.stat().st_mtime
+            self._dirty = False
+
+    # --- escritura ----------------------------------------------------
+
+    def create_collection(self, dimensions: int):
+        with self._lock:
+            if self.dimensions is not None:
+                if self.dimensions != dimensions:
+                    raise ValueError(f"Collection {self.collection_name} has {self.dimensions} dims, got {dimensions}")
+                logger.info(f"Collection {self.collection_name} already exists")
+                return
+            self.dimensions = dimensions
+            self._vectors_path.touch()
+            self._ensure_capacity(self.MIN_CAPACITY)
+            self._dirty = True
+            self.flush()
+            logger.info(f"✅ Local collection {self.collection_name} created at {self.root}")
+
+    def _ensure_capacity(self, rows: int):
+        """Crece el archivo memory-mapped (duplicando) si hace falta"""
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2, self.MIN_CAPACITY)
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self._vectors_path, 'r+b') as f:
+            f.truncate(new_capacity * self.dimensions * self.dtype.itemsize)
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode='r+',
+                                  shape=(new_capacity, self.dimensions))
+        self._ids.extend([None] * (new_capacity - self._capacity))
+        self._live = np.concatenate([self._live, np.zeros(new_capacity - self._capacity, dtype=bool)])
+        if self._hnsw is not None:
+            self._hnsw.resize_index(new_capacity)
+        self._capacity = new_capacity
+
+    def _prepare(self, vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        if self.distance == 'cosine':
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+        return matrix
+
+    def upsert(self, ids, vectors, payloads):
+        if not ids:
+            return
+        matrix = self._prepare(vectors)
+        with self._lock:
+            if self.dimensions is None:
+                self.create_collection(matrix.shape[1])
+
+            rows = []
+            for point_id in ids:
+                point_id = str(point_id)
+                row = self._rows.get(point_id)
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = self._count
+                        self._count += 1
+                rows.append(row)
+            self._ensure_capacity(self._count)
+
+            row_index = np.asarray(rows)
+            self._vectors[row_index] = matrix.astype(self.dtype)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO points (id, row, payload) VALUES (?, ?, ?)",
+                [(str(point_id), row, json.dumps(payload, default=str)) for point_id, row, payload in zip(ids, rows, payloads)]
+            )
+            self._db.commit()
+
+            for point_id, row in zip(ids, rows):
+                self._rows[str(point_id)] = row
+                self._ids[row] = str(point_id)
+            self._live[row_index] = True
+
+            if self._hnsw is not None:
+                self._hnsw.add_items(matrix, row_index)
+            elif self._wants_hnsw():
+                self._build_hnsw()
+            self._dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            removed = []
+            for point_id in ids:
+                row = self._rows.pop(str(point_id), None)
+                if row is None:
+                    continue
+                self._ids[row] = None
+                self._live[row] = False
+                self._free.append(row)
+                removed.append(str(point_id))
+                if self._hnsw is not None:
+                    self._hnsw.mark_deleted(row)
+            if removed:
+                self._db.executemany("DELETE FROM points WHERE id = ?", [(point_id,) for point_id in removed])
+                self._db.commit()
+                self._dirty = True
+
+    def get_vectors(self, ids):
+        with self._lock:
+            found = [(point_id, self._rows.get(str(point_id))) for point_id in ids]
+            return {
+                point_id: np.asarray(self._vectors[row], dtype=np.float32).tolist()
+                for point_id, row in found if row is not None
+            }
+
+    # --- HNSW ---------------------------------------------------------
+
+    def _wants_hnsw(self) -> bool:
+        if hnswlib is None or self.search_mode == 'flat':
+            return False
+        return self.search_mode == 'hnsw' or len(self._rows) >= self.full_scan_threshold
+
+    def _build_hnsw(self):
+        """Construye el grafo HNSW con todas las filas vivas"""
+        index = hnswlib.Index(space='ip', dim=self.dimensions)
+        index.init_index(
+            max_elements=self._capacity,
+            M=self.hnsw_config.get('m', 16),
+            ef_construction=self.hnsw_config.get('ef_construct', 100)
+        )
+        live_rows = np.flatnonzero(self._live[:self._count])
+        for start in range(0, len(live_rows), self.block_rows):
+            block = live_rows[start:start + self.block_rows]
+            index.add_items(np.asarray(self._vectors[block], dtype=np.float32), block)
+        index.set_ef(self.hnsw_config.get('ef', 64))
+        self._hnsw = index
+        logger.info(f"HNSW graph built for {len(live_rows)} points")
+
+    # --- lectura ------------------------------------------------------
+
+    def _payloads(self, rows: Sequence[int]) -> Dict[int, Tuple[str, Dict[str, Any]]]:
+        """Payloads de un conjunto de filas (una sola consulta SQLite)"""
+        ids = [self._ids[row] for row in rows if self._ids[row] is not None]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            found = self._db.execute(
+                f"SELECT id, row, payload FROM points WHERE id IN ({placeholders})", ids
+            ).fetchall()
+        return {row: (point_id, json.loads(payload)) for point_id, row, payload in found}
+
+    def _flat_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Producto punto exacto por bloques; filas muertas a -inf"""
+        scores = np.empty((queries.shape[0], self._count), dtype=np.float32)
+        for start in range(0, self._count, self.block_rows):
+            end = min(start + self.block_rows, self._count)
+            block = np.asarray(self._vectors[start:end], dtype=np.float32)
+            scores[:, start:end] = queries @ block.T
+        scores[:, ~self._live[:self._count]] = -np.inf
+        return scores
+
+    def _select(self, rows: np.ndarray, scores: np.ndarray, k: int, filters) -> List[VectorHit]:
+        """Toma los k mejores candidatos (ordenados) que pasan los filtros"""
+        hits = []
+        page = max(k, 16) if filters else k
+        for start in range(0, len(rows), page):
+            page_rows = rows[start:start + page]
+            payloads = self._payloads(page_rows.tolist())
+            for row, score in zip(page_rows.tolist(), scores[start:start + page].tolist()):
+                if score == -np.inf or row not in payloads:
+                    continue
+                point_id, payload = payloads[row]
+                if matches_filters(payload, filters):
+                    hits.append(VectorHit(id=point_id, score=score, payload=payload))
+                    if len(hits) == k:
+                        return hits
+        return hits
+
+    def _flat_search(self, queries: np.ndarray, k: int, filters) -> List[List[VectorHit]]:
+        all_scores = self._flat_scores(queries)
+        results = []
+        for scores in all_scores:
+            if filters or k >= len(scores):
+                order = np.argsort(-scores)
+            else:
+                top = np.argpartition(-scores, k)[:k]
+                order = top[np.argsort(-scores[top])]
+            results.append(self._select(order, scores[order], k, filters))
+        return results
+
+    def _hnsw_search(self, query: np.ndarray, k: int, filters) -> List[VectorHit]:
+        live = len(self._rows)
+        fetch = min(live, k if not filters else k * 4)
+        while True:
+            self._hnsw.set_ef(max(self.hnsw_config.get('ef', 64), fetch))
+            labels, distances = self._hnsw.knn_query(query[None, :], k=fetch)
+            hits = self._select(labels[0].astype(np.int64), 1.0 - distances[0], k, filters)
+            if len(hits) >= k or fetch >= live:
+                return hits
+            fetch = min(live, fetch * 4)
+
+    def search(self, vector, k, filters=None):
+        return self.search_batch([vector], k, filters)[0]
+
+    def search_batch(self, vectors, k, filters=None):
+        self._maybe_reload()
+        if self._vectors is None or not self._rows or k <= 0:
+            return [[] for _ in vectors]
+
+        queries = self._prepare(vectors)
+        with self._lock:
+            if self._hnsw is not None and self.search_mode != 'flat':
+                return [self._hnsw_search(query, k, filters) for query in queries]
+            return self._flat_search(queries, k, filters)
+
+    def scroll(self, limit, offset=None):
+        offset = offset or 0
+        with self._lock:
+            found = self._db.execute(
+                "SELECT id, payload FROM points ORDER BY row LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        hits = [VectorHit(id=point_id, score=0.0, payload=json.loads(payload)) for point_id, payload in found]
+        return hits, (offset + limit if len(found) == limit else None)
+
+    def info(self):
+        self._maybe_reload()
+        return {
+            "name": self.collection_name,
+            "backend": "local",
+            "path": str(self.root),
+            "vector_size": self.dimensions,
+            "dtype": self.dtype.name,
+            "points_count": len(self._rows),
+            "capacity": self._capacity,
+            "search": "hnsw" if self._hnsw is not None and self.search_mode != 'flat' else "flat"
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+def create_vector_store(index_config: Dict[str, Any]) -> VectorBackend:
+    """Crea el backend declarado en index.type"""
+    index_type = index_config.get('type', 'qdrant')
+    collection_name = index_config.get('collection', 'quannex_docs_replica')
+    distance = index_config.get('distance', 'cosine')
+    hnsw_config = index_config.get('hnsw_config', {})
+
+    if index_type == 'qdrant':
+        return QdrantBackend(
+            url=index_config.get('url', 'http://localhost:6333'),
+            collection_name=collection_name,
+            distance=distance,
+            hnsw_config=hnsw_config
+        )
+
+    if index_type == 'local':
+        local_config = index_config.get('local', {})
+        return LocalVectorStore(
+            path=local_config.get('path', 'data/rag/vectors'),
+            collection_name=collection_name,
+            distance=distance,
+            dtype=local_config.get('dtype', 'float32'),
+            search_mode=local_config.get('search', 'auto'),
+            full_scan_threshold=hnsw_config.get('full_scan_threshold', 10000),
+            hnsw_config={
+                'm': hnsw_config.get('m', 16),
+                'ef_construct': hnsw_config.get('ef_construct', 100),
+                'ef': local_config.get('ef', 64)
+            },
+            reload_interval_s=local_config.get('reload_interval_s', 5.0)
+        )
+
+    raise ValueError(f"Unsupported index.type: {index_type}")
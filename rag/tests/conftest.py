@@ -0,0 +1,36 @@
+"""
+Configuración de pytest para los tests del pipeline RAG
+Los módulos de rag/ se importan como paquetes (rag.serve, rag.ingest) desde la raíz del repo
+"""
+import os
+import sys
+
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'retrieval.yaml')
+
+@pytest.fixture
+def make_config(tmp_path):
+    """Escribe una config de retrieval.yaml autocontenida (backend local, embeddings
+    hash, sin reranker) con overrides {sección: {clave: valor}}; retorna su ruta"""
+    def factory(overrides=None):
+        with open(CONFIG_PATH, encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+        config['index'].update({'type': 'local', 'vector_size': 32})
+        config['index']['local'].update({'path': str(tmp_path / 'vectors'), 'search': 'flat'})
+        config['embeddings'].update({'provider': 'hash', 'dimensions': 32, 'rate_limit': None,
+                                     'cache': {'disk_path': None}})
+        config['reranker']['enabled'] = False
+        config['bm25']['index_path'] = str(tmp_path / 'bm25_index.pkl')
+        config['preprocess']['manifest_path'] = str(tmp_path / 'file_manifest.sqlite')
+        config['ingest']['manifest_path'] = str(tmp_path / 'ingest_manifest.sqlite')
+        for section, values in (overrides or {}).items():
+            config.setdefault(section, {}).update(values)
+        path = tmp_path / 'retrieval.yaml'
+        with open(path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f)
+        return str(path)
+    return factory
@@ -0,0 +1,47 @@
+"""
+Tests de serialización del API: scores no finitos con orjson y con json estándar
+"""
+import json
+import math
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("sentence_transformers")
+
+from rag.serve import api
+from rag.serve.retriever import Chunk
+
+def chunks(*scores):
+    return [Chunk(content=f"c{i}", metadata={"doc_id": "a", "chunk_idx": i, "content": f"c{i}"},
+                  score=score, retrieval_method="vector")
+            for i, score in enumerate(scores)]
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        if api.orjson is None:
+            pytest.skip("orjson not installed")
+    else:
+        monkeypatch.setattr(api, "orjson", None)
+    return request.param
+
+class TestSerialization:
+
+    def test_non_finite_scores_become_null(self, encoder):
+        contexts = api.build_contexts(chunks(0.5, math.nan, math.inf, -math.inf))
+        decoded = json.loads(api.dump_json({"contexts": contexts}))
+        assert [context["score"] for context in decoded["contexts"]] == [0.5, None, None, None]
+
+    def test_contexts_round_trip(self, encoder):
+        contexts = api.build_contexts(chunks(1.25, 0.0), fields=["chunk_idx", "content"])
+        decoded = json.loads(api.dump_json(contexts))
+        assert decoded == [
+            {"content": "c0", "score": 1.25, "retrieval_method": "vector", "metadata": {"chunk_idx": 0}},
+            {"content": "c1", "score": 0.0, "retrieval_method": "vector", "metadata": {"chunk_idx": 1}},
+        ]
+
+    def test_stdlib_encoder_still_rejects_other_non_finite_values(self, monkeypatch):
+        monkeypatch.setattr(api, "orjson", None)
+        with pytest.raises(ValueError):
+            api.dump_json({"value": math.nan})
@@ -0,0 +1,68 @@
+"""
+Tests de AsyncHybridRetriever: nada de I/O SQLite en el hilo del event loop y
+lotes en el executor acotado del retriever
+"""
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from rag.serve.async_retriever import AsyncHybridRetriever
+
+@pytest.fixture
+def make_retriever(make_config):
+    retrievers = []
+
+    def factory(overrides=None):
+        retriever = AsyncHybridRetriever(make_config(overrides))
+        retrievers.append(retriever)
+        return retriever
+
+    yield factory
+    for retriever in retrievers:
+        asyncio.run(retriever.aclose())
+
+def record_threads(monkeypatch, obj, name, threads):
+    original = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(obj, name, wrapper)
+
+class TestEmbeddingCacheOffLoop:
+
+    def test_disk_write_runs_in_the_executor(self, make_retriever, tmp_path, monkeypatch):
+        retriever = make_retriever({"embeddings": {"cache": {"disk_path": str(tmp_path / "emb.sqlite")}}})
+        threads = []
+        record_threads(monkeypatch, retriever.embedding_cache.disk, "put", threads)
+
+        async def embed():
+            return await retriever.aget_embedding("hello world"), threading.get_ident()
+
+        embedding, loop_thread = asyncio.run(embed())
+        # Esperar la escritura en segundo plano
+        retriever.executor.shutdown(wait=True)
+        assert threads and loop_thread not in threads
+        assert retriever.embedding_cache.get_memory("hello world") == embedding
+        retriever.embedding_cache.memory.clear()
+        assert retriever.embedding_cache.get_disk("hello world") == embedding
+
+class TestBatchExecutor:
+
+    def test_retrieve_many_runs_in_the_retriever_executor(self, make_retriever, monkeypatch):
+        retriever = make_retriever({"retrieval": {"max_workers": 2}})
+        names = []
+        original = retriever.retrieve_many
+
+        def retrieve_many(*args):
+            names.append(threading.current_thread().name)
+            return original(*args)
+
+        monkeypatch.setattr(retriever, "retrieve_many", retrieve_many)
+        results, batch_timings = asyncio.run(retriever.aretrieve_many(["alpha", "beta"], k=3))
+        assert len(results) == 2 and "retrieval" in batch_timings
+        assert names and all(name.startswith("retriever") for name in names)
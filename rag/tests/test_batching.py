@@ -0,0 +1,92 @@
+"""
+Tests de MicroBatcher: coalesce entre corrutinas, orden de resultados y errores
+"""
+import asyncio
+
+import pytest
+
+from rag.serve.batching import MicroBatcher
+
+def run(coro):
+    return asyncio.run(coro)
+
+class TestMicroBatcher:
+
+    def test_concurrent_submits_share_a_batch(self):
+        calls = []
+
+        async def double(items):
+            calls.append(list(items))
+            return [item * 2 for item in items]
+
+        async def main():
+            batcher = MicroBatcher(double, max_batch_size=64, max_wait_ms=5)
+            results = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+            return batcher, results
+
+        batcher, results = run(main())
+        assert results == [i * 2 for i in range(10)]
+        assert calls == [list(range(10))]
+        assert batcher.stats()["batches"] == 1
+
+    def test_splits_at_max_batch_size(self):
+        calls = []
+
+        def identity(items):
+            calls.append(len(items))
+            return list(items)
+
+        async def main():
+            batcher = MicroBatcher(identity, max_batch_size=4, max_wait_ms=50)
+            return await asyncio.gather(
+                batcher.submit_many([0, 1, 2]),
+                batcher.submit_many([3, 4, 5]),
+                batcher.submit(6)
+            )
+
+        assert run(main()) == [[0, 1, 2], [3, 4, 5], 6]
+        assert sum(calls) == 7
+        assert max(calls) <= 4
+
+    def test_error_reaches_every_caller(self):
+        async def failing(items):
+            raise RuntimeError("backend down")
+
+        async def main():
+            batcher = MicroBatcher(failing, max_wait_ms=1)
+            return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+        results = run(main())
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    def test_wrong_result_count_is_an_error(self):
+        async def short(items):
+            return items[:-1]
+
+        async def main():
+            batcher = MicroBatcher(short, max_wait_ms=1)
+            await asyncio.gather(batcher.submit(1), batcher.submit(2))
+
+        with pytest.raises(ValueError):
+            run(main())
+
+    def test_cancelled_caller_does_not_break_batch(self):
+        async def slow(items):
+            await asyncio.sleep(0.02)
+            return list(items)
+
+        async def main():
+            batcher = MicroBatcher(slow, max_wait_ms=1)
+            cancelled = asyncio.ensure_future(batcher.submit("a"))
+            kept = asyncio.ensure_future(batcher.submit("b"))
+            await asyncio.sleep(0.005)
+            cancelled.cancel()
+            return await kept
+
+        assert run(main()) == "b"
+
+    def test_empty_submit(self):
+        async def main():
+            return await MicroBatcher(lambda items: items).submit_many([])
+
+        assert run(main()) == []
@@ -0,0 +1,95 @@
+"""
+Tests de BM25Index: paridad de búsqueda tras eliminar, compactar y recargar
+"""
+import pytest
+
+from rag.serve.bm25 import BM25Index
+
+DOCS = [
+    ("doc-a", 0, "retrieval hybrid search with bm25 and vectors"),
+    ("doc-a", 1, "reciprocal rank fusion merges vector and lexical results"),
+    ("doc-b", 0, "qdrant stores dense vectors for semantic search"),
+    ("doc-b", 1, "bm25 scores terms by idf and document length"),
+    ("doc-c", 0, "the reranker scores query passage pairs"),
+    ("doc-c", 1, "chunking splits documents with token overlap"),
+    ("doc-d", 0, "search latency budget for hybrid retrieval"),
+]
+
+QUERIES = ["bm25 search", "vectors", "hybrid retrieval", "scores", "overlap chunking", "missing term"]
+
+def payload(doc_id, chunk_idx, content):
+    return {"doc_id": doc_id, "chunk_idx": chunk_idx, "chunk_hash": str(hash(content)), "content": content}
+
+def build(docs):
+    index = BM25Index()
+    for doc_id, chunk_idx, content in docs:
+        index.upsert(content, payload(doc_id, chunk_idx, content))
+    return index
+
+def results(index, query, k=10, filters=None):
+    """Resultados comparables entre índices (ids internos distintos)"""
+    return sorted(
+        ((p["doc_id"], p["chunk_idx"], round(score, 9)) for p, score in index.search(query, k, filters)),
+        key=lambda item: (-item[2], item[0], item[1])
+    )
+
+class TestBM25Parity:
+
+    def test_delete_compact_reload_matches_fresh_index(self, tmp_path):
+        index = build(DOCS)
+        index.remove("doc-b")
+        index.remove("doc-c", 1)
+        remaining = [d for d in DOCS if d[0] != "doc-b" and (d[0], d[1]) != ("doc-c", 1)]
+        fresh = build(remaining)
+
+        before = {q: results(index, q) for q in QUERIES}
+        assert before == {q: results(fresh, q) for q in QUERIES}
+
+        index.compact()
+        assert {q: results(index, q) for q in QUERIES} == before
+
+        path = tmp_path / "bm25.pkl"
+        index.save(str(path))
+        loaded = BM25Index.load(str(path))
+        assert {q: results(loaded, q) for q in QUERIES} == before
+        assert len(loaded) == len(remaining)
+
+    def test_replaced_chunk_is_searchable_only_with_new_content(self, tmp_path):
+        index = build(DOCS)
+        assert index.upsert("completely new text about embeddings", payload("doc-d", 0, "new")) is True
+        assert results(index, "latency") == []
+        assert [r[:2] for r in results(index, "embeddings")] == [("doc-d", 0)]
+
+        index.compact()
+        path = tmp_path / "bm25.pkl"
+        index.save(str(path))
+        loaded = BM25Index.load(str(path))
+        assert results(loaded, "latency") == []
+        assert results(loaded, "embeddings") == results(index, "embeddings")
+
+    def test_unchanged_upsert_keeps_document(self):
+        index = build(DOCS)
+        doc_id, chunk_idx, content = DOCS[0]
+        assert index.upsert(content, payload(doc_id, chunk_idx, content)) is False
+        assert len(index) == len(DOCS)
+        assert not index._tombstones
+
+    def test_filters_after_removal(self):
+        index = build(DOCS)
+        index.remove("doc-a", 0)
+        hits = results(index, "hybrid", filters={"doc_id": "doc-a"})
+        assert hits == []
+        assert [r[:2] for r in results(index, "hybrid")] == [("doc-d", 0)]
+
+    def test_remove_unknown_is_noop(self):
+        index = build(DOCS)
+        assert index.remove("nope") == 0
+        assert index.remove("doc-a", 99) == 0
+        assert len(index) == len(DOCS)
+
+    @pytest.mark.parametrize("ratio,expected", [(0.2, True), (0.9, False)])
+    def test_needs_compaction(self, ratio, expected):
+        index = build(DOCS)
+        index.compact_ratio = ratio
+        index.remove("doc-a")
+        assert index.needs_compaction is expected
@@ -0,0 +1,195 @@
+"""
+Tests de los caches del retriever: LRU, embeddings (memoria + SQLite) y resultados
+"""
+import time
+
+import pytest
+
+from rag.serve.cache import EmbeddingCache, LRUCache, ResultCache, SQLiteVectorStore
+
+class TestLRUCache:
+
+    def test_evicts_least_recently_used(self):
+        evicted = []
+        cache = LRUCache(max_entries=2, on_evict=evicted.append)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert evicted == ["b"]
+        assert cache.get("b") is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_entries=10, max_bytes=5, sizeof=len)
+        cache.put("a", "abc")
+        cache.put("b", "abc")
+        assert len(cache) == 1
+        assert cache.get("b") == "abc"
+
+    def test_ttl_expires(self):
+        cache = LRUCache(ttl_s=0.01)
+        cache.put("a", 1)
+        time.sleep(0.02)
+        assert cache.peek("a") is None
+        assert cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+
+    def test_peek_does_not_count_or_reorder(self):
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.peek("a") == 1
+        assert cache.peek("missing") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (0, 0)
+        # "a" sigue siendo el menos reciente
+        cache.put("c", 3)
+        assert cache.peek("a") is None
+
+class TestEmbeddingCache:
+
+    def test_disk_tier_survives_memory_and_promotes(self, tmp_path):
+        cache = EmbeddingCache("model", 4, disk_path=str(tmp_path / "emb.sqlite"))
+        cache.put("hello  world", [0.5, 0.25, 0.0, 1.0])
+        cache.memory.clear()
+
+        assert cache.get_memory("hello world") is None
+        assert cache.get_disk("hello world") == [0.5, 0.25, 0.0, 1.0]
+        assert cache.disk_hits == 1
+        assert cache.get_memory("hello world") == [0.5, 0.25, 0.0, 1.0]
+        cache.close()
+
+    def test_keys_depend_on_model_and_dimensions(self):
+        assert EmbeddingCache("a", 4).key("x") != EmbeddingCache("b", 4).key("x")
+        assert EmbeddingCache("a", 4).key("x") != EmbeddingCache("a", 8).key("x")
+
+    def test_peek_is_not_counted(self):
+        cache = EmbeddingCache("model", 2)
+        cache.put("q", [1.0, 0.0])
+        assert cache.peek("q") == [1.0, 0.0]
+        assert cache.peek("other") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (0, 0)
+
+    def test_memory_and_disk_writes_are_separate(self, tmp_path):
+        cache = EmbeddingCache("model", 2, disk_path=str(tmp_path / "emb.sqlite"))
+        cache.put_memory("q", [1.0, 0.0])
+        assert len(cache.disk) == 0
+        cache.put_disk("q", [1.0, 0.0])
+        cache.memory.clear()
+        assert cache.get("q") == [1.0, 0.0]
+        cache.close()
+
+class TestSQLiteVectorStore:
+
+    def test_prune_keeps_newest_entries(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(SQLiteVectorStore, "PRUNE_EVERY", 10)
+        store = SQLiteVectorStore(str(tmp_path / "emb.sqlite"), max_entries=4)
+        for i in range(10):
+            store.put(f"k{i}", [float(i)])
+        assert len(store) == 4
+        assert [store.get(f"k{i}") for i in range(6, 10)] == [[6.0], [7.0], [8.0], [9.0]]
+        assert store.get("k5") is None
+        store.close()
+
+    def test_prune_is_bounded_per_pass(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(SQLiteVectorStore, "PRUNE_EVERY", 10)
+        monkeypatch.setattr(SQLiteVectorStore, "PRUNE_BATCH", 3)
+        store = SQLiteVectorStore(str(tmp_path / "emb.sqlite"), max_entries=2)
+        for i in range(10):
+            store.put(f"k{i}", [float(i)])
+        # 8 sobrantes, 3 por pasada: el resto queda para las siguientes
+        assert len(store) == 7
+        assert store.get("k0") is None and store.get("k3") == [3.0]
+        store.close()
+
+    def test_prune_expired_entries(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(SQLiteVectorStore, "PRUNE_EVERY", 2)
+        store = SQLiteVectorStore(str(tmp_path / "emb.sqlite"), ttl_s=60)
+        store.put("old", [1.0])
+        store._conn.execute("UPDATE vectors SET stored_at = stored_at - 120 WHERE key = 'old'")
+        store.put("new", [2.0])
+        assert len(store) == 1 and store.get("new") == [2.0]
+        store.close()
+
+    def test_prune_uses_the_stored_at_index(self, tmp_path):
+        store = SQLiteVectorStore(str(tmp_path / "emb.sqlite"), max_entries=2)
+        plan = store._conn.execute(
+            "EXPLAIN QUERY PLAN SELECT stored_at FROM vectors ORDER BY stored_at DESC LIMIT 1 OFFSET 2"
+        ).fetchall()
+        assert any("vectors_stored_at" in row[-1] for row in plan)
+        assert not any("TEMP B-TREE" in row[-1] for row in plan)
+        store.close()
+
+class TestResultCache:
+
+    def test_exact_lookup_is_scoped(self):
+        cache = ResultCache()
+        scope = ResultCache.scope("cfg", 5, None)
+        cache.put("What is BM25?", scope, ["r"])
+        assert cache.get("what  is bm25?", scope) == ["r"]
+        assert cache.get("What is BM25?", ResultCache.scope("cfg", 10, None)) is None
+
+    def test_similar_lookup_counts_once(self):
+        cache = ResultCache(similarity_threshold=0.95)
+        scope = ResultCache.scope("cfg", 5, None)
+        cache.put("query one", scope, ["r"], embedding=[1.0, 0.0])
+
+        assert cache.get("query uno", scope) is None
+        assert cache.get_similar([0.99, 0.05], scope) == ["r"]
+        assert cache.get_similar([0.0, 1.0], scope) is None
+        assert cache.get_similar([0.99, 0.05], ResultCache.scope("cfg", 7, None)) is None
+
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["semantic_hits"]) == (0, 1, 1)
+
+    def test_eviction_forgets_vectors(self):
+        cache = ResultCache(max_entries=1, similarity_threshold=0.9)
+        scope = ResultCache.scope("cfg", 5, None)
+        cache.put("a", scope, ["a"], embedding=[1.0, 0.0])
+        cache.put("b", scope, ["b"], embedding=[0.0, 1.0])
+        assert cache.get_similar([1.0, 0.0], scope) is None
+        assert cache.get_similar([0.0, 1.0], scope) == ["b"]
+
+    def test_put_and_evict_update_rows_in_place(self):
+        cache = ResultCache(max_entries=3, similarity_threshold=0.9)
+        scope = ResultCache.scope("cfg", 5, None)
+        cache.put("a", scope, ["a"], embedding=[1.0, 0.0, 0.0])
+        matrix = cache._matrix
+        for name, vector in (("b", [0.0, 1.0, 0.0]), ("c", [0.0, 0.0, 1.0]), ("d", [1.0, 1.0, 0.0])):
+            cache.put(name, scope, [name], embedding=vector)
+        # La matriz no se reconstruye: "d" ocupa la fila liberada por "a"
+        assert cache._matrix is matrix and matrix.shape == (3, 3)
+        assert cache._rows[ResultCache.key("d", scope)] == 0
+        assert cache.get_similar([1.0, 0.0, 0.0], scope) is None
+        assert cache.get_similar([1.0, 1.05, 0.0], scope) == ["d"]
+
+    def test_best_match_in_scope_wins(self):
+        cache = ResultCache(similarity_threshold=0.8)
+        scope, other = ResultCache.scope("cfg", 5, None), ResultCache.scope("cfg", 7, None)
+        cache.put("exact other scope", other, ["other"], embedding=[1.0, 0.0])
+        cache.put("close", scope, ["close"], embedding=[0.9, 0.3])
+        cache.put("closer", scope, ["closer"], embedding=[0.95, 0.1])
+        assert cache.get_similar([1.0, 0.0], scope) == ["closer"]
+        assert cache.get_similar([1.0, 0.0], other) == ["other"]
+
+    def test_clear_resets_rows(self):
+        cache = ResultCache(max_entries=2, similarity_threshold=0.9)
+        scope = ResultCache.scope("cfg", 5, None)
+        cache.put("a", scope, ["a"], embedding=[1.0, 0.0])
+        cache.clear()
+        assert cache.get_similar([1.0, 0.0], scope) is None
+        cache.put("b", scope, ["b"], embedding=[0.0, 1.0])
+        cache.put("c", scope, ["c"], embedding=[1.0, 0.0])
+        assert cache.get_similar([1.0, 0.0], scope) == ["c"]
+
+    @pytest.mark.parametrize("generation,cleared", [("tag-1", False), ("tag-2", True)])
+    def test_generation_change_invalidates(self, generation, cleared):
+        cache = ResultCache()
+        cache.set_generation("tag-1")
+        scope = ResultCache.scope("cfg", 5, None)
+        cache.put("q", scope, ["r"])
+        cache.set_generation(generation)
+        assert (len(cache) == 0) is cleared
+        assert cache.stats()["invalidations"] == int(cleared)
@@ -0,0 +1,58 @@
+"""
+Tests de chunk_io: round-trip JSONL (plano/gzip), formato legado y tombstones
+"""
+import json
+
+import pytest
+
+from rag.ingest.chunk_io import ChunkWriter, is_tombstone, read_chunks, tombstone, zstandard
+
+CHUNKS = [
+    {"content": "primer chunk con acentos: canción", "metadata": {"doc_id": "a.md", "chunk_idx": 0}},
+    {"content": "segundo\nchunk", "metadata": {"doc_id": "a.md", "chunk_idx": 1}},
+]
+
+class TestChunkIO:
+
+    @pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.gz"])
+    def test_round_trip(self, tmp_path, suffix):
+        path = str(tmp_path / f"chunks{suffix}")
+        with ChunkWriter(path) as writer:
+            writer.write_many(iter(CHUNKS))
+            writer.write(tombstone("gone.md"))
+        assert writer.count == 3
+
+        records = list(read_chunks(path))
+        assert records[:2] == CHUNKS
+        assert is_tombstone(records[2]) and records[2]["metadata"]["doc_id"] == "gone.md"
+        assert not any(is_tombstone(record) for record in records[:2])
+
+    @pytest.mark.skipif(zstandard is None, reason="zstandard not installed")
+    def test_round_trip_zstd(self, tmp_path):
+        path = str(tmp_path / "chunks.jsonl.zst")
+        with ChunkWriter(path) as writer:
+            writer.write_many(CHUNKS)
+        assert list(read_chunks(path)) == CHUNKS
+
+    def test_one_compact_line_per_chunk(self, tmp_path):
+        path = tmp_path / "chunks.jsonl"
+        with ChunkWriter(str(path)) as writer:
+            writer.write_many(CHUNKS)
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0]) == CHUNKS[0]
+        assert "canción" in lines[0] and '", "' not in lines[0]
+
+    def test_reads_legacy_json_array(self, tmp_path):
+        path = tmp_path / "chunks.json"
+        path.write_text("  \n" + json.dumps(CHUNKS, indent=2), encoding="utf-8")
+        assert list(read_chunks(str(path))) == CHUNKS
+
+    def test_skips_blank_lines_and_empty_files(self, tmp_path):
+        path = tmp_path / "chunks.jsonl"
+        path.write_text("\n" + json.dumps(CHUNKS[0]) + "\n\n" + json.dumps(CHUNKS[1]) + "\n\n", encoding="utf-8")
+        assert list(read_chunks(str(path))) == CHUNKS
+
+        empty = tmp_path / "empty.jsonl"
+        empty.write_text("", encoding="utf-8")
+        assert list(read_chunks(str(empty))) == []
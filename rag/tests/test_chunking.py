@@ -0,0 +1,95 @@
+"""
+Tests de TextChunker: offsets sobre el texto original, presupuesto y ventana de overlap
+"""
+import random
+
+import pytest
+
+from rag.ingest.chunking import Span, TextChunker
+from rag.ingest.rate_limit import estimate_tokens
+
+SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+WORDS = ["índice", "vector", "chunk", "qdrant", "bm25", "rerank", "overlap", "token", "a", "documento"]
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+def random_document(rng: random.Random) -> str:
+    paragraphs = []
+    for _ in range(rng.randint(1, 8)):
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 25)))
+                     for _ in range(rng.randint(1, 6))]
+        paragraphs.append(". ".join(sentences) + rng.choice([".", "", "\n"]))
+    return rng.choice(["", " ", "\n"]) + "\n\n".join(paragraphs) + rng.choice(["", "\n", "  "])
+
+def documents(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [random_document(rng) for _ in range(count)]
+
+CASES = [
+    (counter, max_tokens, overlap_tokens)
+    for counter in (count_words, estimate_tokens)
+    for max_tokens, overlap_tokens in ((8, 3), (20, 5), (64, 16), (12, 0))
+]
+
+class TestTextChunker:
+
+    @pytest.mark.parametrize("counter,max_tokens,overlap_tokens", CASES)
+    def test_offsets_map_back_to_source(self, counter, max_tokens, overlap_tokens):
+        chunker = TextChunker(max_tokens, overlap_tokens, SEPARATORS, counter)
+        for text in documents(60):
+            for chunk in chunker.split(text):
+                assert 0 <= chunk.start < chunk.end <= len(text)
+                assert chunk.content == text[chunk.start:chunk.end]
+                assert chunk.content == chunk.content.strip()
+                assert chunk.tokens == counter(chunk.content)
+
+    @pytest.mark.parametrize("counter,max_tokens,overlap_tokens", CASES)
+    def test_budget_and_coverage(self, counter, max_tokens, overlap_tokens):
+        chunker = TextChunker(max_tokens, overlap_tokens, SEPARATORS, counter)
+        for text in documents(60, seed=11):
+            chunks = chunker.split(text)
+            assert all(chunk.tokens <= max_tokens for chunk in chunks)
+
+            # Nada se descarta salvo espacios en blanco
+            covered = [False] * len(text)
+            for chunk in chunks:
+                covered[chunk.start:chunk.end] = [True] * (chunk.end - chunk.start)
+            assert all(covered[i] or text[i].isspace() for i in range(len(text)))
+
+    @pytest.mark.parametrize("counter,max_tokens,overlap_tokens", CASES)
+    def test_overlap_bounds(self, counter, max_tokens, overlap_tokens):
+        chunker = TextChunker(max_tokens, overlap_tokens, SEPARATORS, counter)
+        for text in documents(60, seed=23):
+            chunks = chunker.split(text)
+            for previous, current in zip(chunks, chunks[1:]):
+                # El siguiente chunk avanza y sólo repite una cola del anterior
+                assert previous.start < current.start and previous.end < current.end
+                if current.start < previous.end:
+                    assert overlap_tokens > 0
+                    assert counter(text[current.start:previous.end]) <= chunker.overlap_tokens
+
+    def test_overlap_is_shared_between_neighbours(self):
+        text = " ".join(f"w{i}" for i in range(40))
+        chunks = TextChunker(10, 3, SEPARATORS, count_words).split(text)
+        assert len(chunks) > 1
+        for previous, current in zip(chunks, chunks[1:]):
+            assert text[current.start:previous.end].split() == previous.content.split()[-3:]
+
+    def test_no_overlap_when_disabled(self):
+        text = " ".join(f"w{i}" for i in range(40))
+        chunks = TextChunker(10, 0, SEPARATORS, count_words).split(text)
+        assert all(previous.end <= current.start for previous, current in zip(chunks, chunks[1:]))
+        assert " ".join(chunk.content for chunk in chunks) == text
+
+    def test_overlap_tail_at_document_start(self):
+        # El último span empieza en 0: text[start - 1] no debe leer el final del documento
+        text = "ab cd" + " ef" * 10 + "z"
+        chunker = TextChunker(4, 2, SEPARATORS, count_words)
+        spans = [Span(0, 5, 2, 0), Span(5, len(text), count_words(text[5:]), -1)]
+        assert chunker._overlap(text, spans, 0, 1) == (0, 2)
+
+    def test_empty_and_blank_documents(self):
+        chunker = TextChunker(8, 2, SEPARATORS, count_words)
+        assert chunker.split("") == []
+        assert chunker.split(" \n\n \t") == []
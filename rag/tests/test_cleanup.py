@@ -0,0 +1,82 @@
+"""
+Tests de equivalencia: CleanupEngine (clean_content) contra la implementación
+anterior (legacy_clean, re.sub por regla) en entradas adversariales
+"""
+import re
+import random
+
+import pytest
+import yaml
+
+from rag.eval.bench_cleanup import legacy_clean
+from rag.ingest.preprocess import CleanupEngine, DocumentPreprocessor
+
+from conftest import CONFIG_PATH
+
+@pytest.fixture(scope="module")
+def preprocessor():
+    with open(CONFIG_PATH, encoding='utf-8') as f:
+        return DocumentPreprocessor(yaml.safe_load(f))
+
+ADVERSARIAL = {
+    # Reglas de línea que coinciden en líneas adyacentes (y repetidas)
+    "adjacent_toc_lines": "intro\n- [a](#a)\n* [b](#b)\n1. [c](#c)\n2. [d](#d)\ntext",
+    "adjacent_headings": "## Navigation\n# Menu\n### Back to top\n## Contents\nbody",
+    "same_rule_twice": "- [a](#a)\n- [a](#a)\n- [a](#a)",
+    # Una regla deja texto (o líneas vacías) que otra regla vuelve a coincidir
+    "removed_line_then_indented_toc": "p\n# TOC\n  - [a](#b)\nq",
+    "removed_line_then_toc_block": "p\n## Table of Contents\n- [a](#a)\n- [c](#d)\n\n\nq",
+    "nav_link_inside_toc_line": "- [x](#y) [Next →](z)\n[← Back](w)- [a](#b)",
+    "script_removal_exposes_toc": "a\n<script>\nx</script>- [t](#u)\nb",
+    "control_chars_split_heading": "#\x01# Menu\nz\x0b\n\n\n\nend",
+    "blank_runs_between_matches": "a\n\n\n- [x](#y)\n\n\n\n## Nav\n\n\nb",
+    # Anclas ^/$ al inicio y al final del texto
+    "match_at_start": "# Table of Contents\nrest",
+    "match_at_end": "rest\n- [last](#last)",
+    "match_is_whole_text": "## Back to top",
+    "only_matches": "# TOC\n- [a](#a)\n## Menu",
+    "leading_whitespace_before_anchor": "\n\n  \t- [a](#a)\nx",
+    "trailing_newlines_after_match": "x\n1. [n](#n)\n\n\n",
+    "crlf_lines": "a\r\n- [a](#a)\r\n## Nav\r\nb",
+    "empty": "",
+    "whitespace_only": " \n\t\n ",
+}
+
+FRAGMENTS = ['\n', '\n\n', ' ', '\t', '# TOC', '## Contents x', '- [a](#b)', '1. [x](#y) z', '* [q](#r)',
+             'text', '[← Back](u)', '[next →](v)', '<meta a>', '<LINK b>', '<script>x\ny</script>',
+             '<style>', '</style>', '\x0b', '\x0c', '\x01', '   ', '#', 'Nav', '↑', '\r', '[', ']',
+             '(#', ')', '<', '>', '\n  \n', '## Back to top']
+
+class TestCleanupEquivalence:
+
+    @pytest.mark.parametrize("name", sorted(ADVERSARIAL))
+    def test_adversarial_fixtures(self, preprocessor, name):
+        content = ADVERSARIAL[name]
+        assert preprocessor.clean_content(content) == legacy_clean(preprocessor.cleanup_patterns, content)
+
+    def test_random_fragment_documents(self, preprocessor):
+        rng = random.Random(16)
+        for _ in range(5000):
+            content = ''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 14)))
+            assert preprocessor.clean_content(content) == legacy_clean(preprocessor.cleanup_patterns, content), content
+
+    def test_line_rules_are_newline_anchored(self, preprocessor):
+        anchored = [regex for regex, _, line_anchored in preprocessor.cleanup_engine.passes if line_anchored]
+        assert len(anchored) == 5
+        assert all(regex.pattern.startswith('\\n') for regex in anchored)
+        assert len(preprocessor.cleanup_engine.passes) == len(preprocessor.cleanup_patterns)
+
+    @pytest.mark.parametrize("rules,content", [
+        # Una regla produce texto que coincide con la regla de línea siguiente
+        ([(r'X', 'DROP', 0), (r'^DROP.*$', '', re.MULTILINE)], "X\nkeep\nX"),
+        # Vaciar una línea deja que el \\s* de la regla siguiente cruce el salto
+        ([(r'^x.*$', '', re.MULTILINE), (r'^\\s*y.*$', '', re.MULTILINE)], "p\nx\ny\nq"),
+        ([(r'^x.*$', '', re.MULTILINE), (r'^\\s*y.*$', '', re.MULTILINE)], "x\n\n  y\nx\ny"),
+        # Matches adyacentes de la misma regla y anclas al inicio/fin del texto
+        ([(r'^-.*$', '', re.MULTILINE)], "-a\n-b\n\n-c"),
+        ([(r'^#\\s*toc.*$', '', re.MULTILINE | re.IGNORECASE)], "# TOC\nbody\n#toc"),
+        # Reglas no elegibles (DOTALL, reemplazo no vacío) se aplican tal cual
+        ([(r'^a.*$', '', re.MULTILINE | re.DOTALL), (r'^b.*$', 'B', re.MULTILINE)], "a\nb\nc"),
+    ])
+    def test_generic_rules(self, rules, content):
+        assert CleanupEngine(rules).clean(content) == legacy_clean(rules, content)
@@ -0,0 +1,104 @@
+"""
+Tests del pipeline de embeddings: ids de punto estables entre réplicas y log de upserts
+"""
+import json
+
+import yaml
+
+from rag.ingest.embed import EmbeddingPipeline
+
+def chunks(contents, doc_id="doc"):
+    return [
+        {"content": content, "metadata": {"doc_id": doc_id, "chunk_idx": idx, "chunk_hash": f"h-{content}"}}
+        for idx, content in enumerate(contents)
+    ]
+
+def pipeline(config_path, incremental=False):
+    with open(config_path, encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config['ingest']['incremental'] = incremental
+    pipeline = EmbeddingPipeline(config)
+    pipeline.create_collection()
+    return pipeline
+
+class TestPointIds:
+
+    def test_point_id_ignores_replica_tag_and_content(self):
+        first = chunks(["alpha"])[0]
+        second = chunks(["changed"])[0]
+        assert EmbeddingPipeline._generate_point_id(first) == EmbeddingPipeline._generate_point_id(second)
+        assert EmbeddingPipeline._generate_point_id(first) != EmbeddingPipeline._generate_point_id(chunks(["x", "y"])[1])
+
+    def test_reingest_overwrites_in_place(self, make_config):
+        config_path = make_config()
+        ingest = pipeline(config_path)
+        ingest.upsert_chunks(chunks(["alpha", "beta"]), "tag-1")
+        ingest.upsert_chunks(chunks(["alpha", "beta v2"]), "tag-2")
+
+        info = ingest.vector_store.info()
+        assert info["points_count"] == 2
+        payloads = {hit.payload["chunk_idx"]: hit.payload for hit in ingest.vector_store.scroll(10)[0]}
+        assert {payload["replica_tag"] for payload in payloads.values()} == {"tag-2"}
+        assert payloads[1]["content"] == "beta v2"
+        ingest.vector_store.close()
+
+class TestUpsertLog:
+
+    def test_log_is_scoped_to_the_with_block(self, make_config, tmp_path):
+        config_path = make_config()
+        ingest = pipeline(config_path)
+        log_path = tmp_path / "upserts.jsonl"
+        with ingest.open_upsert_log(str(log_path)) as upsert_log:
+            assert ingest.upsert_log is upsert_log
+            ingest.upsert_chunks(chunks(["alpha", "beta"]), "tag-1")
+        assert ingest.upsert_log is None
+
+        # Una ingesta posterior no escribe en el log ya cerrado
+        ingest.upsert_chunks(chunks(["gamma"], doc_id="other"), "tag-2")
+        lines = log_path.read_text(encoding='utf-8').splitlines()
+        assert len(lines) == 3
+        assert json.loads(lines[-1])["summary"]["status"] == "completed"
+
+    def test_log_is_detached_on_error(self, make_config, tmp_path):
+        ingest = pipeline(make_config())
+        log_path = tmp_path / "upserts.jsonl"
+        try:
+            with ingest.open_upsert_log(str(log_path)):
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        assert ingest.upsert_log is None
+        assert '"failed"' in log_path.read_text(encoding='utf-8')
+
+class TestSupersededChunks:
+
+    def test_shrunken_document_drops_stale_chunks(self, make_config):
+        ingest = pipeline(make_config())
+        ingest.upsert_chunks(chunks(["alpha", "beta", "zebra stripes"]) + chunks(["other"], doc_id="keep"), "tag-1")
+        assert [p["chunk_idx"] for p, _ in ingest.bm25_index.search("zebra", 5)] == [2]
+
+        result = ingest.upsert_chunks(chunks(["alpha", "beta v2"]), "tag-2")
+        assert result["deleted"] == 1
+        assert ingest.bm25_index.search("zebra", 5) == []
+        assert ingest.bm25_index.chunk_indices("doc") == [0, 1]
+        # Los documentos ausentes de la corrida no se tocan
+        assert ingest.bm25_index.chunk_indices("keep") == [0]
+        assert ingest.vector_store.info()["points_count"] == 3
+
+    def test_without_bm25_probes_the_vector_store(self, make_config, monkeypatch):
+        monkeypatch.setattr(EmbeddingPipeline, "SUPERSEDED_PROBE", 2)
+        ingest = pipeline(make_config({"bm25": {"index_path": None}}))
+        ingest.upsert_chunks(chunks([f"chunk {i}" for i in range(7)]), "tag-1")
+
+        result = ingest.upsert_chunks(chunks(["chunk 0"]), "tag-2")
+        assert result["deleted"] == 6
+        assert [hit.payload["chunk_idx"] for hit in ingest.vector_store.scroll(10)[0]] == [0]
+
+    def test_failed_document_keeps_its_chunks(self, make_config, monkeypatch):
+        ingest = pipeline(make_config())
+        ingest.upsert_chunks(chunks(["alpha", "beta"]), "tag-1")
+        monkeypatch.setattr(ingest, "_embed_with_retry", lambda batch: [None] * len(batch))
+
+        result = ingest.upsert_chunks(chunks(["alpha"]), "tag-2")
+        assert result["errors"] == 1 and result["deleted"] == 0
+        assert ingest.bm25_index.chunk_indices("doc") == [0, 1]
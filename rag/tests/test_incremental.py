@@ -0,0 +1,160 @@
+"""
+Tests de la ingesta incremental preprocess -> embed: archivos cambiados, borrados,
+con error, que ya no producen chunks, y confirmación diferida del manifest
+"""
+import os
+
+import pytest
+import yaml
+
+from rag.ingest.chunk_io import is_file_manifest_update, is_tombstone
+from rag.ingest.embed import EmbeddingPipeline
+from rag.ingest.manifest import FileManifest
+from rag.ingest.preprocess import DocumentPreprocessor
+
+@pytest.fixture
+def setup(make_config, tmp_path):
+    config_path = make_config({
+        'preprocess': {'incremental': True, 'workers': 1},
+        'ingest': {'incremental': True},
+        'embeddings': {'max_retries': 0, 'retry_base_s': 0},
+    })
+    with open(config_path, encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    source = tmp_path / "docs"
+    source.mkdir()
+    return config, source
+
+def write(path, text, bump=0):
+    path.write_text(text, encoding='utf-8')
+    if bump:
+        # mtime distinto aunque la corrida anterior caiga en el mismo tick
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump))
+
+def run(config, source, fail_on=None):
+    """Una corrida preprocess + embed; fail_on: texto cuyo embedding falla"""
+    records = list(DocumentPreprocessor(config).iter_directory(source, workers=1))
+    pipeline = EmbeddingPipeline(config)
+    pipeline.create_collection()
+    if fail_on is not None:
+        embed = pipeline.embedding_provider.embed
+
+        def failing(texts):
+            if any(fail_on in text for text in texts):
+                raise RuntimeError("embedding backend error")
+            return embed(texts)
+        pipeline.embedding_provider.embed = failing
+    try:
+        result = pipeline.upsert_chunks(iter(records), "tag", prune=False)
+        points = {hit.payload['doc_id'] for hit in pipeline.vector_store.scroll(1000)[0]}
+    finally:
+        pipeline.vector_store.close()
+        pipeline.manifest.close()
+    return records, result, points
+
+def chunk_docs(records):
+    return {r['metadata']['doc_id'] for r in records if not is_tombstone(r) and not is_file_manifest_update(r)}
+
+def tombstones(records):
+    return {r['metadata']['doc_id'] for r in records if is_tombstone(r)}
+
+def manifest_paths(config, source):
+    manifest = FileManifest(config['preprocess']['manifest_path'], str(source))
+    try:
+        return set(manifest.entries())
+    finally:
+        manifest.close()
+
+class TestIncrementalIngest:
+
+    def test_changed_and_deleted_files(self, setup):
+        config, source = setup
+        a, b, c = source / "a.md", source / "b.md", source / "c.md"
+        write(a, "# A\n\nalpha content")
+        write(b, "# B\n\nbeta content")
+        write(c, "# C\n\ngamma content")
+
+        records, _, points = run(config, source)
+        assert chunk_docs(records) == {str(a), str(b), str(c)}
+        assert points == {str(a), str(b), str(c)}
+        assert manifest_paths(config, source) == {str(a), str(b), str(c)}
+
+        # Sin cambios: sólo el registro del manifest
+        records, _, _ = run(config, source)
+        assert chunk_docs(records) == set() and tombstones(records) == set()
+
+        write(b, "# B\n\nbeta content, edited", bump=10**9)
+        c.unlink()
+        records, result, points = run(config, source)
+        assert chunk_docs(records) == {str(b)}
+        assert tombstones(records) == {str(c)}
+        assert result['deleted_docs'] == 1
+        assert points == {str(a), str(b)}
+        assert manifest_paths(config, source) == {str(a), str(b)}
+
+    def test_file_without_chunks_emits_tombstone(self, setup):
+        config, source = setup
+        a, b = source / "a.md", source / "b.md"
+        write(a, "# A\n\nalpha content")
+        write(b, "# B\n\nbeta content")
+        run(config, source)
+
+        # Tras la limpieza no queda contenido: los chunks anteriores deben borrarse
+        write(b, "## Table of Contents\n", bump=10**9)
+        records, _, points = run(config, source)
+        assert chunk_docs(records) == set()
+        assert tombstones(records) == {str(b)}
+        assert points == {str(a)}
+        assert manifest_paths(config, source) == {str(a), str(b)}
+
+    def test_errored_file_is_retried(self, setup):
+        config, source = setup
+        a, bad = source / "a.md", source / "bad.md"
+        write(a, "# A\n\nalpha content")
+        bad.write_bytes(b"\xff\xfe not utf-8 \x80")
+
+        records, _, points = run(config, source)
+        assert chunk_docs(records) == {str(a)}
+        assert str(bad) not in manifest_paths(config, source)
+
+        # Se reintenta en cada corrida hasta que se procese bien
+        records, _, _ = run(config, source)
+        assert chunk_docs(records) == set()
+        write(bad, "# Fixed\n\nnow readable", bump=10**9)
+        records, _, points = run(config, source)
+        assert chunk_docs(records) == {str(bad)}
+        assert points == {str(a), str(bad)}
+        assert manifest_paths(config, source) == {str(a), str(bad)}
+
+    def test_manifest_waits_for_embed(self, setup):
+        config, source = setup
+        a, b = source / "a.md", source / "b.md"
+        write(a, "# A\n\nalpha content")
+        write(b, "# B\n\nbeta broken content")
+
+        # Preprocess solo (embed nunca corre): nada queda marcado como visto
+        list(DocumentPreprocessor(config).iter_directory(source, workers=1))
+        assert manifest_paths(config, source) == set()
+
+        # Embed falla para b: sólo a se confirma, b vuelve a emitirse
+        _, result, _ = run(config, source, fail_on="broken")
+        assert result['errors'] == 1
+        assert manifest_paths(config, source) == {str(a)}
+        records, _, points = run(config, source)
+        assert chunk_docs(records) == {str(b)}
+        assert points == {str(a), str(b)}
+
+    def test_config_change_reprocesses_everything(self, setup):
+        config, source = setup
+        a, b = source / "a.md", source / "b.md"
+        write(a, "# A\n\nalpha content")
+        write(b, "# B\n\nbeta content")
+        run(config, source)
+
+        config['chunking']['max_tokens'] = 120
+        records, _, _ = run(config, source)
+        assert chunk_docs(records) == {str(a), str(b)}
+
+        records, _, _ = run(config, source)
+        assert chunk_docs(records) == set()
@@ -0,0 +1,37 @@
+"""
+Tests de los manifests de ingesta (chunks por colección, archivos por fuente)
+"""
+from rag.ingest.manifest import ChunkManifest, FileManifest
+
+class TestChunkManifest:
+
+    def test_record_entries_remove(self, tmp_path):
+        manifest = ChunkManifest(str(tmp_path / "m.sqlite"), "col")
+        manifest.record([("d1", 0, "h0", "p0", "t1"), ("d1", 1, "h1", "p1", "t1")])
+        manifest.record([("d1", 1, "h1b", "p1", "t2")])
+        assert manifest.entries() == {("d1", 0): ("h0", "p0"), ("d1", 1): ("h1b", "p1")}
+
+        manifest.remove([("d1", 0), ("missing", 3)])
+        assert manifest.entries() == {("d1", 1): ("h1b", "p1")}
+        assert len(manifest) == 1
+        manifest.close()
+
+    def test_collections_are_isolated_and_persisted(self, tmp_path):
+        path = str(tmp_path / "m.sqlite")
+        first = ChunkManifest(path, "a")
+        first.record([("d", 0, "h", "p", None)])
+        first.close()
+
+        assert ChunkManifest(path, "b").entries() == {}
+        assert ChunkManifest(path, "a").entries() == {("d", 0): ("h", "p")}
+
+class TestFileManifest:
+
+    def test_record_and_remove_by_source(self, tmp_path):
+        path = str(tmp_path / "files.sqlite")
+        docs = FileManifest(path, "/docs")
+        docs.record({"a.md": (10, 1, "ha"), "b.md": (20, 2, "hb")})
+        docs.remove(["a.md"])
+        assert docs.entries() == {"b.md": (20, 2, "hb")}
+        assert FileManifest(path, "/other").entries() == {}
+        docs.close()
@@ -0,0 +1,121 @@
+"""
+Tests del sampling profiler: atribución por task en el hilo del loop y muestreo con umbral
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rag.serve.profiling import SamplingProfiler, attributed
+
+def busy(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+@pytest.fixture
+def profiler(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), interval_ms=2, slow_threshold_ms=0)
+    yield profiler
+    profiler.close()
+
+def state_weights(session):
+    """ms por atribución ('request', 'other task', 'idle', 'loop', 'other request', 'shared')"""
+    weights = {}
+    for thread, _, weight_ms in session.samples:
+        state = thread[thread.index("[") + 1:-1]
+        weights[state] = weights.get(state, 0.0) + weight_ms
+    return weights
+
+def thread_weights(session, name_prefix):
+    """ms por atribución de los hilos cuyo nombre empieza con name_prefix"""
+    weights = {}
+    for thread, _, weight_ms in session.samples:
+        if thread.startswith(name_prefix):
+            state = thread[thread.index("[") + 1:-1]
+            weights[state] = weights.get(state, 0.0) + weight_ms
+    return weights
+
+class TestTaskAttribution:
+
+    def test_request_vs_other_task_vs_idle(self, profiler):
+        async def other_task():
+            await asyncio.sleep(0)
+            busy(0.15)
+
+        async def request(other):
+            session = profiler.start("request", asyncio.current_task())
+            busy(0.15)
+            await other
+            await asyncio.sleep(0.15)
+            profiler.stop(session)
+            return session
+
+        async def main():
+            return await request(asyncio.ensure_future(other_task()))
+
+        session = asyncio.run(main())
+        weights = state_weights(session)
+        # CPU de la request, de otra task que la bloquea y espera en select
+        assert weights.get("request", 0) > 50
+        assert weights.get("other task", 0) > 50
+        assert weights.get("idle", 0) > 50
+
+    def test_session_without_task_owns_its_thread(self, profiler):
+        session = profiler.start("sync")
+        busy(0.05)
+        profiler.stop(session)
+        assert session.loop_thread is None
+        assert session.samples and set(state_weights(session)) == {"request"}
+
+class TestExecutorAttribution:
+
+    def test_executor_work_is_charged_to_its_request(self, profiler):
+        executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="worker")
+
+        async def request(name, seconds):
+            session = profiler.start(name, asyncio.current_task())
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, attributed(busy), seconds)
+            profiler.stop(session)
+            return session
+
+        async def main():
+            # Trabajo sin dueño en paralelo (p.ej. un micro-batcher): compartido
+            shared = asyncio.get_running_loop().run_in_executor(executor, busy, 0.15)
+            sessions = await asyncio.gather(request("a", 0.15), request("b", 0.3))
+            await shared
+            return sessions
+
+        first, second = asyncio.run(main())
+        executor.shutdown()
+        assert attributed(busy) is busy  # fuera de una request no se envuelve
+
+        first_weights, second_weights = thread_weights(first, "worker"), thread_weights(second, "worker")
+        assert 50 < first_weights["request"] < 250
+        assert second_weights["request"] > 200
+        # El worker de la otra request se etiqueta como ajeno, no como propio
+        assert first_weights["other request"] > 50 and second_weights["other request"] > 50
+        assert first_weights["shared"] > 50
+
+class TestShouldProfile:
+
+    def test_threshold_samples_every_request_by_default(self, tmp_path):
+        profiler = SamplingProfiler(str(tmp_path), slow_threshold_ms=100)
+        assert all(profiler.should_profile() == (True, False) for _ in range(50))
+
+    def test_slow_sample_rate_bounds_threshold_sampling(self, tmp_path):
+        profiler = SamplingProfiler(str(tmp_path), slow_threshold_ms=100, slow_sample_rate=0.0)
+        assert all(profiler.should_profile() == (False, False) for _ in range(50))
+
+    def test_sample_rate_keeps_profile(self, tmp_path):
+        profiler = SamplingProfiler(str(tmp_path), sample_rate=1.0)
+        assert profiler.should_profile() == (True, True)
+
+    def test_from_config(self, tmp_path):
+        assert SamplingProfiler.from_config({}) is None
+        profiler = SamplingProfiler.from_config({
+            "enabled": True, "output_dir": str(tmp_path), "slow_threshold_ms": 500, "slow_sample_rate": 0.25
+        })
+        assert profiler.stats()["slow_sample_rate"] == 0.25
@@ -0,0 +1,71 @@
+"""
+Tests de RerankEngine: orden por longitud, cache de scores y contadores
+"""
+import threading
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from rag.serve.reranker import RerankEngine
+
+class LengthModel:
+    """Cross-encoder de prueba: score = longitud del contenido"""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        with self._lock:
+            self.calls.append([tuple(pair) for pair in pairs])
+        return [float(len(content)) for _, content in pairs]
+
+class TestRerankEngine:
+
+    def test_sorted_by_length_and_restored(self):
+        model = LengthModel()
+        engine = RerankEngine(model, cache_entries=0)
+        contents = ["ccc", "a", "bbbbb", "dd"]
+        scores = engine.predict_pairs([("q", content) for content in contents])
+        assert scores == [3.0, 1.0, 5.0, 2.0]
+        assert [content for _, content in model.calls[0]] == ["a", "dd", "ccc", "bbbbb"]
+
+    def test_length_sort_disabled(self):
+        model = LengthModel()
+        engine = RerankEngine(model, cache_entries=0, length_sort=False)
+        engine.predict_pairs([("q", "ccc"), ("q", "a")])
+        assert [content for _, content in model.calls[0]] == ["ccc", "a"]
+
+    def test_score_cache_skips_known_pairs(self):
+        model = LengthModel()
+        engine = RerankEngine(model)
+        assert engine.score("Q", ["aa", "b"], ["id-a", "id-b"]) == [2.0, 1.0]
+        assert engine.score("Q", ["aa", "ccc"], ["id-a", "id-c"]) == [2.0, 3.0]
+        assert model.calls[-1] == [("Q", "ccc")]
+        assert engine.stats()["pairs_cached"] == 1
+
+    def test_score_many_single_pass(self):
+        model = LengthModel()
+        engine = RerankEngine(model, cache_entries=0)
+        results = engine.score_many([
+            ("q1", ["a", "bb"], ["1", "2"]),
+            ("q2", ["ccc"], ["3"])
+        ])
+        assert results == [[1.0, 2.0], [3.0]]
+        assert len(model.calls) == 1
+
+    def test_counters_are_thread_safe(self):
+        engine = RerankEngine(LengthModel(), cache_entries=0)
+        pairs = [("q", "x" * n) for n in range(10)]
+
+        def worker():
+            for _ in range(200):
+                engine.predict_pairs(pairs)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert engine.pairs_scored == 8 * 200 * len(pairs)
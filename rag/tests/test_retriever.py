@@ -0,0 +1,68 @@
+"""
+Tests de HybridRetriever: fusión RRF (pesos, deduplicación entre piernas)
+"""
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from rag.serve.retriever import Chunk, HybridRetriever
+
+def chunk(doc_id, chunk_idx, method, score=1.0, **extra):
+    metadata = {"doc_id": doc_id, "chunk_idx": chunk_idx, **extra}
+    return Chunk(content=f"{doc_id}#{chunk_idx}", metadata=metadata, score=score, retrieval_method=method)
+
+@pytest.fixture
+def retriever(make_config):
+    retriever = HybridRetriever(make_config())
+    yield retriever
+    if retriever.executor is not None:
+        retriever.executor.shutdown(wait=False)
+
+class TestReciprocalRankFusion:
+
+    def test_dedup_across_legs_by_doc_and_chunk(self, retriever):
+        # La pierna vectorial trae point_id/chunk_hash; BM25 sólo el payload
+        vector = [chunk("a", 0, "vector", chunk_hash="h-a0"), chunk("b", 0, "vector", chunk_hash="h-b0")]
+        vector[0].point_id = 101
+        bm25 = [chunk("b", 0, "bm25"), chunk("a", 0, "bm25"), chunk("c", 1, "bm25")]
+
+        fused = retriever.reciprocal_rank_fusion({"vector": vector, "bm25": bm25}, k=60, weights={})
+        keys = [(c.metadata["doc_id"], c.metadata["chunk_idx"]) for c in fused]
+        assert sorted(keys) == [("a", 0), ("b", 0), ("c", 1)]
+
+        expected = 1 / 61 + 1 / 62
+        assert fused[0].score == pytest.approx(expected)
+        assert fused[1].score == pytest.approx(expected)
+        assert fused[2].score == pytest.approx(1 / 63)
+        assert all(c.retrieval_method == "hybrid_rrf" for c in fused)
+
+    def test_weights_change_the_order(self, retriever):
+        legs = {"vector": [chunk("a", 0, "vector")], "bm25": [chunk("b", 0, "bm25")]}
+        fused = retriever.reciprocal_rank_fusion(legs, k=60, weights={"vector": 1.0, "bm25": 2.0})
+        assert [c.metadata["doc_id"] for c in fused] == ["b", "a"]
+        assert fused[0].score == pytest.approx(2.0 / 61)
+
+        fused = retriever.reciprocal_rank_fusion(legs, k=60, weights={"vector": 3.0})
+        assert [c.metadata["doc_id"] for c in fused] == ["a", "b"]
+        assert fused[1].score == pytest.approx(1.0 / 61)
+
+    def test_weights_from_config(self, retriever):
+        retriever.retrieval_config["fusion_weights"] = {"bm25": 0.5}
+        legs = {"vector": [chunk("a", 0, "vector")], "bm25": [chunk("b", 0, "bm25")]}
+        fused = retriever.reciprocal_rank_fusion(legs, k=60)
+        assert [c.score for c in fused] == pytest.approx([1 / 61, 0.5 / 61])
+
+    def test_leg_chunks_are_not_mutated(self, retriever):
+        vector = [chunk("a", 0, "vector", score=0.9)]
+        bm25 = [chunk("a", 0, "bm25", score=7.5)]
+        fused = retriever.reciprocal_rank_fusion({"vector": vector, "bm25": bm25}, k=60)
+        assert (vector[0].score, vector[0].retrieval_method) == (0.9, "vector")
+        assert (bm25[0].score, bm25[0].retrieval_method) == (7.5, "bm25")
+        assert fused[0] is not vector[0]
+
+    def test_content_fallback_without_payload_identity(self, retriever):
+        first = Chunk(content="same text", metadata={}, score=1.0, retrieval_method="vector")
+        second = Chunk(content="same text", metadata={"source": "x"}, score=2.0, retrieval_method="bm25")
+        other = Chunk(content="other text", metadata={}, score=1.0, retrieval_method="bm25")
+        fused = retriever.reciprocal_rank_fusion({"vector": [first], "bm25": [second, other]}, k=60)
+        assert [c.content for c in fused] == ["same text", "other text"]
@@ -0,0 +1,169 @@
+"""
+Tests de los backends vectoriales: LocalVectorStore (round-trip upsert/delete/search,
+filas reutilizadas y persistencia) y QdrantBackend contra el cliente en memoria
+"""
+import asyncio
+import uuid
+
+import numpy as np
+import pytest
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from rag.serve.vector_store import LocalVectorStore, QdrantBackend, hnswlib
+
+DIMENSIONS = 8
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, DIMENSIONS)).astype(np.float32)
+
+def open_store(tmp_path, **kwargs):
+    kwargs.setdefault('search_mode', 'flat')
+    return LocalVectorStore(str(tmp_path), "test", reload_interval_s=0, **kwargs)
+
+def populate(store, count=20):
+    matrix = vectors(count)
+    ids = [f"p{i}" for i in range(count)]
+    payloads = [{"doc_id": f"d{i % 4}", "chunk_idx": i} for i in range(count)]
+    store.upsert(ids, matrix.tolist(), payloads)
+    return ids, matrix
+
+class TestLocalVectorStore:
+
+    def test_search_finds_each_point(self, tmp_path):
+        store = open_store(tmp_path)
+        ids, matrix = populate(store)
+        for point_id, vector in zip(ids, matrix):
+            hits = store.search(vector.tolist(), 1)
+            assert hits[0].id == point_id
+            assert hits[0].score == pytest.approx(1.0, abs=1e-5)
+        store.close()
+
+    def test_filters(self, tmp_path):
+        store = open_store(tmp_path)
+        _, matrix = populate(store)
+        hits = store.search(matrix[0].tolist(), 50, filters={"doc_id": "d1"})
+        assert hits and all(hit.payload["doc_id"] == "d1" for hit in hits)
+        assert len(hits) == 5
+        store.close()
+
+    def test_delete_removes_from_results_and_reuses_rows(self, tmp_path):
+        store = open_store(tmp_path)
+        ids, matrix = populate(store)
+        store.delete(["p3", "p7", "missing"])
+        assert store.info()["points_count"] == 18
+        assert all(hit.id not in ("p3", "p7") for hit in store.search(matrix[3].tolist(), 20))
+        freed = sorted(store._free)
+
+        new_vectors = vectors(2, seed=1)
+        store.upsert(["n0", "n1"], new_vectors.tolist(), [{"doc_id": "new"}, {"doc_id": "new"}])
+        assert store._count == 20
+        assert sorted(store._rows[point_id] for point_id in ("n0", "n1")) == freed
+        assert store.search(new_vectors[1].tolist(), 1)[0].id == "n1"
+        store.close()
+
+    def test_upsert_existing_id_overwrites_in_place(self, tmp_path):
+        store = open_store(tmp_path)
+        _, matrix = populate(store)
+        row = store._rows["p0"]
+        store.upsert(["p0"], [matrix[5].tolist()], [{"doc_id": "moved"}])
+        assert store._rows["p0"] == row
+        hits = store.search(matrix[5].tolist(), 2)
+        assert {hit.id for hit in hits} == {"p0", "p5"}
+        assert store.get_vectors(["p0"])["p0"] == pytest.approx(store.get_vectors(["p5"])["p5"], abs=1e-6)
+        store.close()
+
+    def test_reopen_after_flush(self, tmp_path):
+        store = open_store(tmp_path)
+        ids, matrix = populate(store)
+        freed_row = store._rows["p1"]
+        store.delete(["p1"])
+        store.close()
+
+        reopened = open_store(tmp_path)
+        assert reopened.info()["points_count"] == len(ids) - 1
+        assert reopened._free == [freed_row]
+        assert reopened.search(matrix[2].tolist(), 1)[0].id == "p2"
+        scrolled, _ = reopened.scroll(100)
+        assert {hit.id for hit in scrolled} == set(ids) - {"p1"}
+        reopened.close()
+
+    def test_capacity_grows(self, tmp_path):
+        store = open_store(tmp_path)
+        store.MIN_CAPACITY = 4
+        populate(store, count=10)
+        assert store.info()["capacity"] >= 10
+        assert store.info()["points_count"] == 10
+        store.close()
+
+    @pytest.mark.skipif(hnswlib is None, reason="hnswlib not installed")
+    def test_hnsw_matches_flat_top1(self, tmp_path):
+        store = open_store(tmp_path, search_mode='hnsw', full_scan_threshold=0)
+        ids, matrix = populate(store, count=50)
+        store.delete(["p10"])
+        for idx in (0, 11, 49):
+            assert store.search(matrix[idx].tolist(), 1)[0].id == ids[idx]
+        assert all(hit.id != "p10" for hit in store.search(matrix[10].tolist(), 5))
+        store.close()
+
+def qdrant_points(count=12):
+    matrix = vectors(count, seed=3)
+    ids = [uuid.uuid5(uuid.NAMESPACE_URL, f"p{i}").hex for i in range(count)]
+    payloads = [{"doc_id": f"d{i % 3}", "chunk_idx": i} for i in range(count)]
+    return ids, matrix, payloads
+
+@pytest.fixture
+def qdrant():
+    backend = QdrantBackend(":memory:", "test")
+    backend.create_collection(DIMENSIONS)
+    ids, matrix, payloads = qdrant_points()
+    backend.upsert(ids, matrix.tolist(), payloads)
+    yield backend, ids, matrix
+    backend.close()
+
+class TestQdrantBackend:
+
+    def test_search_finds_each_point(self, qdrant):
+        backend, ids, matrix = qdrant
+        for point_id, vector in zip(ids, matrix):
+            hits = backend.search(vector.tolist(), 3)
+            assert backend._id_key(hits[0].id) == point_id
+            assert hits[0].score == pytest.approx(1.0, abs=1e-5)
+            assert hits[0].payload["chunk_idx"] == ids.index(point_id)
+
+    def test_search_filters_and_batch(self, qdrant):
+        backend, ids, matrix = qdrant
+        hits = backend.search(matrix[0].tolist(), 10, {"doc_id": "d1"})
+        assert hits and all(hit.payload["doc_id"] == "d1" for hit in hits)
+
+        batch = backend.search_batch([matrix[1].tolist(), matrix[2].tolist()], 2)
+        assert [backend._id_key(hits[0].id) for hits in batch] == [ids[1], ids[2]]
+
+    def test_delete_vectors_and_info(self, qdrant):
+        backend, ids, matrix = qdrant
+        backend.delete([ids[0]])
+        assert backend._id_key(backend.search(matrix[0].tolist(), 1)[0].id) != ids[0]
+        assert backend.get_vectors([ids[1], ids[0]]).keys() == {ids[1]}
+        info = backend.info()
+        assert info["points_count"] == info["vectors_count"] == len(ids) - 1
+
+    def test_async_search(self):
+        backend = QdrantBackend(":memory:", "test")
+        ids, matrix, payloads = qdrant_points()
+
+        async def search():
+            # El cliente async en memoria es otra base: se carga por el mismo cliente
+            client = backend.async_client
+            await client.create_collection(
+                "test", vectors_config=VectorParams(size=DIMENSIONS, distance=Distance.COSINE)
+            )
+            await client.upsert("test", points=[
+                PointStruct(id=point_id, vector=vector.tolist(), payload=payload)
+                for point_id, vector, payload in zip(ids, matrix, payloads)
+            ])
+            hits = await backend.asearch(matrix[4].tolist(), 2, {"doc_id": "d1"})
+            await backend.aclose()
+            return hits
+
+        hits = asyncio.run(search())
+        assert backend._id_key(hits[0].id) == ids[4]
+        assert all(hit.payload["doc_id"] == "d1" for hit in hits)